@@ -0,0 +1,76 @@
+"""
+Scaling efficiency of the ddp runner on one machine, train a few batches with 1, 2, 4 ... processes
+python benchmark_ddp.py --config configs/dfaust/training/dfaust_w_pf.yaml --world_sizes 1,2,4 --device cpu --threads 2
+"""
+
+import os
+import argparse
+import logging
+import torch
+import torch.multiprocessing as mp
+from init import build_config, setup_seed
+from dataset import get_dataset
+from core.models import get_model
+from core.distributed_solver import DistributedSolver
+
+arg_parser = argparse.ArgumentParser(description="Benchmark DDP")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--world_sizes", dest="world_sizes", default="1,2", help="(str) comma list")
+arg_parser.add_argument("--n_batches", "-n", dest="n_batches", type=int, default=20)
+arg_parser.add_argument("--n_warmup", dest="n_warmup", type=int, default=2)
+arg_parser.add_argument("--device", dest="device", default="auto", help="(str) auto, cuda or cpu")
+arg_parser.add_argument("--backend", dest="backend", default="gloo")
+arg_parser.add_argument("--threads", dest="threads", type=int, default=-1, help="(int) per process")
+arg_parser.add_argument("--port", dest="port", type=int, default=29500)
+
+
+def worker(rank, world_size, args, queue):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(args.port + world_size)
+    os.environ["RANK"], os.environ["LOCAL_RANK"] = str(rank), str(rank)
+    os.environ["WORLD_SIZE"] = str(world_size)
+    logging.getLogger().setLevel(logging.INFO if rank == 0 else logging.WARNING)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    project_root = os.getcwd()
+    cfg = build_config(
+        args.config_fn,
+        project_root,
+        overrides={
+            "resume": False,
+            "modes": ["train"],
+            "training": {"initialize_network_file": []},
+            "distributed": {"backend": args.backend, "device": args.device},
+        },
+    )
+    setup_seed(cfg["rand_seed"])
+
+    datasets_dict = {"train": get_dataset(cfg)(cfg, mode="train")}
+    model = get_model(cfg["model"]["model_name"])(cfg)
+    solver = DistributedSolver(cfg, model, datasets_dict, None)
+    throughput = solver.benchmark(args.n_batches, args.n_warmup)
+    if rank == 0:
+        queue.put(throughput)
+    torch.distributed.destroy_process_group()
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    result = {}
+    for world_size in [int(i) for i in args.world_sizes.split(",")]:
+        queue = mp.get_context("spawn").SimpleQueue()
+        mp.spawn(worker, args=(world_size, args, queue), nprocs=world_size)
+        result[world_size] = queue.get()
+        logging.info("{} processes: {:.2f} samples/s".format(world_size, result[world_size]))
+
+    base_size = min(result.keys())
+    base = result[base_size] / base_size
+    logging.info("processes | samples/s | speedup | efficiency")
+    for world_size, throughput in result.items():
+        logging.info(
+            "{:9d} | {:9.2f} | {:7.2f} | {:10.2f}".format(
+                world_size, throughput, throughput / result[base_size], throughput / (base * world_size)
+            )
+        )
@@ -0,0 +1,97 @@
+"""
+Throughput of the data pipeline alone (no model) over a grid of loader settings, to choose
+dataset.num_workers / prefetch_factor / persistent_workers / worker_affinity for a machine
+python benchmark_loader.py --config configs/dfaust/training/dfaust_w_pf.yaml --num_workers 4,8,16 --prefetch_factor 2,4 -n 50
+"""
+
+import os
+import time
+import itertools
+import argparse
+import logging
+from init import build_config, setup_seed
+from dataset import get_dataset
+from dataset.seeded_sampling import SeededDataset, ResumableSampler
+from dataset.loader_utils import build_dataloader, loader_shuffle
+
+arg_parser = argparse.ArgumentParser(description="Benchmark loader")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--mode", dest="mode", default="train")
+arg_parser.add_argument("--num_workers", dest="num_workers", default="0,4,8", help="(str) comma list")
+arg_parser.add_argument("--prefetch_factor", dest="prefetch_factor", default="2", help="(str) comma list")
+arg_parser.add_argument("--persistent_workers", dest="persistent_workers", default="0,1", help="(str) comma list of 0/1")
+arg_parser.add_argument("--worker_affinity", dest="worker_affinity", default="0", help="(str) comma list of 0/1")
+arg_parser.add_argument("--n_batches", "-n", dest="n_batches", type=int, default=50, help="(int) per epoch")
+arg_parser.add_argument("--epochs", dest="epochs", type=int, default=2)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+
+def int_list(s):
+    return [int(i) for i in s.split(",")]
+
+
+def batch_len(batch):
+    # the loader yields (model_input, meta_info), count the samples by the first tensor of the input
+    for v in batch[0].values():
+        if hasattr(v, "shape"):
+            return v.shape[0]
+    return 0
+
+
+project_root = os.getcwd()
+cfg = build_config(args.config_fn, project_root, overrides={"modes": [args.mode]})
+setup_seed(cfg["rand_seed"])
+dataset = get_dataset(cfg)(cfg, mode=args.mode)
+shuffle = loader_shuffle(cfg, args.mode)
+seeded = "seeded_sampling" in cfg["dataset"].keys() and cfg["dataset"]["seeded_sampling"]
+logging.info("{} {} samples, seeded sampling {}".format(args.mode, len(dataset), seeded))
+
+prefetch_list = int_list(args.prefetch_factor)
+result = []
+for n_workers, prefetch, persistent, affinity in itertools.product(
+    int_list(args.num_workers),
+    prefetch_list,
+    int_list(args.persistent_workers),
+    int_list(args.worker_affinity),
+):
+    if n_workers == 0 and (prefetch != prefetch_list[0] or persistent or affinity):
+        continue  # no effect without workers
+    setting = {
+        "num_workers": n_workers,
+        "num_workers_eval": n_workers,
+        "prefetch_factor": prefetch,
+        "persistent_workers": bool(persistent),
+        "worker_affinity": bool(affinity),
+    }
+    _cfg = build_config(args.config_fn, project_root, overrides={"modes": [args.mode], "dataset": setting})
+    sampler = ResumableSampler(len(dataset), _cfg["rand_seed"], shuffle) if seeded else None
+    loader = build_dataloader(
+        _cfg, args.mode, SeededDataset(dataset, _cfg["rand_seed"]) if seeded else dataset, shuffle, sampler
+    )
+    # the first batch of each epoch includes the worker startup, the rest is the steady state
+    first_batch_s, n_samples, steady_s = [], 0, 0.0
+    for epoch in range(args.epochs):
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        start_t = time.time()
+        for i, batch in enumerate(loader):
+            if i == 0:
+                first_batch_s.append(time.time() - start_t)
+                start_t = time.time()
+            else:
+                n_samples += batch_len(batch)
+            if i >= args.n_batches:
+                break
+        steady_s += time.time() - start_t
+    del loader
+    throughput = n_samples / max(steady_s, 1e-6)
+    result.append((throughput, setting, first_batch_s))
+    logging.info(
+        "{} | {:.1f} samples/s | first batch per epoch {}s".format(
+            setting, throughput, ["{:.2f}".format(t) for t in first_batch_s]
+        )
+    )
+
+best = max(result, key=lambda x: x[0])
+logging.info("Best: {} with {:.1f} samples/s".format(best[1], best[0]))
@@ -0,0 +1,68 @@
+"""
+Per-step overhead of the parameter update (zero_grad, grad clipping, optimizer step) with and without training.fast_optim
+python benchmark_optim.py --config configs/dfaust/training/dfaust_w_pf.yaml -n 100
+"""
+
+import os
+import time
+import copy
+import argparse
+import logging
+import torch
+from init import build_config, setup_seed
+from core.models import get_model
+
+arg_parser = argparse.ArgumentParser(description="Benchmark optimizer step")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--n_steps", "-n", dest="n_steps", type=int, default=100)
+arg_parser.add_argument("--n_warmup", dest="n_warmup", type=int, default=5)
+arg_parser.add_argument(
+    "--grad_clip", dest="grad_clip", type=float, default=1.0, help="(float) <= 0 to skip clipping"
+)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+project_root = os.getcwd()
+cfg = build_config(args.config_fn, project_root, overrides={"training": {"grad_clip": args.grad_clip}})
+
+
+def sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def time_update(fast_optim):
+    _cfg = copy.deepcopy(cfg)
+    _cfg["training"]["fast_optim"] = fast_optim
+    setup_seed(_cfg["rand_seed"])
+    model = get_model(_cfg["model"]["model_name"])(_cfg)
+    model.to_gpus()
+    device = model.device
+    params = [p for p in model.network.parameters() if p.requires_grad]
+    grads = [torch.randn_like(p) for p in params]
+    elapsed = 0.0
+    for step in range(args.n_warmup + args.n_steps):
+        sync(device)
+        start_t = time.time()
+        model.zero_grad()
+        sync(device)
+        elapsed += time.time() - start_t if step >= args.n_warmup else 0.0
+        # the backward is not timed
+        for p, g in zip(params, grads):
+            p.grad = g.clone()
+        sync(device)
+        start_t = time.time()
+        if model.grad_clip > 0:
+            model.clip_grad_norm()
+        model.optimizers_step()
+        sync(device)
+        elapsed += time.time() - start_t if step >= args.n_warmup else 0.0
+    return elapsed / args.n_steps * 1000.0
+
+
+result = {fast_optim: time_update(fast_optim) for fast_optim in [False, True]}
+logging.info(
+    "Update per step: {:.3f}ms before, {:.3f}ms with fast_optim, speedup {:.2f}".format(
+        result[False], result[True], result[False] / result[True]
+    )
+)
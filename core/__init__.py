@@ -1,5 +1,7 @@
 from .solver import Solver
+from .distributed_solver import DistributedSolver
 
 runner_dict = {
     "solver": Solver,
+    "ddp": DistributedSolver,
 }
@@ -0,0 +1,168 @@
+"""
+solve the optimization with one process per device, the gradients are all-reduced by DDP
+each process is launched with the env:// variables (RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR, MASTER_PORT), e.g.
+python -m torch.distributed.launch --use_env --nproc_per_node 4 run.py --config ... -f
+"""
+import os
+import time
+import logging
+import datetime
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+from core.solver import Solver
+from dataset.seeded_sampling import ResumableSampler
+
+
+def get_rank():
+    # valid before the process group is initialized
+    return int(os.environ.get("RANK", 0))
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(cfg):
+    """
+    Initialize the process group from the env, return rank, world size and the device of this process
+    """
+    backend, device, timeout_min = "gloo", "auto", 30
+    if "distributed" in cfg.keys():
+        if "backend" in cfg["distributed"].keys():
+            backend = cfg["distributed"]["backend"]
+        if "device" in cfg["distributed"].keys():
+            device = str(cfg["distributed"]["device"])
+        if "timeout_min" in cfg["distributed"].keys():
+            timeout_min = float(cfg["distributed"]["timeout_min"])
+    if not dist.is_initialized():
+        dist.init_process_group(
+            backend=backend,
+            init_method="env://",
+            timeout=datetime.timedelta(minutes=timeout_min),
+        )
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    local_rank = int(os.environ.get("LOCAL_RANK", rank))
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda":
+        torch.cuda.set_device(local_rank)
+        device = torch.device("cuda", local_rank)
+    else:
+        device = torch.device(device)
+    return rank, world_size, device
+
+
+def all_reduce_metrics(data, keys, device):
+    """
+    Average the scalar metrics over all processes in one all-reduce, a metric missing on some
+    processes is averaged over the ones that have it
+    """
+    values = torch.zeros(2, len(keys), dtype=torch.float64)
+    for i, k in enumerate(keys):
+        v = data[k] if k in data.keys() else None
+        if isinstance(v, torch.Tensor) and v.numel() == 1 or isinstance(v, (float, int, np.number)):
+            values[0, i], values[1, i] = float(v), 1.0
+    values = values.to(device)
+    dist.all_reduce(values)
+    values = values.cpu()
+    for i, k in enumerate(keys):
+        if k in data.keys() and values[1, i] > 0:
+            data[k] = float(values[0, i] / values[1, i])
+    return data
+
+
+class DistributedSolver(Solver):
+    """
+    Solver with DistributedDataParallel, the batch size in the config is the one of each process;
+    the train phase is sharded by a DistributedSampler and its scalar metrics are averaged over
+    the processes, the val / test phases run unsharded on rank 0 so every sample is reported
+    once; only rank 0 logs and saves checkpoints
+    """
+
+    def __init__(self, cfg, model, datasets_dict, logger):
+        self.rank, self.world_size, self.device = init_distributed(cfg)
+        self.find_unused_parameters = False
+        if "distributed" in cfg.keys() and "find_unused_parameters" in cfg["distributed"].keys():
+            self.find_unused_parameters = bool(cfg["distributed"]["find_unused_parameters"])
+        super().__init__(cfg, model, datasets_dict, logger)
+        logging.info(
+            "Rank {}/{} on {} with backend {}".format(
+                self.rank, self.world_size, self.device, dist.get_backend()
+            )
+        )
+
+    def make_sampler(self, mode, dataset, shuffle):
+        if mode != "train":
+            # the padding of a DistributedSampler would count samples twice
+            return super().make_sampler(mode, dataset, shuffle)
+        if self.seeded_sampling:
+            return ResumableSampler(len(dataset), self.seed, shuffle, self.world_size, self.rank)
+        return DistributedSampler(
+            dataset,
+            num_replicas=self.world_size,
+            rank=self.rank,
+            shuffle=shuffle,
+            seed=self.seed,
+        )
+
+    def to_devices(self):
+        self.model.to_ddp(self.device, self.find_unused_parameters)
+
+    def run_phase(self, mode):
+        if mode == "train":
+            return super().run_phase(mode)
+        if self.rank == 0:
+            with self.model.local_network():
+                super().run_phase(mode)
+        # the other processes wait, distributed.timeout_min must cover the evaluation
+        dist.barrier()
+
+    def log_batch(self, batch):
+        # gloo reduces on cpu, nccl on the cuda device
+        if batch["phase"] != "train":
+            self.logger.log_batch(batch)
+            return
+        reduce_device = self.device if dist.get_backend() == "nccl" else torch.device("cpu")
+        all_reduce_metrics(batch["data"], self.model.output_specs["metric"], reduce_device)
+        if self.rank == 0:
+            self.logger.log_batch(batch)
+
+    def log_phase(self):
+        if self.rank == 0:
+            self.logger.log_phase()
+
+    def end_log(self):
+        if self.rank == 0:
+            self.logger.end_log()
+        dist.barrier()
+        dist.destroy_process_group()
+
+    def benchmark(self, n_batches, n_warmup=2):
+        """
+        Train n_batches after n_warmup, return the samples / s of all processes together
+        """
+        loader = self.dataloader_dict["train"]
+        loader.sampler.set_epoch(0)
+        iterator = iter(loader)
+        n_samples = 0
+        for i in range(n_warmup + n_batches):
+            if i == n_warmup:
+                dist.barrier()
+                start_t = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                iterator = iter(loader)
+                batch = next(iterator)
+            batch[0]["epoch"] = 0
+            if i >= n_warmup:
+                n_samples += batch[0]["inputs"].shape[0]
+            self.model.train_batch(batch)
+        dist.barrier()
+        elapsed = time.time() - start_t
+        n_samples, elapsed = torch.Tensor([n_samples]).double(), torch.Tensor([elapsed]).double()
+        dist.all_reduce(n_samples)
+        dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+        return float(n_samples / elapsed)
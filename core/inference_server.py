@@ -0,0 +1,373 @@
+# local reconstruction service: concurrent requests are micro-batched into one encoder forward
+# and one batched mesh extraction on a pool of warm model replicas
+
+import json
+import time
+import socket
+import logging
+import threading
+import collections
+import numpy as np
+import torch
+import trimesh
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from core.models.inference_base import occupancy_function, postprocess_mesh_sequence
+
+OUTPUT_LIST = ["mesh", "correspondence"]
+
+
+class ServerMetrics(object):
+    def __init__(self, window=1000):
+        """
+        Thread safe counters, latency percentiles over the last window requests and throughput
+        """
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counter = collections.Counter()
+        self.latency = collections.deque(maxlen=window)
+        self.batch_size = collections.deque(maxlen=window)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counter[key] += n
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.latency.append(latency)
+
+    def add_batch(self, batch_size, elapsed):
+        with self.lock:
+            self.counter["batches"] += 1
+            self.batch_size.append(batch_size)
+            self.counter["busy (ms)"] += int(elapsed * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.start_time
+            report = dict(self.counter)
+            report["uptime (s)"] = uptime
+            report["throughput (req/s)"] = self.counter["completed"] / max(uptime, 1e-6)
+            if len(self.batch_size) > 0:
+                report["mean batch size"] = float(np.mean(self.batch_size))
+            if len(self.latency) > 0:
+                for p in [50, 95, 99]:
+                    report["latency p{} (ms)".format(p)] = float(np.percentile(self.latency, p) * 1000)
+        return report
+
+
+class ReconstructionRequest(object):
+    def __init__(self, seq_pc, output="mesh", query=None, timeout=60.0):
+        """
+        seq_pc: T,N,3; query: M,3 points in the first frame, only used by correspondence output
+        """
+        assert output in OUTPUT_LIST, "Output {} not support".format(output)
+        self.seq_pc = seq_pc
+        self.output = output
+        self.query = query
+        self.arrival = time.time()
+        self.deadline = self.arrival + timeout
+        self.done = threading.Event()
+        self.result, self.error = None, None
+
+    @property
+    def shape_key(self):
+        # only sequences of the same shape can be stacked into one encoder forward
+        return tuple(self.seq_pc.shape)
+
+    def expired(self):
+        return time.time() > self.deadline
+
+    def finish(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.done.set()
+
+
+class MicroBatcher(object):
+    def __init__(self, max_batch_size=4, max_wait_ms=10.0):
+        """
+        Waits at most max_wait_ms after the oldest request for more requests of the same shape
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def put(self, request):
+        with self.cond:
+            self.queue.append(request)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _drop_expired(self):
+        for request in [r for r in self.queue if r.expired()]:
+            self.queue.remove(request)
+            request.finish(error=TimeoutError("request expired in the queue"))
+
+    def get_batch(self):
+        """
+        Block until a batch is ready, return None once closed
+        """
+        with self.cond:
+            while True:
+                self._drop_expired()
+                if self.closed:
+                    return None
+                if len(self.queue) == 0:
+                    self.cond.wait(timeout=0.1)
+                    continue
+                key = self.queue[0].shape_key
+                n_same = sum([r.shape_key == key for r in self.queue])
+                wait = self.queue[0].arrival + self.max_wait - time.time()
+                if n_same >= self.max_batch_size or wait <= 0:
+                    break
+                self.cond.wait(timeout=wait)
+            batch = [r for r in self.queue if r.shape_key == key][: self.max_batch_size]
+            for request in batch:
+                self.queue.remove(request)
+        return batch
+
+
+class ModelReplica(object):
+    def __init__(self, module, generator, device="cpu"):
+        """
+        An eval-mode inference module (InferenceBase or an export.py artifact) with its generator
+        """
+        self.module = module
+        self.generator = generator
+        self.device = device
+
+    def warm_up(self, seq_len, n_pts=512):
+        seq_pc = torch.rand(1, seq_len, n_pts, 3).to(self.device) - 0.5
+        with torch.no_grad():
+            c_t, _ = self.module.encode(seq_pc)
+            self.module.deform(seq_pc[:, 0], c_t)
+
+    def run_batch(self, request_list):
+        """
+        One encoder forward over the batch, one batched extraction over all mesh requests,
+        one padded deform of all t0 vertices and query points
+        """
+        B = len(request_list)
+        seq_pc = torch.from_numpy(np.stack([r.seq_pc for r in request_list])).to(self.device)
+        with torch.no_grad():
+            c_t, c_g = self.module.encode(seq_pc)  # B,T,C; B,C
+        c_t, c_g = c_t.float(), c_g.float()
+
+        mesh_ids = [bid for bid, r in enumerate(request_list) if r.output == "mesh"]
+        mesh_dict = {}
+        if len(mesh_ids) > 0:
+            c = {
+                "c_t": c_t[mesh_ids],
+                "c_g": c_g[mesh_ids],
+                "query_t": torch.zeros((len(mesh_ids), 1)).to(self.device),
+            }
+            mesh_list = self.generator.generate_batch_from_latent(
+                c=c, F=occupancy_function(self.module), batch_size=len(mesh_ids)
+            )
+            for bid, mesh in zip(mesh_ids, mesh_list):
+                # Safe operation, if no mesh is extracted, replace by a fake one
+                if mesh.vertices.shape[0] == 0:
+                    mesh = trimesh.primitives.Box(extents=(1.0, 1.0, 1.0))
+                    logging.warning("Mesh extraction fail, replace by a place holder")
+                mesh_dict[bid] = mesh
+
+        # the points to deform: t0 mesh vertices, the query or the first observed frame
+        points_list = []
+        for bid, r in enumerate(request_list):
+            if r.output == "mesh":
+                points_list.append(np.asarray(mesh_dict[bid].vertices, dtype=np.float32))
+            elif r.query is not None:
+                points_list.append(r.query)
+            else:
+                points_list.append(r.seq_pc[0])
+        n_max = max([p.shape[0] for p in points_list])
+        points = torch.zeros(B, n_max, 3)
+        for bid, p in enumerate(points_list):
+            points[bid, : p.shape[0]] = torch.from_numpy(p)
+        points = points.to(self.device)
+        with torch.no_grad():
+            deformed = self.module.deform(points, c_t).cpu().numpy()  # B,T,N,3
+            cdc = self.module.canonical(points, c_t).cpu().numpy()  # B,N,3
+
+        result_list = []
+        for bid, r in enumerate(request_list):
+            n = points_list[bid].shape[0]
+            if r.output == "mesh":
+                mesh_t_list, _, _ = postprocess_mesh_sequence(
+                    self.module,
+                    self.generator,
+                    mesh_dict[bid],
+                    deformed[bid, :, :n],
+                    cdc[bid, :n],
+                    c_t[bid],
+                    c_g[bid],
+                )
+                result_list.append(
+                    {
+                        "faces": np.asarray(mesh_t_list[0].faces).tolist(),
+                        "vertices": [np.asarray(m.vertices).tolist() for m in mesh_t_list],
+                    }
+                )
+            else:
+                result_list.append({"correspondence": deformed[bid, :, :n].tolist()})
+        return result_list
+
+
+class InferenceServer(object):
+    def __init__(self, replica_list, seq_len, max_batch_size=4, max_wait_ms=10.0, timeout=60.0):
+        """
+        One worker thread per warm replica, all pulling batches from the same micro-batcher
+        """
+        self.replica_list = replica_list
+        self.seq_len = seq_len
+        self.timeout = timeout
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(max_batch_size, max_wait_ms)
+        self.worker_list = []
+
+    def start(self):
+        for rid, replica in enumerate(self.replica_list):
+            t0 = time.time()
+            replica.warm_up(self.seq_len)
+            logging.info("Replica {} on {} warm in {:.2f}s".format(rid, replica.device, time.time() - t0))
+            worker = threading.Thread(target=self._worker, args=(replica,), daemon=True)
+            worker.start()
+            self.worker_list.append(worker)
+        return self
+
+    def stop(self):
+        self.batcher.close()
+        for worker in self.worker_list:
+            worker.join()
+
+    def _worker(self, replica):
+        while True:
+            batch = self.batcher.get_batch()
+            if batch is None:
+                return
+            t0 = time.time()
+            try:
+                result_list = replica.run_batch(batch)
+            except Exception as e:
+                logging.exception("Batch of {} failed".format(len(batch)))
+                for request in batch:
+                    request.finish(error=e)
+                self.metrics.count("failed", len(batch))
+                continue
+            self.metrics.add_batch(len(batch), time.time() - t0)
+            for request, result in zip(batch, result_list):
+                request.finish(result=result)
+
+    def submit(self, seq_pc, output="mesh", query=None, timeout=None):
+        """
+        Blocking call from a handler thread, return the result dict
+        raise ValueError on bad inputs and TimeoutError when the deadline passes
+        """
+        seq_pc = np.asarray(seq_pc, dtype=np.float32)
+        if seq_pc.ndim != 3 or seq_pc.shape[0] != self.seq_len or seq_pc.shape[2] != 3:
+            raise ValueError("points must be {},N,3, got {}".format(self.seq_len, seq_pc.shape))
+        if query is not None:
+            query = np.asarray(query, dtype=np.float32)
+            if query.ndim != 2 or query.shape[1] != 3:
+                raise ValueError("query must be M,3, got {}".format(query.shape))
+        if output not in OUTPUT_LIST:
+            raise ValueError("output must be one of {}".format(OUTPUT_LIST))
+        timeout = self.timeout if timeout is None else float(timeout)
+        request = ReconstructionRequest(seq_pc, output, query, timeout)
+        self.metrics.count("requests")
+        self.batcher.put(request)
+        # a request already in a running batch is still computed, its result is dropped
+        if not request.done.wait(timeout) or isinstance(request.error, TimeoutError):
+            self.metrics.count("timeout")
+            raise TimeoutError("request not served in {:.1f}s".format(timeout))
+        if request.error is not None:
+            raise request.error
+        self.metrics.count("completed")
+        self.metrics.add_latency(time.time() - request.arrival)
+        return request.result
+
+
+def make_handler(server):
+    class ReconstructionHandler(BaseHTTPRequestHandler):
+        """
+        POST /reconstruct {"points": T,N,3, "output": "mesh"|"correspondence", "query": M,3, "timeout": s}
+        GET /metrics, GET /health
+        """
+
+        def address_string(self):
+            # unix sockets have no client address
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return "unix"
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "replicas": len(server.replica_list)})
+            elif self.path == "/metrics":
+                self._send(200, server.metrics.snapshot())
+            else:
+                self._send(404, {"error": "unknown path {}".format(self.path)})
+
+        def do_POST(self):
+            if self.path != "/reconstruct":
+                self._send(404, {"error": "unknown path {}".format(self.path)})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                result = server.submit(
+                    payload["points"],
+                    output=payload.get("output", "mesh"),
+                    query=payload.get("query", None),
+                    timeout=payload.get("timeout", None),
+                )
+            except (ValueError, KeyError) as e:
+                server.metrics.count("bad requests")
+                self._send(400, {"error": str(e)})
+                return
+            except TimeoutError as e:
+                self._send(504, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, result)
+
+    return ReconstructionHandler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler reads these
+        self.server_name, self.server_port = socket.gethostname(), 0
+
+
+def make_http_server(server, host="127.0.0.1", port=8000, unix_socket=None):
+    handler = make_handler(server)
+    if unix_socket is not None:
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
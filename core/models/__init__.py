@@ -4,3 +4,8 @@ import importlib
 def get_model(name):
     module = importlib.import_module("core.models." + name)
     return module.Model
+
+
+def get_inference(name):
+    module = importlib.import_module("core.models." + name)
+    return module.Inference
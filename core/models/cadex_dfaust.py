@@ -1,4 +1,5 @@
 from .model_base import ModelBase
+from .inference_base import InferenceBase
 import torch
 
 import copy
@@ -11,11 +12,13 @@ from core.net_bank.nice import NICE
 
 import logging
 from .utils.occnet_utils import get_generator
+from .utils.checkpointing import apply_checkpointing
+from .utils.lazy_import import LazyCallable
 from torch import distributions as dist
 import numpy as np
 from copy import deepcopy
 
-from core.models.utils.viz_cdc import viz_cdc
+viz_cdc = LazyCallable("core.models.utils.viz_cdc", "viz_cdc")
 from core.models.utils.oflow_eval.evaluator import MeshEvaluator
 from core.models.utils.oflow_common import eval_oflow_all, eval_iou
 
@@ -35,7 +38,8 @@ class Model(ModelBase):
         self.output_specs = {
             "metric": ["batch_loss", "loss_recon", "loss_corr", "iou", "rec_error"]
             + eval_metric
-            + ["loss_reg_shift_len"],
+            + ["loss_reg_shift_len"]
+            + self.profile_metrics,
             "image": ["mesh_viz_image"],
             "mesh": viz_mesh + ["cdc_mesh"],
             "video": ["flow_video"],
@@ -62,7 +66,9 @@ class Model(ModelBase):
             "c_g": c_g.unsqueeze(0).detach(),
             "query_t": torch.zeros((1, 1)).to(c_t.device),
         }
-        mesh_t0 = self.mesh_extractor.generate_from_latent(c=observation_c, F=net.decode_by_current)
+        mesh_t0 = self.mesh_extractor.generate_from_latent(
+            c=observation_c, F=net.decode_by_current, refine=False
+        )
         # get deformation code
         c_homeo = c_t.unsqueeze(0).transpose(2, 1)  # B,C,T
         # convert t0 mesh to cdc
@@ -77,15 +83,32 @@ class Model(ModelBase):
         # ! clamp all vtx to unit cube
         surface_vtx = torch.clamp(surface_vtx, -1.0, 1.0)
         surface_vtx = surface_vtx.detach().cpu().squeeze(0).numpy()  # T,Pts,3
+        mesh_cdc_vtx = t0_mesh_vtx_cdc_uncompressed if use_uncomp_cdc else t0_mesh_vtx_cdc
+        mesh_cdc_vtx = mesh_cdc_vtx.squeeze(1).squeeze(0).detach().cpu().squeeze(0).numpy()
+        # simplify t0 and replay its edge collapses on all frames and the cdc mesh
+        mesh_t0, simplified_vtx = self.mesh_extractor.simplify_sequence(
+            mesh_t0, np.concatenate([surface_vtx, mesh_cdc_vtx[None]], axis=0)
+        )
+        surface_vtx, mesh_cdc_vtx = simplified_vtx[:-1], simplified_vtx[-1]
+        # refine all frames together, each frame is decoded with its own deformation code
+        seq_c = {
+            "c_t": c_t.unsqueeze(1).detach(),  # T,1,C
+            "c_g": c_g.unsqueeze(0).expand(T, -1).detach(),
+            "query_t": torch.zeros((T, 1)).to(c_t.device),
+        }
+        surface_vtx, vtx_normals = self.mesh_extractor.refine_sequence(
+            surface_vtx, np.array(mesh_t0.faces), seq_c, F=net.decode_by_current
+        )
         # make meshes for each frame
         for t in range(0, T):
             mesh_t = deepcopy(mesh_t0)
             mesh_t.vertices = surface_vtx[t]
             mesh_t.update_vertices(mask=np.array([True] * surface_vtx.shape[0]))
+            if vtx_normals is not None:
+                mesh_t.vertex_normals = vtx_normals[t]
             mesh_t_list.append(mesh_t)
         mesh_cdc = deepcopy(mesh_t0)
-        mesh_cdc_vtx = t0_mesh_vtx_cdc_uncompressed if use_uncomp_cdc else t0_mesh_vtx_cdc
-        mesh_cdc.vertices = mesh_cdc_vtx.squeeze(1).squeeze(0).detach().cpu().squeeze(0).numpy()
+        mesh_cdc.vertices = mesh_cdc_vtx
         mesh_cdc.update_vertices(mask=np.array([True] * surface_vtx.shape[0]))
         return mesh_t_list, surface_vtx, mesh_cdc
 
@@ -243,6 +266,7 @@ class CaDeX_DFAU(torch.nn.Module):
                     sum(param.numel() for param in self.network_dict[k].parameters()), k
                 )
             )
+        apply_checkpointing(self.network_dict, cfg)
 
         # ! Note here we bounded the cdc in a sigmoid cube. Is this necessary?
         self.compress_cdc = cfg["model"]["compress_cdc"]
@@ -301,16 +325,20 @@ class CaDeX_DFAU(torch.nn.Module):
         )
         B, T = seq_t.shape
 
-        # encode Hoemo condition
-        if self.t_perm_inv:
-            c_t = self.network_dict["homeomorphism_encoder"](seq_pc.reshape(B * T, -1, 3))
-            c_t = c_t.reshape(B, T, -1)
+        if "cached_latent" in input_pack.keys():
+            # * the test sample hits the latent cache, skip encoding
+            c_t, c_g = input_pack["cached_latent"]["c_t"], input_pack["cached_latent"]["c_g"]
         else:
-            _, c_t = self.network_dict["homeomorphism_encoder"](seq_pc)  # B,C; B,T,C
+            # encode Hoemo condition
+            if self.t_perm_inv:
+                c_t = self.network_dict["homeomorphism_encoder"](seq_pc.reshape(B * T, -1, 3))
+                c_t = c_t.reshape(B, T, -1)
+            else:
+                _, c_t = self.network_dict["homeomorphism_encoder"](seq_pc)  # B,C; B,T,C
 
-        # tranform observation to CDC and encode canonical geometry
-        inputs_cdc = self.map2canonical(c_t.transpose(2, 1), input_pack["inputs"])  # B,T,N,3
-        c_g = self.network_dict["canonical_geometry_encoder"](inputs_cdc.reshape(B, -1, 3))
+            # tranform observation to CDC and encode canonical geometry
+            inputs_cdc = self.map2canonical(c_t.transpose(2, 1), input_pack["inputs"])  # B,T,N,3
+            c_g = self.network_dict["canonical_geometry_encoder"](inputs_cdc.reshape(B, -1, 3))
 
         # visualize
         if viz_flag:
@@ -411,3 +439,23 @@ class CaDeX_DFAU(torch.nn.Module):
         logits = self.decode_by_cdc(observation_c=c_g, query=cdc).logits
         pr = dist.Bernoulli(logits=logits.squeeze(1))
         return pr
+
+
+class Inference(InferenceBase):
+    def __init__(self, cfg, network=None):
+        network = CaDeX_DFAU(cfg) if network is None else network
+        super().__init__(network, deform_uncompressed=False)
+        self.t_perm_inv = network.t_perm_inv
+
+    def encode_frame(self, seq_pc):
+        B, T, _, _ = seq_pc.shape
+        if self.t_perm_inv:
+            c_t = self.network_dict["homeomorphism_encoder"](seq_pc.reshape(B * T, -1, 3))
+            return c_t.reshape(B, T, -1)
+        return self.network_dict["homeomorphism_encoder"].spatial_encode(seq_pc)
+
+    def encode_dynamics(self, seq_pc, frame_c, seq_t=None):
+        if self.t_perm_inv:
+            return frame_c
+        _, c_t = self.network_dict["homeomorphism_encoder"](seq_pc, frame_c, seq_t)  # B,C; B,T,C
+        return c_t
@@ -1,4 +1,5 @@
 from .model_base import ModelBase
+from .inference_base import InferenceBase
 import torch
 import copy
 import trimesh
@@ -11,11 +12,13 @@ from core.net_bank.cdc_v2_encoder import ATCSetEncoder, Query1D
 
 import logging
 from .utils.occnet_utils import get_generator
+from .utils.checkpointing import apply_checkpointing
+from .utils.lazy_import import LazyCallable
 from torch import distributions as dist
 import numpy as np
 from copy import deepcopy
 
-from core.models.utils.viz_cdc_render import viz_cdc
+viz_cdc = LazyCallable("core.models.utils.viz_cdc_render", "viz_cdc")
 from core.models.utils.oflow_eval.evaluator import MeshEvaluator
 from core.models.utils.oflow_common import eval_atc_all, eval_iou
 
@@ -42,7 +45,8 @@ class Model(ModelBase):
                 "iou_gen",
                 "iou_obs",
             ]
-            + ["loss_reg_shift_len"],
+            + ["loss_reg_shift_len"]
+            + self.profile_metrics,
             "image": ["mesh_viz_image", "query_viz_image"],
             "mesh": viz_mesh + ["cdc_mesh"],
             "video": ["flow_video"],
@@ -60,6 +64,7 @@ class Model(ModelBase):
         self.evaluator = MeshEvaluator(cfg["dataset"]["n_query_sample_eval"])
 
         self.viz_use_T = cfg["dataset"]["input_type"] != "pcl"
+        self.latent_keys = ["c_t", "c_g", "c_t_pred_theta", "theta_hat"]
 
     def generate_mesh(self, c_t, c_g, use_uncomp_cdc=True):
         mesh_t_list = []
@@ -71,7 +76,9 @@ class Model(ModelBase):
             "c_g": c_g.unsqueeze(0).detach(),
             "query_t": torch.zeros((1, 1)).to(c_t.device),
         }
-        mesh_t0 = self.mesh_extractor.generate_from_latent(c=observation_c, F=net.decode_by_current)
+        mesh_t0 = self.mesh_extractor.generate_from_latent(
+            c=observation_c, F=net.decode_by_current, refine=False
+        )
         # Safe operation, if no mesh is extracted, replace by a fake one
         if mesh_t0.vertices.shape[0] == 0:
             mesh_t0 = trimesh.primitives.Box(extents=(1.0, 1.0, 1.0))
@@ -92,15 +99,32 @@ class Model(ModelBase):
         # ! clamp all vtx to unit cube
         surface_vtx = torch.clamp(surface_vtx, -1.0, 1.0)
         surface_vtx = surface_vtx.detach().cpu().numpy()  # T,Pts,3
+        mesh_cdc_vtx = t0_mesh_vtx_cdc_uncompressed if use_uncomp_cdc else t0_mesh_vtx_cdc
+        mesh_cdc_vtx = mesh_cdc_vtx.squeeze(1).squeeze(0).detach().cpu().squeeze(0).numpy()
+        # simplify t0 and replay its edge collapses on all frames and the cdc mesh
+        mesh_t0, simplified_vtx = self.mesh_extractor.simplify_sequence(
+            mesh_t0, np.concatenate([surface_vtx, mesh_cdc_vtx[None]], axis=0)
+        )
+        surface_vtx, mesh_cdc_vtx = simplified_vtx[:-1], simplified_vtx[-1]
+        # refine all frames together, each frame is decoded with its own deformation code
+        seq_c = {
+            "c_t": c_t.unsqueeze(1).detach(),  # T,1,C
+            "c_g": c_g.unsqueeze(0).expand(T, -1).detach(),
+            "query_t": torch.zeros((T, 1)).to(c_t.device),
+        }
+        surface_vtx, vtx_normals = self.mesh_extractor.refine_sequence(
+            surface_vtx, np.array(mesh_t0.faces), seq_c, F=net.decode_by_current
+        )
         # make meshes for each frame
         for t in range(0, T):
             mesh_t = deepcopy(mesh_t0)
             mesh_t.vertices = surface_vtx[t]
             mesh_t.update_vertices(mask=np.array([True] * surface_vtx.shape[0]))
+            if vtx_normals is not None:
+                mesh_t.vertex_normals = vtx_normals[t]
             mesh_t_list.append(mesh_t)
         mesh_cdc = deepcopy(mesh_t0)
-        mesh_cdc_vtx = t0_mesh_vtx_cdc_uncompressed if use_uncomp_cdc else t0_mesh_vtx_cdc
-        mesh_cdc.vertices = mesh_cdc_vtx.squeeze(1).squeeze(0).detach().cpu().squeeze(0).numpy()
+        mesh_cdc.vertices = mesh_cdc_vtx
         mesh_cdc.update_vertices(mask=np.array([True] * surface_vtx.shape[0]))
         return mesh_t_list, surface_vtx, mesh_cdc
 
@@ -376,6 +400,7 @@ class CaDeX_S2M(torch.nn.Module):
                     sum(param.numel() for param in self.network_dict[k].parameters()), k
                 )
             )
+        apply_checkpointing(self.network_dict, cfg)
 
         self.compress_cdc = cfg["model"]["compress_cdc"]
 
@@ -438,13 +463,18 @@ class CaDeX_S2M(torch.nn.Module):
         B, T_all, _ = input_pack["theta"].shape
         T_in = self.input_num
 
-        # encode Hoemo condition
-        c_global, theta_hat = self.network_dict["homeomorphism_encoder"](set_pc)
-        c_t = self.network_dict["ci_decoder"](c_global, theta_gt)  # B,T,C
+        cached = input_pack["cached_latent"] if "cached_latent" in input_pack.keys() else None
+        if cached is not None:
+            # * the test sample hits the latent cache, skip encoding
+            c_t, c_g = cached["c_t"], cached["c_g"]
+        else:
+            # encode Hoemo condition
+            c_global, theta_hat = self.network_dict["homeomorphism_encoder"](set_pc)
+            c_t = self.network_dict["ci_decoder"](c_global, theta_gt)  # B,T,C
 
-        # tranform observation to CDC and encode canonical geometry
-        inputs_cdc = self.map2canonical(c_t.transpose(2, 1), input_pack["inputs"])  # B,T,N,3
-        c_g = self.network_dict["canonical_geometry_encoder"](inputs_cdc.reshape(B, -1, 3))
+            # tranform observation to CDC and encode canonical geometry
+            inputs_cdc = self.map2canonical(c_t.transpose(2, 1), input_pack["inputs"])  # B,T,N,3
+            c_g = self.network_dict["canonical_geometry_encoder"](inputs_cdc.reshape(B, -1, 3))
 
         # visualize
         if viz_flag:
@@ -461,7 +491,10 @@ class CaDeX_S2M(torch.nn.Module):
             output["c_t"] = c_t.detach()
             output["c_g"] = c_g.detach()
             # also test with pred theta
-            c_t_pred_theta = self.network_dict["ci_decoder"](c_global, theta_hat)
+            if cached is not None:
+                c_t_pred_theta, theta_hat = cached["c_t_pred_theta"], cached["theta_hat"]
+            else:
+                c_t_pred_theta = self.network_dict["ci_decoder"](c_global, theta_hat)
             output["c_t_pred_theta"] = c_t_pred_theta.detach()
             output["theta_hat"] = theta_hat.detach()
             output["theta_gt"] = input_pack["theta"][:, : self.input_num]
@@ -562,3 +595,34 @@ class CaDeX_S2M(torch.nn.Module):
         logits = self.decode_by_cdc(observation_c=c_g, query=cdc).logits
         pr = dist.Bernoulli(logits=logits.squeeze(1))
         return pr
+
+
+class Inference(InferenceBase):
+    def __init__(self, cfg, network=None):
+        network = CaDeX_S2M(cfg) if network is None else network
+        super().__init__(network, deform_uncompressed=True)
+
+    def encode(self, seq_pc):
+        # the observed set is articulated by the predicted theta
+        c_global, theta_hat = self.network_dict["homeomorphism_encoder"](seq_pc)
+        c_t = self.network_dict["ci_decoder"](c_global, theta_hat)  # B,T,C
+        c_g = self.encode_canonical_geometry(c_t, seq_pc)
+        return c_t, c_g
+
+    def encode_with_theta(self, seq_pc, theta):
+        """
+        seq_pc: B,T_in,N,3 observed set; theta: B,T,ATC articulations to generate, the first T_in
+        are the observed ones; return c_t: B,T,C and c_g: B,C
+        """
+        c_global, _ = self.network_dict["homeomorphism_encoder"](seq_pc)
+        c_t = self.network_dict["ci_decoder"](c_global, theta)  # B,T,C
+        c_g = self.encode_canonical_geometry(c_t[:, : seq_pc.shape[1]], seq_pc)
+        return c_t, c_g
+
+    def example_inputs(self, seq_len, n_pts=512, n_query=2048, batch_size=2):
+        inputs = super().example_inputs(seq_len, n_pts, n_query, batch_size)
+        seq_pc = inputs["encode"][0]
+        with torch.no_grad():
+            _, theta_hat = self.network_dict["homeomorphism_encoder"](seq_pc)
+        inputs["encode_with_theta"] = (seq_pc, theta_hat)
+        return inputs
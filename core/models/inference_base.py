@@ -0,0 +1,348 @@
+import torch
+import logging
+import json
+import trimesh
+import numpy as np
+from collections import deque
+from torch import distributions as dist
+
+
+class InferenceBase(torch.nn.Module):
+    def __init__(self, network, deform_uncompressed=True):
+        """
+        Inference Base
+        A pure tensor-in / tensor-out view of a trained CaDeX network: no phase, viz_flag or cfg
+        lookup inside the methods, so the module can be traced, scripted or compiled.
+        The network_dict is shared with the training network, so the state dict keys are the same
+        as the ones in the training checkpoints.
+        """
+        super().__init__()
+        self.network_dict = network.network_dict
+        self.compress_cdc = bool(network.compress_cdc)
+        # DFAU maps the compressed cdc back to the frames, DT4D and S2M use the uncompressed one
+        self.deform_uncompressed = deform_uncompressed
+
+    @staticmethod
+    def logit(x):
+        return -torch.log((1 / x) - 1)
+
+    def map2canonical(self, code, query):
+        # code: B,C,T, query: B,T,N,3; return compressed and uncompressed cdc B,T,N,3
+        coordinates = self.network_dict["homeomorphism_decoder"].forward(
+            code.transpose(2, 1), query.transpose(2, 1)
+        )
+        if self.compress_cdc:
+            out = torch.sigmoid(coordinates) - 0.5
+        else:
+            out = coordinates
+        return out.transpose(2, 1), coordinates.transpose(2, 1)
+
+    def map2current(self, code, query, compressed=True):
+        # code: B,C,T, query: B,T,N,3
+        coordinates = self.logit(query + 0.5) if (self.compress_cdc and compressed) else query
+        coordinates, _ = self.network_dict["homeomorphism_decoder"].inverse(
+            code.transpose(2, 1), coordinates.transpose(2, 1)
+        )
+        return coordinates.transpose(2, 1)  # B,T,N,3
+
+    def encode(self, seq_pc):
+        """
+        seq_pc: B,T,N,3 observation sequence; return c_t: B,T,C and c_g: B,C
+        """
+        c_t = self.encode_dynamics(seq_pc, self.encode_frame(seq_pc))
+        c_g = self.encode_canonical_geometry(c_t, seq_pc)
+        return c_t, c_g
+
+    def encode_frame(self, seq_pc):
+        """
+        seq_pc: B,T,N,3; return the per frame features B,T,C, computed for each frame on its own so
+        that a stream can cache them, None if the encoder has no per frame part
+        """
+        return None
+
+    def encode_dynamics(self, seq_pc, frame_c, seq_t=None):
+        """
+        seq_pc: B,T,N,3; frame_c: B,T,C from encode_frame; seq_t: B,T time stamps, default evenly
+        spaced in [0, 1]; return c_t: B,T,C
+        """
+        raise NotImplementedError
+
+    def encode_canonical_geometry(self, c_t, seq_pc):
+        B = seq_pc.shape[0]
+        inputs_cdc, _ = self.map2canonical(c_t.transpose(2, 1), seq_pc)  # B,T,N,3
+        return self.network_dict["canonical_geometry_encoder"](inputs_cdc.reshape(B, -1, 3))
+
+    def occupancy(self, query, t, c_t, c_g):
+        """
+        query: B,N,3 in the frame at normalized time t: B; return occupancy logits B,N
+        """
+        B, N, _ = query.shape
+        idx = (t * (c_t.shape[1] - 1)).long()  # B
+        c_homeomorphism = torch.gather(
+            c_t, dim=1, index=idx.reshape(B, 1, 1).expand(-1, -1, c_t.shape[-1])
+        ).transpose(
+            2, 1
+        )  # B,C,1
+        cdc, _ = self.map2canonical(c_homeomorphism, query.unsqueeze(1))  # B,1,N,3
+        logits = self.network_dict["canonical_geometry_decoder"](
+            cdc.reshape(B, -1, 3), None, c_g
+        ).reshape(B, N)
+        return logits
+
+    def deform(self, points, c_t):
+        """
+        points: B,N,3 in the first frame; return their positions in every frame B,T,N,3
+        """
+        return self.deform_canonical(self.canonical_source(points, c_t), c_t)
+
+    def canonical(self, points, c_t):
+        """
+        points: B,N,3 in the first frame; return the uncompressed cdc coordinates B,N,3
+        """
+        _, cdc_uncompressed = self.map2canonical(c_t[:, :1].transpose(2, 1), points.unsqueeze(1))
+        return cdc_uncompressed.squeeze(1)
+
+    def canonical_source(self, points, c_t):
+        """
+        points: B,N,3 in the first frame; return the cdc coordinates deform starts from B,N,3
+        """
+        cdc, cdc_uncompressed = self.map2canonical(c_t[:, :1].transpose(2, 1), points.unsqueeze(1))
+        if self.deform_uncompressed:
+            return cdc_uncompressed.squeeze(1)
+        return cdc.squeeze(1)
+
+    def deform_canonical(self, source, c_t):
+        """
+        source: B,N,3 from canonical_source; return its positions in every frame of c_t B,T,N,3
+        """
+        T = c_t.shape[1]
+        source = source.unsqueeze(1).expand(-1, T, -1, -1)
+        surface = self.map2current(
+            c_t.transpose(2, 1), source, compressed=not self.deform_uncompressed
+        )
+        # ! clamp all vtx to unit cube
+        return torch.clamp(surface, -1.0, 1.0)
+
+    def forward(self, query, t, c_t, c_g):
+        return self.occupancy(query, t, c_t, c_g)
+
+    def load_checkpoint(self, filename, map_location="cpu"):
+        checkpoint = torch.load(filename, map_location=map_location)
+        if checkpoint.get("folded_norms", False):
+            # a fold_checkpoint.py output, make the same folded structure before loading
+            from core.models.utils.fold_norm import fold_norms
+
+            fold_norms(self.eval())
+        state_dict = {}
+        for k, v in checkpoint["model_state_dict"].items():
+            name = ".".join(k.split(".")[1:]) if k.startswith("module.") else k
+            state_dict[name] = v
+        self.load_state_dict(state_dict, strict=True)
+        if "epoch" in checkpoint.keys():
+            logging.info("Inference module load from ep {}".format(checkpoint["epoch"]))
+        return self
+
+    def example_inputs(self, seq_len, n_pts=512, n_query=2048, batch_size=2):
+        """
+        Random inputs used to trace every exported method
+        """
+        device = next(self.parameters()).device
+        seq_pc = torch.rand(batch_size, seq_len, n_pts, 3).to(device) - 0.5
+        with torch.no_grad():
+            c_t, c_g = self.encode(seq_pc)
+        query = torch.rand(batch_size, n_query, 3).to(device) - 0.5
+        t = torch.zeros(batch_size).to(device)
+        return {
+            "encode": (seq_pc,),
+            "occupancy": (query, t, c_t, c_g),
+            "deform": (query, c_t),
+            "canonical": (query, c_t),
+        }
+
+
+def get_seq_len(cfg):
+    """
+    Number of observed frames the encoder takes
+    """
+    if "input_num" in cfg["dataset"].keys():
+        return cfg["dataset"]["input_num"]
+    try:
+        return cfg["dataset"]["oflow_config"]["length_sequence"]
+    except:
+        return cfg["dataset"]["seq_len"]
+
+
+def export_inference(module, example_inputs, filename, meta_info=None):
+    """
+    Trace every method in example_inputs and save a self-contained TorchScript artifact,
+    workers load it with torch.jit.load(filename) without the training codebase.
+    """
+    module.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace_module(module, example_inputs, check_trace=False)
+    extra_files = {"meta_info.json": json.dumps(meta_info if meta_info is not None else {})}
+    torch.jit.save(traced, filename, _extra_files=extra_files)
+    logging.info("Export inference module [{}] to {}".format(list(example_inputs.keys()), filename))
+    return traced
+
+
+def load_inference(filename, map_location="cpu"):
+    extra_files = {"meta_info.json": ""}
+    module = torch.jit.load(filename, map_location=map_location, _extra_files=extra_files)
+    module.eval()
+    return module, json.loads(extra_files["meta_info.json"] or "{}")
+
+
+def occupancy_function(module):
+    """
+    The implicit function of the mesh extractor, c holds the batched c_t, c_g and query_t
+    """
+
+    def implicit_F(query, z_none, c):
+        return dist.Bernoulli(
+            logits=module.occupancy(query, c["query_t"].reshape(-1), c["c_t"], c["c_g"])
+        )
+
+    return implicit_F
+
+
+def generate_mesh_sequence(module, mesh_extractor, c_t, c_g):
+    """
+    Extract the t0 mesh of one sample and deform it to all frames, works with both an
+    InferenceBase and its exported TorchScript module
+    c_t: T,C; c_g: C; return the per frame meshes, the T,V,3 surface vertices and the cdc mesh
+    """
+    c_t, c_g = c_t.unsqueeze(0).detach(), c_g.unsqueeze(0).detach()
+    implicit_F = occupancy_function(module)
+    observation_c = {"c_t": c_t, "c_g": c_g, "query_t": torch.zeros((1, 1)).to(c_t.device)}
+    mesh_t0 = mesh_extractor.generate_from_latent(c=observation_c, F=implicit_F, refine=False)
+    # Safe operation, if no mesh is extracted, replace by a fake one
+    if mesh_t0.vertices.shape[0] == 0:
+        mesh_t0 = trimesh.primitives.Box(extents=(1.0, 1.0, 1.0))
+        logging.warning("Mesh extraction fail, replace by a place holder")
+    t0_mesh_vtx = torch.Tensor(np.array(mesh_t0.vertices)).to(c_t.device).unsqueeze(0)  # 1,V,3
+    with torch.no_grad():
+        surface_vtx = module.deform(t0_mesh_vtx, c_t).squeeze(0).cpu().numpy()  # T,V,3
+        cdc_vtx = module.canonical(t0_mesh_vtx, c_t).squeeze(0).cpu().numpy()  # V,3
+    return postprocess_mesh_sequence(
+        module, mesh_extractor, mesh_t0, surface_vtx, cdc_vtx, c_t[0], c_g[0]
+    )
+
+
+def postprocess_mesh_sequence(module, mesh_extractor, mesh_t0, surface_vtx, cdc_vtx, c_t, c_g):
+    """
+    Simplify and refine the deformed t0 mesh as configured in the mesh extractor and make the
+    per frame meshes; surface_vtx: T,V,3; cdc_vtx: V,3; c_t: T,C; c_g: C
+    """
+    # simplify t0 and replay its edge collapses on all frames and the cdc mesh
+    mesh_t0, simplified_vtx = mesh_extractor.simplify_sequence(
+        mesh_t0, np.concatenate([surface_vtx, cdc_vtx[None]], axis=0)
+    )
+    faces = np.array(mesh_t0.faces)
+    surface_vtx, cdc_vtx = simplified_vtx[:-1], simplified_vtx[-1]
+    # refine all frames together, each frame is decoded with its own deformation code
+    T = surface_vtx.shape[0]
+    seq_c = {
+        "c_t": c_t.unsqueeze(1).detach(),  # T,1,C
+        "c_g": c_g.unsqueeze(0).expand(T, -1).detach(),
+        "query_t": torch.zeros((T, 1)).to(c_t.device),
+    }
+    surface_vtx, vtx_normals = mesh_extractor.refine_sequence(
+        surface_vtx, faces, seq_c, F=occupancy_function(module)
+    )
+    mesh_t_list = [
+        trimesh.Trimesh(
+            vertices=surface_vtx[t],
+            faces=faces,
+            vertex_normals=None if vtx_normals is None else vtx_normals[t],
+            process=False,
+        )
+        for t in range(T)
+    ]
+    mesh_cdc = trimesh.Trimesh(vertices=cdc_vtx, faces=faces, process=False)
+    return mesh_t_list, surface_vtx, mesh_cdc
+
+
+class StreamingSequence(object):
+    def __init__(self, module, mesh_extractor, window):
+        """
+        Online reconstruction of a live sequence, one frame is pushed at a time.
+        The per frame encoder features of the last window frames are cached, so each push only
+        encodes the new frame and re-runs the cheap temporal part over the window; the cost is
+        constant in the stream length. The window stamps its frames with the time of the slot they
+        are in, as the training sequences of window frames.
+        Once the first window is full, its t0 mesh is extracted and mapped to the canonical space,
+        every later frame deforms this reference mesh with its own c_t.
+        """
+        self.module = module
+        self.mesh_extractor = mesh_extractor
+        self.window = window
+        self.frame_list = deque(maxlen=window)
+        self.frame_c_list = deque(maxlen=window)
+        self.n_pushed = 0
+        self.reference_faces, self.reference_source = None, None
+
+    @property
+    def device(self):
+        return next(self.module.parameters()).device
+
+    def push(self, frame_pc):
+        """
+        frame_pc: N,3 observation of the new frame; return its c_t: C and its mesh, the mesh is
+        None until the first window is full (both for an encoder without per frame features)
+        """
+        frame = torch.as_tensor(np.asarray(frame_pc), dtype=torch.float32).to(self.device)
+        frame = frame[None, None]  # 1,1,N,3
+        with torch.no_grad():
+            frame_c = self.module.encode_frame(frame)
+        self.frame_list.append(frame)
+        self.frame_c_list.append(frame_c)
+        self.n_pushed += 1
+
+        seq_pc = torch.cat(list(self.frame_list), dim=1)  # 1,K,N,3
+        n_frames = seq_pc.shape[1]
+        if frame_c is None and n_frames < self.window:
+            # an encoder without per frame part (traj) only takes full windows
+            return None, None
+        seq_t = torch.arange(n_frames, dtype=torch.float32) / max(self.window - 1, 1)
+        seq_t = seq_t.to(self.device).unsqueeze(0)
+        with torch.no_grad():
+            c_t = self.module.encode_dynamics(
+                seq_pc, None if frame_c is None else torch.cat(list(self.frame_c_list), dim=1), seq_t
+            )  # 1,K,C
+        if self.reference_source is None and n_frames == self.window:
+            self.build_reference(seq_pc, c_t)
+        mesh = None
+        if self.reference_source is not None:
+            with torch.no_grad():
+                vtx = self.module.deform_canonical(self.reference_source, c_t[:, -1:])
+            mesh = trimesh.Trimesh(
+                vertices=vtx[0, 0].cpu().numpy(), faces=self.reference_faces, process=False
+            )
+        return c_t[0, -1], mesh
+
+    def build_reference(self, seq_pc, c_t):
+        with torch.no_grad():
+            c_g = self.module.encode_canonical_geometry(c_t, seq_pc)
+        mesh_t_list, _, _ = generate_mesh_sequence(self.module, self.mesh_extractor, c_t[0], c_g[0])
+        vtx = torch.as_tensor(np.array(mesh_t_list[0].vertices), dtype=torch.float32)
+        with torch.no_grad():
+            self.reference_source = self.module.canonical_source(vtx.to(self.device)[None], c_t)
+        self.reference_faces = np.array(mesh_t_list[0].faces)
+        logging.info(
+            "Stream reference mesh with {} vertices from frames {}-{}".format(
+                vtx.shape[0], self.n_pushed - self.window, self.n_pushed - 1
+            )
+        )
+
+
+def compile_inference(module):
+    """
+    torch.compile every exported method if the installed torch supports it
+    """
+    if not hasattr(torch, "compile"):
+        logging.warning("torch.compile not available in torch {}, skip".format(torch.__version__))
+        return module
+    for name in ["encode", "occupancy", "deform", "canonical"]:
+        setattr(module, name, torch.compile(getattr(module, name)))
+    return module
@@ -1,8 +1,14 @@
 import torch.nn as nn
 import torch
 import copy
+import time
+import contextlib
+import resource
 import logging
 import numpy as np
+from .utils.latent_cache import LatentCache
+from .utils.precision import train_autocast, TRAIN_AMP_LIST, get_precision, assert_module_precision
+from .utils.fast_optim import make_adam, clip_grad_norm_fused
 
 
 class ModelBase(object):
@@ -14,19 +20,62 @@ class ModelBase(object):
         self.__dataparallel_flag__ = False
         self.network = network
         self.optimizer_specs = self.cfg["training"]["optim"]
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # one optimizer with a param group per optim key, foreach / fused update, grads set to None
+        self.fast_optim = False
+        if "fast_optim" in cfg["training"].keys():
+            self.fast_optim = bool(cfg["training"]["fast_optim"])
         self.optimizer_dict = self._register_optimizer()
+        self._clip_params = None
+        # step time and peak memory train metrics, added to the metric specs of each model
+        self.step_profile = False
+        if "step_profile" in cfg["training"].keys():
+            self.step_profile = bool(cfg["training"]["step_profile"])
+        self.profile_metrics = []
+        if self.step_profile:
+            self.profile_metrics = ["step_time", "peak_memory_mb", "max_rss_mb"]
         # self.to_gpus()
         self.output_specs = {
-            "metric": [],
+            "metric": list(self.profile_metrics),
         }
         self.grad_clip = float(cfg["training"]["grad_clip"])
         self.loss_clip = float(cfg["training"]["loss_clip"])
+        # mixed precision and gradient accumulation over micro-batches of each loader batch
+        self.amp = "none"
+        if "amp" in cfg["training"].keys():
+            self.amp = str(cfg["training"]["amp"]).lower()
+        assert self.amp in TRAIN_AMP_LIST, "AMP {} not support".format(self.amp)
+        assert_module_precision(get_precision(cfg), "the training runner")
+        self.accumulation_steps = 1
+        if "accumulation_steps" in cfg["training"].keys():
+            self.accumulation_steps = max(int(cfg["training"]["accumulation_steps"]), 1)
+        # only fp16 needs loss scaling, bf16 has the fp32 exponent range
+        self.grad_scaler = torch.cuda.amp.GradScaler(
+            enabled=self.amp == "fp16" and self.device.type == "cuda"
+        )
+        if self.amp != "none" or self.accumulation_steps > 1:
+            logging.info(
+                "Train with amp={} over {} micro-batches per batch".format(
+                    self.amp, self.accumulation_steps
+                )
+            )
+        # network outputs of the test phase that are cached on disk, set by each model
+        self.latent_keys = ["c_t", "c_g"]
+        self.latent_cache = None
         return
 
+    def set_latent_cache(self, checkpoint_hash):
+        cache_root = "./resource/latent_cache"
+        if "latent_cache_dir" in self.cfg["evaluation"].keys():
+            cache_root = self.cfg["evaluation"]["latent_cache_dir"]
+        self.latent_cache = LatentCache(cache_root, checkpoint_hash, self.latent_keys)
+
     def _register_optimizer(self):
         optimizer_dict = {}
         parameter_keys = self.optimizer_specs.keys()
         logging.debug("Config defines {} network parameters optimization".format(parameter_keys))
+        if self.fast_optim:
+            return self._register_fused_optimizer()
         # if len(parameter_keys) != len(self.network.network_dict.keys()):
         #     logging.warning("Network Components != Optimizer Config")
         if "all" in parameter_keys:
@@ -49,6 +98,42 @@ class ModelBase(object):
                     )
         return optimizer_dict
 
+    def _register_fused_optimizer(self):
+        """
+        One Adam, the param groups are named by the optim keys of the config
+        """
+        if "all" in self.optimizer_specs.keys():
+            keys, modules = ["all"], [self.network]
+        else:
+            keys = list(self.optimizer_specs.keys())
+            modules = [self.network.network_dict[key] for key in keys]
+        param_groups = [
+            {"params": list(m.parameters()), "lr": self.optimizer_specs[k]["lr"], "name": k}
+            for k, m in zip(keys, modules)
+        ]
+        if len(param_groups) == 0:
+            return {}
+        # the fused kernel needs the params on the device at construction
+        self.network.to(self.device)
+        optimizer, impl = make_adam(param_groups, self.device)
+        logging.info("Fast optim: one {} Adam with groups {}".format(impl, keys))
+        return {"fused": optimizer}
+
+    def get_param_groups(self, key):
+        """
+        The param groups of an optim key of the config, for the lr schedule
+        """
+        if self.fast_optim:
+            return [g for g in self.optimizer_dict["fused"].param_groups if g["name"] == key]
+        return self.optimizer_dict[key].param_groups
+
+    def clip_grad_norm(self):
+        if not self.fast_optim:
+            return torch.nn.utils.clip_grad_norm_(self.network.parameters(), self.grad_clip)
+        if self._clip_params is None:
+            self._clip_params = list(self.network.parameters())
+        return clip_grad_norm_fused(self._clip_params, self.grad_clip)
+
     def count_parameters(self):
         net = (
             self.network.module.network_dict
@@ -66,7 +151,7 @@ class ModelBase(object):
         data, meta_info = batch
         for k in data.keys():
             if isinstance(data[k], torch.Tensor):
-                data[k] = data[k].cuda().float()
+                data[k] = data[k].to(self.device).float()
         data["phase"] = meta_info["mode"][0]
         data["viz_flag"] = viz_flag
         batch = {"model_input": data, "meta_info": meta_info}
@@ -76,7 +161,16 @@ class ModelBase(object):
         """
         forward through the network
         """
+        use_cache = self.latent_cache is not None and batch["model_input"]["phase"].startswith(
+            "test"
+        )
+        if use_cache:  # on a cache hit, the network skips encoding
+            cached = self.latent_cache.load_batch(batch["meta_info"]["viz_id"])
+            if cached is not None:
+                batch["model_input"]["cached_latent"] = {k: v.to(self.device) for k, v in cached.items()}
         model_out = self.network(batch["model_input"], viz_flag)
+        if use_cache and "cached_latent" not in batch["model_input"].keys():
+            self.latent_cache.save_batch(batch["meta_info"]["viz_id"], model_out)
         for k, v in model_out.items():
             batch[k] = v  # directly place all output to batch dict
         return batch
@@ -110,29 +204,131 @@ class ModelBase(object):
         return batch
 
     def train_batch(self, batch, viz_flag=False):
+        start_t = self._start_step_profile()
         batch = self._preprocess(batch, viz_flag)
         self.set_train()
         self.zero_grad()
-        batch = self._predict(batch, viz_flag)
-        batch = self._postprocess(batch)
-        if self.loss_clip > 0.0:
-            if abs(batch["batch_loss"]) > self.loss_clip:
-                logging.warning(
-                    f"Loss Clipped from {abs(batch['batch_loss'])} to {self.loss_clip}"
-                )
-            batch["batch_loss"] = torch.clamp(batch["batch_loss"], -self.loss_clip, self.loss_clip)
-        batch["batch_loss"].backward()
+        micro_batch_list = self._split_micro_batches(batch)
+        batch_size = sum([w for w, _ in micro_batch_list])
+        output_list = []
+        for i, (weight, micro_batch) in enumerate(micro_batch_list):
+            is_last = i == len(micro_batch_list) - 1
+            with self._grad_sync(is_last), train_autocast(self.amp, self.device.type):
+                micro_batch = self._predict(micro_batch, viz_flag)
+                micro_batch = self._postprocess(micro_batch)
+            loss = micro_batch["batch_loss"].float()
+            if self.loss_clip > 0.0:
+                if abs(loss) > self.loss_clip:
+                    logging.warning(f"Loss Clipped from {abs(loss)} to {self.loss_clip}")
+                loss = torch.clamp(loss, -self.loss_clip, self.loss_clip)
+            micro_batch["batch_loss"] = loss
+            # the accumulated gradient is the one of the mean loss over the whole batch
+            with self._grad_sync(is_last):
+                self.grad_scaler.scale(loss * (weight / batch_size)).backward()
+            output_list.append((weight, self._detach_before_return(micro_batch)))
+        batch = self._merge_micro_batches(batch, output_list)
         if self.grad_clip > 0:
-            grad_norm = torch.nn.utils.clip_grad_norm_(self.network.parameters(), self.grad_clip)
+            for optimizer in self.optimizer_dict.values():
+                self.grad_scaler.unscale_(optimizer)
+            grad_norm = self.clip_grad_norm()
             if grad_norm > self.grad_clip:
                 logging.info(
                     "Warning! Clip gradient from {} to {}".format(grad_norm, self.grad_clip)
                 )
         self.optimizers_step()
+        batch = self._end_step_profile(batch, start_t)
         batch = self._postprocess_after_optim(batch)
         batch = self._detach_before_return(batch)
         return batch
 
+    def _grad_sync(self, is_last):
+        # under DDP only the backward of the last micro batch all-reduces the gradients
+        if not is_last and isinstance(self.network, nn.parallel.DistributedDataParallel):
+            return self.network.no_sync()
+        return contextlib.suppress()
+
+    def _start_step_profile(self):
+        if not self.step_profile:
+            return None
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        return time.time()
+
+    def _end_step_profile(self, batch, start_t):
+        """
+        Step time and the peak memory of the step (cuda allocator) as train metrics, on cpu the
+        max rss of the whole process instead
+        """
+        if not self.step_profile:
+            return batch
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+            batch["peak_memory_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+        else:
+            batch["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+        batch["step_time"] = time.time() - start_t
+        return batch
+
+    def _split_micro_batches(self, batch):
+        """
+        Split the model input along the batch dim into accumulation_steps parts,
+        return a list of (size, micro batch)
+        """
+        B = batch["model_input"]["inputs"].shape[0]
+        K = min(self.accumulation_steps, B)
+        if K <= 1:
+            return [(B, batch)]
+        bounds = np.linspace(0, B, K + 1).astype(int)
+
+        def _slice(d, i0, i1):
+            out = {}
+            for k, v in d.items():
+                if isinstance(v, torch.Tensor) and v.dim() > 0 and v.shape[0] == B:
+                    out[k] = v[i0:i1]
+                elif isinstance(v, (list, tuple)) and len(v) == B:
+                    out[k] = v[i0:i1]
+                else:
+                    out[k] = v
+            return out
+
+        return [
+            (
+                int(i1 - i0),
+                {
+                    "model_input": _slice(batch["model_input"], i0, i1),
+                    "meta_info": _slice(batch["meta_info"], i0, i1),
+                },
+            )
+            for i0, i1 in zip(bounds[:-1], bounds[1:])
+        ]
+
+    def _merge_micro_batches(self, batch, output_list):
+        """
+        Merge the outputs of the micro batches: per sample tensors are concatenated, scalars are
+        averaged by the micro batch sizes, everything else is taken from the last one
+        """
+        if len(output_list) == 1:
+            return output_list[0][1]
+        batch_size = sum([w for w, _ in output_list])
+        for k in output_list[0][1].keys():
+            if k in ["model_input", "meta_info"]:
+                continue
+            v_list = [o[k] for _, o in output_list if k in o.keys()]
+            if len(v_list) != len(output_list):
+                batch[k] = v_list[-1]
+            elif all([isinstance(v, torch.Tensor) and v.dim() == 0 for v in v_list]):
+                batch[k] = sum([w * v.float() for (w, _), v in zip(output_list, v_list)]) / batch_size
+            elif all(
+                [
+                    isinstance(v, torch.Tensor) and v.dim() > 0 and v.shape[0] == w
+                    for (w, _), v in zip(output_list, v_list)
+                ]
+            ):
+                batch[k] = torch.cat(v_list, dim=0)
+            else:
+                batch[k] = v_list[-1]
+        return batch
+
     def val_batch(self, batch, viz_flag=False):
         batch = self._preprocess(batch, viz_flag)
         self.set_eval()
@@ -149,7 +345,7 @@ class ModelBase(object):
             for k in batch.keys():
                 if k.endswith("loss") or k in self.output_specs["metric"]:
                     if isinstance(batch[k], list):
-                        for idx in len(batch[k]):
+                        for idx in range(len(batch[k])):
                             batch[k][idx] = batch[k][idx].mean()
                     else:
                         batch[k] = batch[k].mean()
@@ -157,11 +353,16 @@ class ModelBase(object):
 
     def zero_grad(self):
         for k in self.optimizer_dict.keys():
-            self.optimizer_dict[k].zero_grad()
+            if self.fast_optim:
+                # free the grads instead of writing zeros
+                self.optimizer_dict[k].zero_grad(set_to_none=True)
+            else:
+                self.optimizer_dict[k].zero_grad()
 
     def optimizers_step(self):
         for k in self.optimizer_dict.keys():
-            self.optimizer_dict[k].step()
+            self.grad_scaler.step(self.optimizer_dict[k])
+        self.grad_scaler.update()
 
     def model_resume(self, checkpoint, is_initialization, network_name=None):
         # reprocess to fit the old version
@@ -177,12 +378,18 @@ class ModelBase(object):
         if not is_initialization or network_name == ["all"]:
             self.network.load_state_dict(checkpoint["model_state_dict"], strict=True)
             for k, v in checkpoint["optimizers_state_dict"]:
+                if k not in self.optimizer_dict.keys():
+                    # e.g. saved with another training.fast_optim
+                    logging.warning("Optimizer {} not found, skip its state".format(k))
+                    continue
                 self.optimizer_dict[k].load_state_dict(v)
                 # send to cuda
                 for state in self.optimizer_dict[k].state.values():
                     for _k, _v in state.items():
                         if torch.is_tensor(_v):
-                            state[_k] = _v.cuda()
+                            state[_k] = _v.to(self.device)
+            if "grad_scaler_state_dict" in checkpoint.keys() and self.grad_scaler.is_enabled():
+                self.grad_scaler.load_state_dict(checkpoint["grad_scaler_state_dict"])
         else:
             if network_name is not None:
                 prefix = ["network_dict." + name for name in network_name]
@@ -204,6 +411,8 @@ class ModelBase(object):
                 (k, opti.state_dict()) for k, opti in self.optimizer_dict.items()
             ],
         }
+        if self.grad_scaler.is_enabled():
+            save_dict["grad_scaler_state_dict"] = self.grad_scaler.state_dict()
         if additional_dict is not None:
             for k, v in additional_dict.items():
                 save_dict[k] = v
@@ -215,7 +424,42 @@ class ModelBase(object):
             self.__dataparallel_flag__ = True
         else:
             self.__dataparallel_flag__ = False
-        self.network.cuda()
+        self.network.to(self.device)
+
+    def to_ddp(self, device, find_unused_parameters=False):
+        """
+        Wrap the network in DistributedDataParallel on the device of this process, the process
+        group must be initialized
+        """
+        self.device = device
+        self.network.to(device)
+        for optimizer in self.optimizer_dict.values():
+            for state in optimizer.state.values():
+                for k, v in state.items():
+                    if torch.is_tensor(v):
+                        state[k] = v.to(device)
+        self.network = nn.parallel.DistributedDataParallel(
+            self.network,
+            device_ids=[device.index] if device.type == "cuda" else None,
+            find_unused_parameters=find_unused_parameters,
+        )
+        self.__dataparallel_flag__ = True
+
+    @contextlib.contextmanager
+    def local_network(self):
+        """
+        Run the network inside DistributedDataParallel directly, without its collectives, e.g. for
+        an evaluation on one process
+        """
+        ddp = self.network
+        if not isinstance(ddp, nn.parallel.DistributedDataParallel):
+            yield
+            return
+        self.network, self.__dataparallel_flag__ = ddp.module, False
+        try:
+            yield
+        finally:
+            self.network, self.__dataparallel_flag__ = ddp, True
 
     def set_train(self):
         self.network.train()
@@ -0,0 +1,43 @@
+# activation checkpointing policy of the networks: recompute the activations in the backward to
+# trade compute for memory
+
+import logging
+from core.net_bank.checkpoint_utils import checkpoint_forward
+
+CHECKPOINT_POLICY_LIST = ["none", "per-coupling", "per-block", "every-k"]
+
+
+def apply_checkpointing(network_dict, cfg):
+    """
+    Set the checkpointing policy of the homeomorphism from model.checkpoint_policy:
+    none, per-coupling (each coupling layer), per-block (each block of two couplings) or
+    every-k (model.checkpoint_every_k blocks at once); model.checkpoint_encoder also checkpoints
+    the encoders
+    """
+    policy, every_k, encoder = "none", 2, False
+    if "checkpoint_policy" in cfg["model"].keys():
+        policy = str(cfg["model"]["checkpoint_policy"]).lower()
+    if "checkpoint_every_k" in cfg["model"].keys():
+        every_k = int(cfg["model"]["checkpoint_every_k"])
+    if "checkpoint_encoder" in cfg["model"].keys():
+        encoder = bool(cfg["model"]["checkpoint_encoder"])
+    assert policy in CHECKPOINT_POLICY_LIST, "Checkpoint policy {} not support".format(policy)
+
+    if policy != "none":
+        homeomorphism = network_dict["homeomorphism_decoder"]
+        if hasattr(homeomorphism, "set_checkpointing"):
+            homeomorphism.set_checkpointing(policy, every_k)
+        else:
+            logging.warning(
+                "{} has no checkpointing policy, ignore {}".format(type(homeomorphism).__name__, policy)
+            )
+    if encoder:
+        for k in network_dict.keys():
+            if k.endswith("encoder"):
+                checkpoint_forward(network_dict[k])
+    if policy != "none" or encoder:
+        logging.info(
+            "Activation checkpointing: homeomorphism {} (k={}), encoders {}".format(
+                policy, every_k, encoder
+            )
+        )
@@ -0,0 +1,47 @@
+# optimizer update utils: one Adam over all param groups with the multi-tensor / fused kernels
+# where the installed torch has them, and the grad norm of all params in one reduction
+
+import inspect
+import torch
+
+
+def make_adam(param_groups, device):
+    """
+    Adam with the fastest update the torch version supports: fused (cuda), foreach, the
+    multi-tensor Adam of torch 1.7-1.8, or the for-loop one
+    """
+    sig = inspect.signature(torch.optim.Adam.__init__).parameters
+    if device.type == "cuda" and "fused" in sig:
+        try:
+            return torch.optim.Adam(param_groups, fused=True), "fused"
+        except (RuntimeError, ValueError):
+            pass
+    if "foreach" in sig:
+        return torch.optim.Adam(param_groups, foreach=True), "foreach"
+    if hasattr(torch.optim, "_multi_tensor"):
+        return torch.optim._multi_tensor.Adam(param_groups), "multi-tensor"
+    return torch.optim.Adam(param_groups), "for-loop"
+
+
+@torch.no_grad()
+def clip_grad_norm_fused(parameters, max_norm):
+    """
+    clip_grad_norm_ with the per-tensor norms and the scaling as foreach ops where supported,
+    return the total norm before clipping
+    """
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return torch.tensor(0.0)
+    if hasattr(torch, "_foreach_norm"):
+        norms = torch._foreach_norm(grads)
+    else:
+        norms = [torch.norm(g) for g in grads]
+    total_norm = torch.norm(torch.stack([n.to(grads[0].device) for n in norms]))
+    clip_coef = max_norm / (float(total_norm) + 1e-6)
+    if clip_coef < 1.0:
+        if hasattr(torch, "_foreach_mul_"):
+            torch._foreach_mul_(grads, clip_coef)
+        else:
+            for g in grads:
+                g.mul_(clip_coef)
+    return total_norm
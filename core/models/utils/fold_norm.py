@@ -0,0 +1,210 @@
+# fold eval-mode normalizations into the neighbouring linear layers of an inference module
+# the structure change only depends on the module types, so a fresh module folded the same way
+# loads the folded state dict
+
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.parameter import Parameter
+from core.net_bank.oflow_decoder import CBatchNorm1d, CBatchNorm1d_legacy
+from core.net_bank.lpdc_utils.decoders import CBatchNorm1d as CBatchNorm1d_lpdc
+from core.net_bank.lpdc_utils.decoders import CBatchNorm1d_legacy as CBatchNorm1d_legacy_lpdc
+from core.net_bank.nvp_v2.models.frozen_batchnorm import FrozenBatchNorm2d
+from core.net_bank.nice.models.frozen_batchnorm import FrozenBatchNorm2d as FrozenBatchNorm2d_nice
+from core.net_bank.neuralparts_nvp.models.frozen_batchnorm import (
+    FrozenBatchNorm2d as FrozenBatchNorm2d_np,
+)
+
+LINEAR_TYPES = (nn.Linear, nn.Conv1d, nn.Conv2d)
+FROZEN_BN_TYPES = (FrozenBatchNorm2d, FrozenBatchNorm2d_nice, FrozenBatchNorm2d_np)
+CBN_TYPES = (CBatchNorm1d, CBatchNorm1d_lpdc)
+CBN_LEGACY_TYPES = (CBatchNorm1d_legacy, CBatchNorm1d_legacy_lpdc)
+ACT_TYPES = (nn.ReLU, nn.LeakyReLU, nn.ELU)
+
+
+class FusedInstanceNorm1d(nn.Module):
+    """
+    InstanceNorm1d without running stats and the activation after it in one module, the
+    normalization and the affine transform run in the single native instance_norm kernel
+    without the checks and the stats bookkeeping of nn.InstanceNorm1d; the normalization depends
+    on the input, so it can not be folded
+    """
+
+    def __init__(self, norm, act=None):
+        super().__init__()
+        self.num_features = norm.num_features
+        self.eps = norm.eps
+        self.affine = norm.affine
+        if self.affine:
+            self.weight = Parameter(norm.weight.data.clone())
+            self.bias = Parameter(norm.bias.data.clone())
+        else:
+            self.weight, self.bias = None, None
+        self.act = act
+
+    def forward(self, x):
+        # x: B,C,L
+        out = F.instance_norm(x, weight=self.weight, bias=self.bias, eps=self.eps)
+        if self.act is not None:
+            out = self.act(out)
+        return out
+
+
+def norm_affine(norm):
+    """
+    The per channel scale and shift of an eval-mode norm with fixed stats, None if not foldable
+    """
+    if isinstance(norm, FROZEN_BN_TYPES):
+        # the frozen running_var already includes eps
+        scale = norm.weight * norm.running_var.rsqrt()
+        return scale, norm.bias - norm.running_mean * scale
+    is_bn = isinstance(norm, (nn.BatchNorm1d, nn.BatchNorm2d))
+    is_tracked_in = isinstance(norm, nn.InstanceNorm1d) and norm.track_running_stats
+    if not (is_bn or is_tracked_in) or norm.running_mean is None:
+        return None
+    scale = torch.rsqrt(norm.running_var + norm.eps)
+    shift = -norm.running_mean * scale
+    if norm.affine:
+        scale, shift = scale * norm.weight, shift * norm.weight + norm.bias
+    return scale, shift
+
+
+def fold_into_linear(layer, scale, shift):
+    # layer(x) * scale + shift as one layer, the channel is dim 0 of the weight
+    with torch.no_grad():
+        view = [-1] + [1] * (layer.weight.dim() - 1)
+        layer.weight.mul_(scale.reshape(view))
+        bias = layer.bias if layer.bias is not None else torch.zeros_like(scale)
+        new_bias = bias * scale + shift
+    if layer.bias is None:
+        layer.bias = Parameter(new_bias)
+    else:
+        layer.bias.data.copy_(new_bias)
+
+
+def fold_conditional_norm(cbn, gamma_layer, beta_layer):
+    """
+    gamma * bn(x) + beta with a fixed stats bn is gamma' * x + beta', fold bn into the layers
+    predicting gamma and beta from the code
+    """
+    affine = norm_affine(cbn.bn)
+    if affine is None:
+        return False
+    scale, shift = affine
+    with torch.no_grad():
+        # beta' = beta + gamma * shift, gamma' = gamma * scale
+        view = [-1] + [1] * (gamma_layer.weight.dim() - 1)
+        beta_layer.weight.add_(gamma_layer.weight * shift.reshape(view))
+        beta_layer.bias.add_(gamma_layer.bias * shift)
+        gamma_layer.weight.mul_(scale.reshape(view))
+        gamma_layer.bias.mul_(scale)
+    cbn.bn = nn.Identity()
+    return True
+
+
+def fold_norms(module):
+    """
+    Fold in place all foldable norms of an eval-mode module, return the report of what is done:
+    BatchNorm / FrozenBatchNorm2d / tracked InstanceNorm right after a Linear or Conv in a
+    Sequential are folded into it, the bn of conditional batch norms is folded into the gamma /
+    beta layers, InstanceNorm1d without stats is replaced by FusedInstanceNorm1d
+    """
+    assert not module.training, "Only eval-mode norms can be folded"
+    for m in module.modules():
+        if hasattr(m, "clear_bind_cache"):
+            m.clear_bind_cache()  # computed with the weights before folding
+    report = {"folded": [], "fused": [], "kept": []}
+    for name, m in list(module.named_modules()):
+        if isinstance(m, CBN_TYPES + CBN_LEGACY_TYPES):
+            if isinstance(m, CBN_TYPES):
+                done = fold_conditional_norm(m, m.conv_gamma, m.conv_beta)
+            else:
+                done = fold_conditional_norm(m, m.fc_gamma, m.fc_beta)
+            report["folded" if done else "kept"].append(name + ".bn")
+        if not isinstance(m, nn.Sequential):
+            continue
+        children = list(m.named_children())
+        for i, (child_name, child) in enumerate(children):
+            prev = children[i - 1][1] if i > 0 else None
+            full_name = "{}.{}".format(name, child_name) if name else child_name
+            is_norm = isinstance(
+                child,
+                (nn.BatchNorm1d, nn.BatchNorm2d, nn.InstanceNorm1d) + FROZEN_BN_TYPES,
+            )
+            if not is_norm:
+                continue
+            affine = norm_affine(child)
+            if affine is not None and isinstance(prev, LINEAR_TYPES):
+                fold_into_linear(prev, *affine)
+                setattr(m, child_name, nn.Identity())
+                report["folded"].append(full_name)
+            elif isinstance(child, nn.InstanceNorm1d) and not child.track_running_stats:
+                nxt = children[i + 1][1] if i + 1 < len(children) else None
+                if isinstance(nxt, ACT_TYPES):
+                    setattr(m, children[i + 1][0], nn.Identity())
+                else:
+                    nxt = None
+                setattr(m, child_name, FusedInstanceNorm1d(child, nxt))
+                report["fused"].append(full_name)
+            else:
+                report["kept"].append(full_name)
+    return report
+
+
+@torch.no_grad()
+def max_output_difference(module_a, module_b, example_inputs):
+    """
+    Run every method of example_inputs on both modules, return the max abs difference per method
+    """
+    diff = {}
+    for method, inputs in example_inputs.items():
+        out_a = getattr(module_a, method)(*inputs)
+        out_b = getattr(module_b, method)(*inputs)
+        if not isinstance(out_a, (tuple, list)):
+            out_a, out_b = [out_a], [out_b]
+        diff[method] = max([float((a - b).abs().max()) for a, b in zip(out_a, out_b)])
+    return diff
+
+
+@torch.no_grad()
+def time_fused_norms(module, example_inputs, n_iters=100):
+    """
+    Time every FusedInstanceNorm1d of a folded module against the nn.InstanceNorm1d and the
+    activation it replaces, on the inputs it gets from example_inputs; return
+    {name: (shape, original ms, fused ms)}
+    """
+    fused = {name: m for name, m in module.named_modules() if isinstance(m, FusedInstanceNorm1d)}
+    captured = {}
+    handles = [
+        m.register_forward_pre_hook(
+            lambda m, inputs, name=name: captured.setdefault(name, inputs[0].detach())
+        )
+        for name, m in fused.items()
+    ]
+    for method, inputs in example_inputs.items():
+        getattr(module, method)(*inputs)
+    for h in handles:
+        h.remove()
+
+    def run_time(fn, x):
+        fn(x)  # warm up
+        if x.is_cuda:
+            torch.cuda.synchronize(x.device)
+        start_t = time.time()
+        for _ in range(n_iters):
+            fn(x)
+        if x.is_cuda:
+            torch.cuda.synchronize(x.device)
+        return (time.time() - start_t) / n_iters * 1000.0
+
+    report = {}
+    for name, x in captured.items():
+        m = fused[name]
+        norm = nn.InstanceNorm1d(m.num_features, eps=m.eps, affine=m.affine).to(x.device)
+        if m.affine:
+            norm.weight.data.copy_(m.weight.data)
+            norm.bias.data.copy_(m.bias.data)
+        original = nn.Sequential(norm, m.act) if m.act is not None else norm
+        report[name] = (tuple(x.shape), run_time(original.eval(), x), run_time(m, x))
+    return report
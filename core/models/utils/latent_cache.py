@@ -0,0 +1,68 @@
+# on-disk cache of the encoded latents of test samples, keyed by checkpoint hash and viz_id
+
+import os
+import hashlib
+import logging
+import torch
+
+
+def hash_checkpoint_files(filelist, chunk_size=1 << 20):
+    """
+    sha1 over the content of all checkpoint files, in order
+    """
+    if isinstance(filelist, str):
+        filelist = [filelist]
+    sha = hashlib.sha1()
+    for fn in filelist:
+        with open(fn, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+
+class LatentCache(object):
+    def __init__(self, cache_root, checkpoint_hash, keys):
+        """
+        One file per sample under cache_root/checkpoint_hash/viz_id.pt holding the keys tensors
+        """
+        self.cache_dir = os.path.join(cache_root, checkpoint_hash)
+        self.keys = list(keys)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hit_count, self.miss_count = 0, 0
+        logging.info("Latent cache of {} at {}".format(self.keys, self.cache_dir))
+
+    def filename(self, viz_id):
+        return os.path.join(self.cache_dir, "{}.pt".format(viz_id))
+
+    def load(self, viz_id):
+        fn = self.filename(viz_id)
+        if not os.path.exists(fn):
+            return None
+        latent = torch.load(fn, map_location="cpu")
+        if not all(k in latent.keys() for k in self.keys):
+            return None
+        return latent
+
+    def load_batch(self, viz_id_list):
+        """
+        return a dict of batched latents if all samples hit, else None
+        """
+        latent_list = []
+        for viz_id in viz_id_list:
+            latent = self.load(viz_id)
+            if latent is None:
+                self.miss_count += len(viz_id_list)
+                return None
+            latent_list.append(latent)
+        self.hit_count += len(viz_id_list)
+        return {k: torch.stack([l[k] for l in latent_list], dim=0) for k in self.keys}
+
+    def save(self, viz_id, latent):
+        fn = self.filename(viz_id)
+        # write then rename, so a killed run never leaves a broken cache file
+        torch.save(latent, fn + ".tmp")
+        os.replace(fn + ".tmp", fn)
+
+    def save_batch(self, viz_id_list, output):
+        for bid, viz_id in enumerate(viz_id_list):
+            self.save(viz_id, {k: output[k][bid].detach().cpu() for k in self.keys})
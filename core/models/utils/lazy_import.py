@@ -0,0 +1,16 @@
+# import the viz and render helpers (matplotlib 3D, scikit-image, pyrender / OSMesa) only when
+# a visualization is made, so that runs without viz do not pay for them at startup
+
+import importlib
+
+
+class LazyCallable(object):
+    def __init__(self, module_name, attr):
+        self.module_name = module_name
+        self.attr = attr
+        self.func = None
+
+    def __call__(self, *args, **kwargs):
+        if self.func is None:
+            self.func = getattr(importlib.import_module(self.module_name), self.attr)
+        return self.func(*args, **kwargs)
@@ -2,12 +2,12 @@ import torch
 import torch.optim as optim
 from torch import autograd
 import numpy as np
-from tqdm import trange
 import trimesh
 from .utils import libmcubes
 from .utils.common import make_3d_grid
-from .utils.libsimplify import simplify_mesh
+from .utils.libsimplify import simplify_mesh, simplify_mesh_sequence
 from .utils.libmise import MISE
+from ..precision import precision_context, get_precision
 import time
 from torch import distributions as dist
 import logging
@@ -31,6 +31,14 @@ class Generator3D(object):
         sample (bool): whether z should be sampled
         simplify_nfaces (int): number of faces the mesh should be simplified to
         preprocessor (nn.Module): preprocessor for inputs
+        precision (str): inference precision of the implicit function, fp32 / bf16 / int8
+        confidence_margin (float): MISE does not subdivide voxels whose touching logits are all
+            farther than this from the threshold, None to always subdivide
+        sparse_mcubes (bool): run marching cubes on the MISE octree instead of the dense grid
+        refinement_tol (float): refinement stops once the loss improves by less than this
+            (relative) for refinement_patience steps
+        refinement_patience (int): number of steps without improvement before stopping
+        simplify_workers (int): number of threads replaying the simplification on the frames
     """
 
     def __init__(
@@ -44,11 +52,24 @@ class Generator3D(object):
         padding=0.1,
         sample=False,
         simplify_nfaces=None,
+        device="cuda",
+        precision="fp32",
+        confidence_margin=None,
+        sparse_mcubes=False,
+        refinement_tol=1e-3,
+        refinement_patience=5,
+        simplify_workers=4,
     ):
         self.implicit_F = None
-        self.device = "cuda"
+        self.device = device
+        self.precision = precision
+        self.confidence_margin = np.inf if confidence_margin is None else confidence_margin
+        self.sparse_mcubes = sparse_mcubes
+        self.stats_dict = {}
         self.points_batch_size = points_batch_size
         self.refinement_step = refinement_step
+        self.refinement_tol = refinement_tol
+        self.refinement_patience = refinement_patience
         self.threshold = threshold
         self.resolution0 = resolution0
         self.upsampling_steps = upsampling_steps
@@ -56,14 +77,23 @@ class Generator3D(object):
         self.padding = padding
         self.sample = sample
         self.simplify_nfaces = simplify_nfaces
+        self.simplify_workers = simplify_workers
 
     def generate_from_latent(self, c, F, **kwargs):
         """
         F output a dist
+        refine=False skips the normals, simplification and refinement of the extracted mesh, for
+        callers that deform it and then process the whole sequence with simplify_sequence and
+        refine_sequence
         """
         self.implicit_F = F
         z = torch.zeros(1, 0).to(self.device)
-        mesh = self.__generate_from_latent__(z, c, **kwargs)
+        # the stats of the last extraction, include the per level query counts and timings
+        self.stats_dict = kwargs.pop("stats_dict", dict())
+        refine = kwargs.pop("refine", True)
+        mesh = self.__generate_from_latent__(
+            z, c, stats_dict=self.stats_dict, refine=refine, **kwargs
+        )
         # try:
         #     mesh = self.__generate_from_latent__(z, c, **kwargs)
         # except:
@@ -71,14 +101,17 @@ class Generator3D(object):
         #     mesh = trimesh.Trimesh(vertices=[[0, 0, 0], [0, 0, 1], [0, 1, 0]], faces=[[0, 1, 2]])
         return mesh
 
-    def __generate_from_latent__(self, z, c=None, stats_dict={}, **kwargs):
+    def __generate_from_latent__(self, z, c=None, stats_dict=None, refine=True, **kwargs):
         """Generates mesh from latent.
 
         Args:
             z (tensor): latent code z
             c (tensor): latent conditioned code c
             stats_dict (dict): stats dictionary
+            refine (bool): estimate normals, simplify and refine the mesh if configured
         """
+        if stats_dict is None:
+            stats_dict = dict()
         threshold = np.log(self.threshold) - np.log(1.0 - self.threshold)
 
         t0 = time.time()
@@ -92,11 +125,15 @@ class Generator3D(object):
             values = self.eval_points(pointsf, z, c, **kwargs).cpu().numpy()
             value_grid = values.reshape(nx, nx, nx)
         else:
-            mesh_extractor = MISE(self.resolution0, self.upsampling_steps, threshold)
+            mesh_extractor = MISE(
+                self.resolution0, self.upsampling_steps, threshold, self.confidence_margin
+            )
+            level_stats = []
 
             points = mesh_extractor.query()
 
             while points.shape[0] != 0:
+                t_level = time.time()
                 # Query points
                 pointsf = torch.FloatTensor(points).to(self.device)
                 # Normalize to bounding box
@@ -105,17 +142,117 @@ class Generator3D(object):
                 # Evaluate model and update
                 values = self.eval_points(pointsf, z, c, **kwargs).cpu().numpy()
                 values = values.astype(np.float64)
+                t_eval = time.time() - t_level
                 mesh_extractor.update(points, values)
+                level_stats.append(
+                    {
+                        "n_query": points.shape[0],
+                        "time (eval points)": t_eval,
+                        "time (update)": time.time() - t_level - t_eval,
+                    }
+                )
+                logging.debug("MISE level {}: {}".format(len(level_stats) - 1, level_stats[-1]))
                 points = mesh_extractor.query()
 
+            stats_dict["mise levels"] = level_stats
+            stats_dict["mise n_query"] = sum([l["n_query"] for l in level_stats])
+            stats_dict["mise n_pruned"] = mesh_extractor.n_pruned
+            if self.sparse_mcubes:
+                stats_dict["time (eval points)"] = time.time() - t0
+                return self.extract_mesh_sparse(
+                    mesh_extractor, z, c, stats_dict=stats_dict, refine=refine
+                )
             value_grid = mesh_extractor.to_dense()
 
         # Extract mesh
         stats_dict["time (eval points)"] = time.time() - t0
 
-        mesh = self.extract_mesh(value_grid, z, c, stats_dict=stats_dict)
+        mesh = self.extract_mesh(value_grid, z, c, stats_dict=stats_dict, refine=refine)
         return mesh
 
+    def generate_batch_from_latent(self, c, F, batch_size, **kwargs):
+        """Generates the meshes of a batch of latents without postprocessing (as refine=False).
+        The MISE levels of all samples run in lockstep, every level is evaluated in one batched
+        forward of F over the B,N,3 queries padded to the longest sample.
+
+        Args:
+            c (tensor): latent conditioned code c, batched over the samples
+            F (callable): implicit function, output a dist
+            batch_size (int): number of samples B
+        """
+        self.implicit_F = F
+        self.stats_dict = kwargs.pop("stats_dict", dict())
+        threshold = np.log(self.threshold) - np.log(1.0 - self.threshold)
+        box_size = 1 + self.padding
+        z = torch.zeros(batch_size, 0).to(self.device)
+
+        t0 = time.time()
+        extractor_list = [
+            MISE(self.resolution0, self.upsampling_steps, threshold, self.confidence_margin)
+            for _ in range(batch_size)
+        ]
+        points_list = [m.query() for m in extractor_list]
+        level_stats = []
+        while max([p.shape[0] for p in points_list]) > 0:
+            t_level = time.time()
+            n_max = max([p.shape[0] for p in points_list])
+            pointsf = torch.zeros(batch_size, n_max, 3)
+            for bid, points in enumerate(points_list):
+                pointsf[bid, : points.shape[0]] = torch.FloatTensor(points)
+            # Normalize to bounding box
+            pointsf = box_size * (pointsf / extractor_list[0].resolution - 0.5)
+            values = self.eval_points_batch(pointsf, z, c, **kwargs).numpy().astype(np.float64)
+            t_eval = time.time() - t_level
+            for bid, points in enumerate(points_list):
+                if points.shape[0] > 0:
+                    extractor_list[bid].update(points, values[bid, : points.shape[0]])
+            # the same per level stats as generate_from_latent, summed over the samples
+            level_stats.append(
+                {
+                    "n_query": sum([p.shape[0] for p in points_list]),
+                    "time (eval points)": t_eval,
+                    "time (update)": time.time() - t_level - t_eval,
+                }
+            )
+            logging.debug("MISE level {}: {}".format(len(level_stats) - 1, level_stats[-1]))
+            points_list = [m.query() for m in extractor_list]
+        self.stats_dict["time (eval points)"] = time.time() - t0
+        self.stats_dict["mise levels"] = level_stats
+        self.stats_dict["mise n_query"] = sum([l["n_query"] for l in level_stats])
+        self.stats_dict["mise n_pruned"] = sum([m.n_pruned for m in extractor_list])
+
+        mesh_list = []
+        for bid, mesh_extractor in enumerate(extractor_list):
+            if self.sparse_mcubes:
+                mesh = self.extract_mesh_sparse(
+                    mesh_extractor, z, c, stats_dict=self.stats_dict, refine=False
+                )
+            else:
+                mesh = self.extract_mesh(
+                    mesh_extractor.to_dense(), z, c, stats_dict=self.stats_dict, refine=False
+                )
+            mesh_list.append(mesh)
+        return mesh_list
+
+    def eval_points_batch(self, p, z, c=None, **kwargs):
+        """Evaluates the occupancy values for a batch of points, return B,N logits.
+
+        Args:
+            p (tensor): B,N,3 points
+            z (tensor): latent code z
+            c (tensor): latent conditioned code c, batched over B
+        """
+        p_split = torch.split(p, max(self.points_batch_size // p.shape[0], 1), dim=1)
+        occ_hats = []
+
+        device_type = torch.device(self.device).type
+        for pi in p_split:
+            pi = pi.to(self.device)
+            with torch.no_grad(), precision_context(self.precision, device_type):
+                occ_hat = self.implicit_F(pi, z, c, **kwargs).logits.float()
+            occ_hats.append(occ_hat.reshape(p.shape[0], -1).detach().cpu())
+        return torch.cat(occ_hats, dim=1)
+
     def eval_points(self, p, z, c=None, **kwargs):
         """Evaluates the occupancy values for the points.
 
@@ -127,10 +264,11 @@ class Generator3D(object):
         p_split = torch.split(p, self.points_batch_size)
         occ_hats = []
 
+        device_type = torch.device(self.device).type
         for pi in p_split:
             pi = pi.unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                occ_hat = self.implicit_F(pi, z, c, **kwargs).logits
+            with torch.no_grad(), precision_context(self.precision, device_type):
+                occ_hat = self.implicit_F(pi, z, c, **kwargs).logits.float()
 
             occ_hats.append(occ_hat.squeeze(0).detach().cpu())
         # ! safe operation update 26th Oct 2021
@@ -141,7 +279,7 @@ class Generator3D(object):
 
         return occ_hat
 
-    def extract_mesh(self, occ_hat, z, c=None, stats_dict=dict()):
+    def extract_mesh(self, occ_hat, z, c=None, stats_dict=dict(), refine=True):
         """Extracts the mesh from the predicted occupancy grid.
 
         Args:
@@ -149,10 +287,10 @@ class Generator3D(object):
             z (tensor): latent code z
             c (tensor): latent conditioned code c
             stats_dict (dict): stats dictionary
+            refine (bool): estimate normals, simplify and refine the mesh if configured
         """
         # Some short hands
         n_x, n_y, n_z = occ_hat.shape
-        box_size = 1 + self.padding
         threshold = np.log(self.threshold) - np.log(1.0 - self.threshold)
         # Make sure that mesh is watertight
         t0 = time.time()
@@ -163,6 +301,42 @@ class Generator3D(object):
         vertices -= 0.5
         # Undo padding
         vertices -= 1
+        return self.postprocess_mesh(
+            vertices, triangles, (n_x, n_y, n_z), z, c, stats_dict, refine=refine
+        )
+
+    def extract_mesh_sparse(self, mesh_extractor, z, c=None, stats_dict=dict(), refine=True):
+        """Extracts the mesh from the MISE octree, without the dense occupancy grid.
+
+        Args:
+            mesh_extractor (MISE): MISE with all grid points evaluated
+            z (tensor): latent code z
+            c (tensor): latent conditioned code c
+            stats_dict (dict): stats dictionary
+            refine (bool): estimate normals, simplify and refine the mesh if configured
+        """
+        t0 = time.time()
+        vertices, triangles = mesh_extractor.marching_cubes()
+        stats_dict["time (marching cubes)"] = time.time() - t0
+        n = mesh_extractor.resolution + 1
+        return self.postprocess_mesh(vertices, triangles, (n, n, n), z, c, stats_dict, refine=refine)
+
+    def postprocess_mesh(
+        self, vertices, triangles, grid_shape, z, c=None, stats_dict=dict(), refine=True
+    ):
+        """Normalizes the marching cubes output and builds the final mesh.
+
+        Args:
+            vertices (numpy array): vertices in grid coordinates
+            triangles (numpy array): triangle indices
+            grid_shape (tuple): number of grid points along each axis
+            z (tensor): latent code z
+            c (tensor): latent conditioned code c
+            stats_dict (dict): stats dictionary
+            refine (bool): estimate normals, simplify and refine the mesh if configured
+        """
+        n_x, n_y, n_z = grid_shape
+        box_size = 1 + self.padding
         # Normalize to bounding box
         vertices /= np.array([n_x - 1, n_y - 1, n_z - 1])
         vertices = box_size * (vertices - 0.5)
@@ -171,7 +345,7 @@ class Generator3D(object):
         # mesh_pymesh = fix_pymesh(mesh_pymesh)
 
         # Estimate normals if needed
-        if self.with_normals and not vertices.shape[0] == 0:
+        if refine and self.with_normals and not vertices.shape[0] == 0:
             t0 = time.time()
             normals = self.estimate_normals(vertices, z, c)
             stats_dict["time (normals)"] = time.time() - t0
@@ -187,15 +361,15 @@ class Generator3D(object):
             return mesh
 
         # TODO: normals are lost here
-        if self.simplify_nfaces is not None:
+        if refine and self.simplify_nfaces is not None:
             t0 = time.time()
             mesh = simplify_mesh(mesh, self.simplify_nfaces, 5.0)
             stats_dict["time (simplify)"] = time.time() - t0
 
         # Refine mesh
-        if self.refinement_step > 0:
+        if refine and self.refinement_step > 0:
             t0 = time.time()
-            self.refine_mesh(mesh, occ_hat, z, c)
+            self.refine_mesh(mesh, z, c)
             stats_dict["time (refine)"] = time.time() - t0
 
         return mesh
@@ -204,89 +378,157 @@ class Generator3D(object):
         """Estimates the normals by computing the gradient of the objective.
 
         Args:
-            vertices (numpy array): vertices of the mesh
+            vertices (numpy array): vertices of the mesh, V,3 or T,V,3 for T meshes
             z (tensor): latent code z
-            c (tensor): latent conditioned code c
+            c (tensor): latent conditioned code c, batched over the T meshes
         """
-        device = self.device
-        vertices = torch.FloatTensor(vertices)
-        vertices_split = torch.split(vertices, self.points_batch_size)
+        vertices = torch.as_tensor(vertices, dtype=torch.float32)
+        single = vertices.ndim == 2
+        if single:
+            vertices = vertices.unsqueeze(0)
+        # split along the vertices, every chunk is one pass over all meshes
+        chunk_size = max(self.points_batch_size // vertices.shape[0], 1)
+        vertices_split = torch.split(vertices, chunk_size, dim=1)
 
         normals = []
-        z, c = z.unsqueeze(0), c.unsqueeze(0)
-        for vi in vertices_split:
-            vi = vi.unsqueeze(0).to(device)
-            vi.requires_grad_()
-            occ_hat = self.implicit_F(vi, z, c).logits
-            out = occ_hat.sum()
-            out.backward()
-            ni = -vi.grad
-            ni = ni / torch.norm(ni, dim=-1, keepdim=True)
-            ni = ni.squeeze(0).cpu().numpy()
-            normals.append(ni)
-
-        normals = np.concatenate(normals, axis=0)
-        return normals
-
-    def refine_mesh(self, mesh, occ_hat, z, c=None):
-        """Refines the predicted mesh.
+        with torch.enable_grad():
+            for vi in vertices_split:
+                vi = vi.to(self.device).requires_grad_()
+                occ_hat = self.implicit_F(vi, z, c).logits
+                ni = -autograd.grad([occ_hat.sum()], [vi])[0]
+                ni = ni / (torch.norm(ni, dim=-1, keepdim=True) + 1e-10)
+                normals.append(ni.detach().cpu())
+
+        normals = torch.cat(normals, dim=1).numpy()
+        return normals[0] if single else normals
+
+    def refine_vertices(self, vertices, faces, z, c=None):
+        """Refines the vertices of T meshes sharing the faces, one autograd pass per step.
 
         Args:
-            mesh (trimesh object): predicted mesh
-            occ_hat (tensor): predicted occupancy grid
+            vertices (tensor): T,V,3 vertices
+            faces (tensor): F,3 faces shared by all meshes
             z (tensor): latent code z
-            c (tensor): latent conditioned code c
+            c (tensor): latent conditioned code c, batched over the T meshes
         """
-
-        self.model.eval()
-
-        # Some shorthands
-        n_x, n_y, n_z = occ_hat.shape
-        assert n_x == n_y == n_z
         # threshold = np.log(self.threshold) - np.log(1. - self.threshold)
         threshold = self.threshold
 
         # Vertex parameter
-        v0 = torch.FloatTensor(mesh.vertices).to(self.device)
+        v0 = torch.as_tensor(vertices, dtype=torch.float32).to(self.device)
         v = torch.nn.Parameter(v0.clone())
 
         # Faces of mesh
-        faces = torch.LongTensor(mesh.faces).to(self.device)
+        faces = torch.as_tensor(faces, dtype=torch.long).to(self.device)
+
+        # Pre-sample the barycentric coordinates of all steps on device
+        eps_all = dist.Dirichlet(torch.full((3,), 0.5, device=self.device)).sample(
+            (self.refinement_step, faces.shape[0])
+        )  # S,F,3
 
         # Start optimization
         optimizer = optim.RMSprop([v], lr=1e-4)
+        best_loss, n_stall = np.inf, 0
+
+        with torch.enable_grad():
+            for it_r in range(self.refinement_step):
+                optimizer.zero_grad()
+
+                # Loss
+                face_vertex = v[:, faces]  # T,F,3,3
+                face_point = (face_vertex * eps_all[it_r][None, :, :, None]).sum(dim=2)  # T,F,3
+
+                face_v1 = face_vertex[:, :, 1, :] - face_vertex[:, :, 0, :]
+                face_v2 = face_vertex[:, :, 2, :] - face_vertex[:, :, 1, :]
+                face_normal = torch.cross(face_v1, face_v2, dim=-1)
+                face_normal = face_normal / (face_normal.norm(dim=-1, keepdim=True) + 1e-10)
+                face_value = torch.sigmoid(self.implicit_F(face_point, z, c).logits)  # T,F
+                normal_target = -autograd.grad(
+                    [face_value.sum()], [face_point], create_graph=True
+                )[0]
+
+                normal_target = normal_target / (normal_target.norm(dim=-1, keepdim=True) + 1e-10)
+                loss_target = (face_value - threshold).pow(2).mean()
+                loss_normal = (face_normal - normal_target).pow(2).sum(dim=-1).mean()
+
+                loss = loss_target + 0.01 * loss_normal
+
+                # Update, only the vertices get gradients
+                v.grad = autograd.grad([loss], [v])[0]
+                optimizer.step()
+
+                # Stop once the loss does not improve anymore
+                loss = loss.item()
+                if loss < best_loss * (1.0 - self.refinement_tol):
+                    best_loss, n_stall = loss, 0
+                else:
+                    n_stall += 1
+                if n_stall >= self.refinement_patience:
+                    break
+        logging.debug("Refinement stops after {} steps, loss {:.6f}".format(it_r + 1, loss))
+
+        return v.detach()
+
+    def refine_mesh(self, mesh, z, c=None):
+        """Refines the predicted mesh.
 
-        for it_r in trange(self.refinement_step):
-            optimizer.zero_grad()
-
-            # Loss
-            face_vertex = v[faces]
-            eps = np.random.dirichlet((0.5, 0.5, 0.5), size=faces.shape[0])
-            eps = torch.FloatTensor(eps).to(self.device)
-            face_point = (face_vertex * eps[:, :, None]).sum(dim=1)
+        Args:
+            mesh (trimesh object): predicted mesh
+            z (tensor): latent code z
+            c (tensor): latent conditioned code c
+        """
+        v = self.refine_vertices(np.array(mesh.vertices)[None], np.array(mesh.faces), z, c)
+        mesh.vertices = v[0].cpu().numpy()
 
-            face_v1 = face_vertex[:, 1, :] - face_vertex[:, 0, :]
-            face_v2 = face_vertex[:, 2, :] - face_vertex[:, 1, :]
-            face_normal = torch.cross(face_v1, face_v2)
-            face_normal = face_normal / (face_normal.norm(dim=1, keepdim=True) + 1e-10)
-            face_value = torch.sigmoid(self.implicit_F(face_point.unsqueeze(0), z, c).logits)
-            normal_target = -autograd.grad([face_value.sum()], [face_point], create_graph=True)[0]
+        return mesh
 
-            normal_target = normal_target / (normal_target.norm(dim=1, keepdim=True) + 1e-10)
-            loss_target = (face_value - threshold).pow(2).mean()
-            loss_normal = (face_normal - normal_target).pow(2).sum(dim=1).mean()
+    def simplify_sequence(self, mesh, vertices):
+        """Simplifies the extracted mesh and replays its edge collapses on the vertices of the
+        other frames, so all frames keep the same faces.
 
-            loss = loss_target + 0.01 * loss_normal
+        Args:
+            mesh (trimesh object): extracted t0 mesh
+            vertices (numpy array): K,V,3 vertices sharing the faces of mesh
+        Returns the simplified mesh and the K,V',3 simplified vertices
+        """
+        if self.simplify_nfaces is None or mesh.vertices.shape[0] == 0:
+            return mesh, vertices
+        t0 = time.time()
+        mesh, vertices = simplify_mesh_sequence(
+            mesh, vertices, self.simplify_nfaces, 5.0, n_workers=self.simplify_workers
+        )
+        self.stats_dict["time (simplify)"] = time.time() - t0
+        return mesh, vertices
 
-            # Update
-            loss.backward()
-            optimizer.step()
+    def refine_sequence(self, vertices, faces, c, F=None):
+        """Refines the frames of a deforming mesh sequence together and estimates their normals,
+        as configured by refinement_step and with_normals.
 
-        mesh.vertices = v.data.cpu().numpy()
+        Args:
+            vertices (numpy array): T,V,3 vertices of all frames
+            faces (numpy array): F,3 faces shared by all frames
+            c (tensor): latent conditioned code c batched over T, frame t is decoded with c[t]
+            F (callable): implicit function, default the one of the last extraction
+        Returns the T,V,3 vertices and T,V,3 normals (None if with_normals is off)
+        """
+        if F is not None:
+            self.implicit_F = F
+        z = torch.zeros(vertices.shape[0], 0).to(self.device)
+        normals = None
+        if vertices.shape[1] == 0:
+            return vertices, normals
+        if self.refinement_step > 0:
+            t0 = time.time()
+            vertices = self.refine_vertices(vertices, faces, z, c).cpu().numpy()
+            self.stats_dict["time (refine)"] = time.time() - t0
+        if self.with_normals:
+            t0 = time.time()
+            normals = self.estimate_normals(vertices, z, c)
+            self.stats_dict["time (normals)"] = time.time() - t0
+        return vertices, normals
 
-        return mesh
 
-def get_generator(cfg):
+def get_generator(cfg, device="cuda"):
     """Returns the generator object.
 
     Args:
@@ -298,6 +540,23 @@ def get_generator(cfg):
         simplify_nfaces = None
     else:
         simplify_nfaces = _cfg["simplify_nfaces"]
+    confidence_margin = None
+    if "confidence_margin" in _cfg.keys() and not isinstance(_cfg["confidence_margin"], str):
+        confidence_margin = _cfg["confidence_margin"]
+    sparse_mcubes = False
+    if "sparse_mcubes" in _cfg.keys():
+        sparse_mcubes = _cfg["sparse_mcubes"]
+    with_normals = False
+    if "with_normals" in _cfg.keys():
+        with_normals = _cfg["with_normals"]
+    refinement_tol, refinement_patience = 1e-3, 5
+    if "refinement_tol" in _cfg.keys():
+        refinement_tol = _cfg["refinement_tol"]
+    if "refinement_patience" in _cfg.keys():
+        refinement_patience = _cfg["refinement_patience"]
+    simplify_workers = 4
+    if "simplify_workers" in _cfg.keys():
+        simplify_workers = _cfg["simplify_workers"]
     generator = Generator3D(
         threshold=_cfg["threshold"],
         resolution0=_cfg["resolution_0"],
@@ -305,6 +564,14 @@ def get_generator(cfg):
         sample=_cfg["use_sampling"],
         simplify_nfaces=simplify_nfaces,
         points_batch_size=_cfg["batch_pts"],
-        refinement_step=_cfg["refinement_step"]
+        refinement_step=_cfg["refinement_step"],
+        device=device,
+        precision=get_precision(cfg),
+        confidence_margin=confidence_margin,
+        sparse_mcubes=sparse_mcubes,
+        with_normals=with_normals,
+        refinement_tol=refinement_tol,
+        refinement_patience=refinement_patience,
+        simplify_workers=simplify_workers,
     )
     return generator
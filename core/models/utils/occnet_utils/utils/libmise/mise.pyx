@@ -2,11 +2,32 @@
 cimport cython
 from cython.operator cimport dereference as dref
 from libcpp.vector cimport vector
-from libcpp.map cimport map
-from libc.math cimport isnan, NAN
+from libcpp.utility cimport pair
+from libcpp.unordered_map cimport unordered_map
+from libc.math cimport isnan, fabs, NAN, INFINITY
+from libcpp.algorithm cimport sort
 import numpy as np
 
 
+# marching cubes tables shared with libmcubes
+cdef extern from "marchingcubes.h" namespace "mc":
+    int edge_table[256]
+    int triangle_table[256][16]
+
+
+# corner offsets of a cell and the two corners of each edge, in the libmcubes order
+cdef int[8][3] CORNER_OFFSET = [
+    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1],
+]
+cdef int[12][2] EDGE_CORNER = [
+    [0, 1], [1, 2], [3, 2], [0, 3],
+    [4, 5], [5, 6], [7, 6], [4, 7],
+    [0, 4], [1, 5], [2, 6], [3, 7],
+]
+cdef int[12] EDGE_AXIS = [0, 1, 0, 1, 0, 1, 0, 1, 2, 2, 2, 2]
+
+
 cdef struct Vector3D:
     int x, y, z
 
@@ -15,6 +36,7 @@ cdef struct Voxel:
     Vector3D loc
     unsigned int level
     bint is_leaf
+    bint is_pruned
     unsigned long children[2][2][2]
 
 
@@ -30,22 +52,57 @@ cdef inline unsigned long vec_to_idx(Vector3D coord, long resolution):
     return idx
 
 
+cdef void overlay(vector[long]& top_x, vector[double]& top_v, vector[long]& bottom_x,
+                  vector[double]& bottom_v, vector[long]& out_x, vector[double]& out_v):
+    # runs of top, with the runs of bottom before the first run of top
+    out_x.clear()
+    out_v.clear()
+    cdef size_t i
+    for i in range(bottom_x.size()):
+        if top_x.size() > 0 and bottom_x[i] >= top_x[0]:
+            break
+        out_x.push_back(bottom_x[i])
+        out_v.push_back(bottom_v[i])
+    for i in range(top_x.size()):
+        out_x.push_back(top_x[i])
+        out_v.push_back(top_v[i])
+
+
+cdef inline double row_value(vector[long]& xs, vector[double]& vs, size_t* run, long x, long resolution,
+                             double pad_value):
+    # value of the run containing x, the rows start at 0; run is a cursor only moved forward, so
+    # the queries of a row must not decrease in x
+    if x < 0 or x > resolution:
+        return pad_value
+    while run[0] + 1 < xs.size() and xs[run[0] + 1] <= x:
+        run[0] += 1
+    return vs[run[0]]
+
+
 cdef class MISE:
     cdef vector[Voxel] voxels
     cdef vector[GridPoint] grid_points
-    cdef map[long, long] grid_point_hash
+    cdef unordered_map[long, long] grid_point_hash
+    # indices of the grid points added since the last query, emitted in one batch per level
+    cdef vector[long] unknown_points
     cdef readonly int resolution_0
     cdef readonly int depth
     cdef readonly double threshold
+    cdef readonly double confidence_margin
     cdef readonly int voxel_size_0
     cdef readonly int resolution
+    cdef readonly long n_pruned
 
-    def __cinit__(self, int resolution_0, int depth, double threshold):
+    def __cinit__(self, int resolution_0, int depth, double threshold, double confidence_margin=INFINITY):
+        """A voxel touching both sides of the threshold is only subdivided if one of its
+        touching grid points is within confidence_margin of the threshold, by default always."""
         self.resolution_0 = resolution_0
         self.depth = depth
         self.threshold = threshold
+        self.confidence_margin = confidence_margin
         self.voxel_size_0 = (1 << depth)
         self.resolution = resolution_0 * self.voxel_size_0
+        self.n_pruned = 0
 
         # Create initial voxels
         self.voxels.reserve(resolution_0 * resolution_0 * resolution_0)
@@ -66,6 +123,7 @@ cdef class MISE:
                         loc=loc,
                         level=0,
                         is_leaf=True,
+                        is_pruned=False,
                     )
 
                     assert(self.voxels.size() == vec_to_idx(Vector3D(i, j, k), resolution_0))
@@ -73,6 +131,8 @@ cdef class MISE:
 
         # Create initial grid points
         self.grid_points.reserve((resolution_0 + 1) * (resolution_0 + 1) * (resolution_0 + 1))
+        self.grid_point_hash.reserve((resolution_0 + 1) * (resolution_0 + 1) * (resolution_0 + 1))
+        self.unknown_points.reserve((resolution_0 + 1) * (resolution_0 + 1) * (resolution_0 + 1))
         for i in range(resolution_0 + 1):
             for j in range(resolution_0 + 1):
                 for k in range(resolution_0 + 1):
@@ -105,28 +165,35 @@ cdef class MISE:
 
     def query(self):
         """Query points to evaluate."""
-        # Find all points with unknown value
-        cdef vector[Vector3D] points
-        cdef int n_unknown = 0
-        for p in self.grid_points:
-            if not p.known:
-                n_unknown += 1 
-
-        points.reserve(n_unknown)
-        for p in self.grid_points:
-            if not p.known:
-                points.push_back(p.loc)
+        # Only grid points added since the last query can be unknown
+        cdef vector[long] points
+        cdef long idx
+        points.reserve(self.unknown_points.size())
+        for idx in self.unknown_points:
+            if not self.grid_points[idx].known:
+                points.push_back(idx)
+        # Points not updated by the caller are emitted again at the next query
+        self.unknown_points = points
 
         # Convert to numpy
         points_np = np.zeros((points.size(), 3), dtype=np.int64)
         cdef long[:, :] points_view = points_np
+        cdef long i
         for i in range(points.size()):
-            points_view[i, 0] = points[i].x
-            points_view[i, 1] = points[i].y
-            points_view[i, 2] = points[i].z
+            points_view[i, 0] = self.grid_points[points[i]].loc.x
+            points_view[i, 1] = self.grid_points[points[i]].loc.y
+            points_view[i, 2] = self.grid_points[points[i]].loc.z
 
         return points_np
 
+    @property
+    def n_voxels(self):
+        return self.voxels.size()
+
+    @property
+    def n_grid_points(self):
+        return self.grid_points.size()
+
     def to_dense(self):
         """Output dense matrix at highest resolution."""
         out_array = np.full((self.resolution + 1,) * 3, np.nan)
@@ -163,6 +230,132 @@ cdef class MISE:
                     assert(not isnan(out_view[i, j, k]))
         return out_array
 
+    def marching_cubes(self, double pad_value=-1e6):
+        """Sparse marching cubes at the highest resolution, without building the dense grid.
+
+        The points take the values of to_dense: the forward fill along x, y, then z gives each
+        point the grid point that is the largest in (z, y, x) order among the grid points not
+        above it on any axis. The planes of these values are built one z at a time as rows of
+        constant runs, and only the cells next to a run boundary or inside a run crossing the
+        threshold are visited; points outside the grid take pad_value, like the padded dense grid.
+        Vertices are shared along cell edges so the mesh is watertight.
+        Returns vertices (V, 3) in grid coordinates and triangles (F, 3).
+        """
+        cdef long n = self.resolution + 1
+        cdef vector[pair[long, double]] entries
+        cdef GridPoint point
+        entries.reserve(self.grid_points.size())
+        for point in self.grid_points:
+            entries.push_back(pair[long, double](
+                (point.loc.z * n + point.loc.y) * n + point.loc.x, point.value
+            ))
+        sort(entries.begin(), entries.end())
+
+        # rows of (run starts, run values), the planes of the filled values below and at z
+        cdef vector[vector[long]] prev_x, cur_x
+        cdef vector[vector[double]] prev_v, cur_v
+        cdef vector[long] line_x, b_x, b_prev_x, empty_x, pad_x
+        cdef vector[double] line_v, b_v, b_prev_v, empty_v, pad_v
+        pad_x.push_back(0)
+        pad_v.push_back(pad_value)
+        prev_x.resize(n)
+        prev_v.resize(n)
+        cur_x.resize(n)
+        cur_v.resize(n)
+
+        cdef unordered_map[long, long] edge_vertex
+        cdef vector[double] vertices
+        cdef vector[long] triangles
+        cdef vector[long] bounds
+        cdef vector[long]* row_x[4]
+        cdef vector[double]* row_v[4]
+        cdef double[8] v
+        cdef size_t[4] pos
+        cdef long e_next = 0, x, y, z, y0, z0, zr, r, s, e
+        cdef size_t i
+
+        for z in range(n + 1):
+            if z < n and e_next < entries.size() and entries[e_next].first // (n * n) == z:
+                b_prev_x.clear()
+                b_prev_v.clear()
+                for y in range(n):
+                    line_x.clear()
+                    line_v.clear()
+                    while e_next < entries.size() and entries[e_next].first // n == z * n + y:
+                        line_x.push_back(entries[e_next].first % n)
+                        line_v.push_back(entries[e_next].second)
+                        e_next += 1
+                    # fill along x, then y from the row below, then z from the plane below
+                    overlay(line_x, line_v, b_prev_x, b_prev_v, b_x, b_v)
+                    if z == 0:
+                        overlay(b_x, b_v, empty_x, empty_v, cur_x[y], cur_v[y])
+                    else:
+                        overlay(b_x, b_v, prev_x[y], prev_v[y], cur_x[y], cur_v[y])
+                    b_prev_x.swap(b_x)
+                    b_prev_v.swap(b_v)
+            elif z < n:
+                cur_x = prev_x
+                cur_v = prev_v
+
+            # cells with lower corner at z - 1, between the planes z - 1 and z
+            z0 = z - 1
+            for y0 in range(-1, n):
+                for r in range(4):
+                    # row of the corner offsets (r % 2 along y, r // 2 along z)
+                    y, zr = y0 + r % 2, z0 + r // 2
+                    if y < 0 or y >= n or zr < 0 or zr >= n:
+                        row_x[r], row_v[r] = &pad_x, &pad_v
+                    elif r // 2 == 0:
+                        row_x[r], row_v[r] = &prev_x[y], &prev_v[y]
+                    else:
+                        row_x[r], row_v[r] = &cur_x[y], &cur_v[y]
+                # merge the run starts of the 4 rows, the points outside the grid are padding
+                bounds.clear()
+                bounds.push_back(-1)
+                for r in range(4):
+                    pos[r] = 0
+                while True:
+                    x = n
+                    for r in range(4):
+                        if pos[r] < row_x[r].size() and row_x[r][0][pos[r]] < x:
+                            x = row_x[r][0][pos[r]]
+                    if x == n:
+                        break
+                    bounds.push_back(x)
+                    for r in range(4):
+                        if pos[r] < row_x[r].size() and row_x[r][0][pos[r]] == x:
+                            pos[r] += 1
+                bounds.push_back(n)
+                bounds.push_back(n + 1)
+                for r in range(4):
+                    pos[r] = 0
+                for i in range(bounds.size() - 1):
+                    s, e = bounds[i], bounds[i + 1]
+                    # the cells inside a run have the same corner values
+                    if e - 2 >= s:
+                        self.cell_values(v, row_x, row_v, pos, s, pad_value)
+                        if edge_table[self.cube_index(v)] != 0:
+                            for x in range(s, e - 1):
+                                self.add_cell(x, y0, z0, v, edge_vertex, vertices, triangles)
+                    # the cell across the run boundary
+                    if e - 1 < n:
+                        self.cell_values(v, row_x, row_v, pos, e - 1, pad_value)
+                        self.add_cell(e - 1, y0, z0, v, edge_vertex, vertices, triangles)
+            if z < n:
+                prev_x.swap(cur_x)
+                prev_v.swap(cur_v)
+
+        # Convert to numpy
+        vertices_np = np.zeros((vertices.size() // 3, 3), dtype=np.float64)
+        triangles_np = np.zeros((triangles.size() // 3, 3), dtype=np.int64)
+        cdef double[:, :] vertices_view = vertices_np
+        cdef long[:, :] triangles_view = triangles_np
+        for i in range(vertices.size()):
+            vertices_view[i // 3, i % 3] = vertices[i]
+        for i in range(triangles.size()):
+            triangles_view[i // 3, i % 3] = triangles[i]
+        return vertices_np, triangles_np
+
     def get_points(self):
         points_np = np.zeros((self.grid_points.size(), 3), dtype=np.int64)
         values_np = np.zeros((self.grid_points.size()), dtype=np.float64)
@@ -184,13 +377,16 @@ cdef class MISE:
     cdef void subdivide_voxels(self) except +:
         cdef vector[bint] next_to_positive
         cdef vector[bint] next_to_negative
+        cdef vector[double] min_distance
         cdef int i, j, k
         cdef long idx
+        cdef double distance
         cdef Vector3D loc, adj_loc
 
         # Initialize vectors
         next_to_positive.resize(self.voxels.size(), False)
         next_to_negative.resize(self.voxels.size(), False)
+        min_distance.resize(self.voxels.size(), INFINITY)
     
         # Iterate over grid points and mark voxels active
         # TODO: can move this to update operation and add attibute to voxel
@@ -198,6 +394,7 @@ cdef class MISE:
             loc = grid_point.loc
             if not grid_point.known:
                 continue
+            distance = fabs(grid_point.value - self.threshold)
 
             # Iterate over the 8 adjacent voxels
             for i in range(-1, 1):
@@ -216,23 +413,33 @@ cdef class MISE:
                             next_to_positive[idx] = True
                         if grid_point.value <= self.threshold:
                             next_to_negative[idx] = True
+                        if distance < min_distance[idx]:
+                            min_distance[idx] = distance
 
         cdef int n_subdivide = 0
+        cdef vector[long] subdivide_list
         
         for idx in range(self.voxels.size()):
             if not self.voxels[idx].is_leaf or self.voxels[idx].level == self.depth:
                 continue
+            if self.voxels[idx].is_pruned:
+                continue
             if next_to_positive[idx] and next_to_negative[idx]:
+                # Confidence pruning: all touching logits are far from the threshold, the voxel
+                # is never subdivided
+                if min_distance[idx] > self.confidence_margin:
+                    self.voxels[idx].is_pruned = True
+                    self.n_pruned += 1
+                    continue
                 n_subdivide += 1
+                subdivide_list.push_back(idx)
 
         self.voxels.reserve(self.voxels.size() + 8 * n_subdivide)
-        self.grid_points.reserve(self.voxels.size() + 19 * n_subdivide)
+        self.grid_points.reserve(self.grid_points.size() + 19 * n_subdivide)
+        self.unknown_points.reserve(self.unknown_points.size() + 19 * n_subdivide)
 
-        for idx in range(self.voxels.size()):
-            if not self.voxels[idx].is_leaf or self.voxels[idx].level == self.depth:
-                continue
-            if next_to_positive[idx] and next_to_negative[idx]:
-                self.subdivide_voxel(idx)
+        for idx in subdivide_list:
+            self.subdivide_voxel(idx)
 
     cdef void subdivide_voxel(self, long idx):
         cdef Voxel voxel
@@ -259,7 +466,8 @@ cdef class MISE:
                     voxel = Voxel(
                         loc=loc, 
                         level=new_level,
-                        is_leaf=True
+                        is_leaf=True,
+                        is_pruned=False,
                     )
 
                     self.voxels[idx].children[i][j][k] = self.voxels.size()
@@ -280,6 +488,64 @@ cdef class MISE:
                         self.add_grid_point(loc)
 
 
+    cdef void cell_values(self, double* v, vector[long]** row_x, vector[double]** row_v, size_t* run,
+                          long x, double pad_value):
+        """Corner values of the cell with lower corner x on the 4 rows of its y and z offsets."""
+        cdef double[4][2] row_values
+        cdef int r, m
+        for r in range(4):
+            row_values[r][0] = row_value(row_x[r][0], row_v[r][0], &run[r], x, self.resolution, pad_value)
+            row_values[r][1] = row_value(row_x[r][0], row_v[r][0], &run[r], x + 1, self.resolution, pad_value)
+        for m in range(8):
+            v[m] = row_values[CORNER_OFFSET[m][1] + 2 * CORNER_OFFSET[m][2]][CORNER_OFFSET[m][0]]
+
+    cdef inline int cube_index(self, double* v):
+        cdef int m, cubeindex = 0
+        for m in range(8):
+            if v[m] <= self.threshold:
+                cubeindex |= 1 << m
+        return cubeindex
+
+    cdef void add_cell(self, long x, long y, long z, double* v, unordered_map[long, long]& edge_vertex,
+                       vector[double]& vertices, vector[long]& triangles):
+        """Add the triangles of a cell, with the vertices on edges already added reused."""
+        cdef int cubeindex = self.cube_index(v)
+        cdef int edges = edge_table[cubeindex]
+        if edges == 0:
+            return
+        cdef long[12] indices
+        cdef long edge_key
+        cdef int e, a, b, axis, m
+        cdef double t
+        for e in range(12):
+            if not (edges & (1 << e)):
+                continue
+            a, b = EDGE_CORNER[e][0], EDGE_CORNER[e][1]
+            axis = EDGE_AXIS[e]
+            # an edge is keyed by its lower corner and axis, shared by the 4 cells around it
+            edge_key = 3 * self.get_point_key(
+                x + CORNER_OFFSET[a][0], y + CORNER_OFFSET[a][1], z + CORNER_OFFSET[a][2]
+            ) + axis
+            p_vertex = edge_vertex.find(edge_key)
+            if p_vertex != edge_vertex.end():
+                indices[e] = dref(p_vertex).second
+                continue
+            indices[e] = vertices.size() // 3
+            edge_vertex[edge_key] = indices[e]
+            t = 0.5 if v[b] == v[a] else (self.threshold - v[a]) / (v[b] - v[a])
+            vertices.push_back(x + CORNER_OFFSET[a][0] + (t if axis == 0 else 0.))
+            vertices.push_back(y + CORNER_OFFSET[a][1] + (t if axis == 1 else 0.))
+            vertices.push_back(z + CORNER_OFFSET[a][2] + (t if axis == 2 else 0.))
+        m = 0
+        while triangle_table[cubeindex][m] != -1:
+            triangles.push_back(indices[triangle_table[cubeindex][m]])
+            m += 1
+
+    cdef inline long get_point_key(self, long x, long y, long z):
+        # points of the padded grid, from -1 to resolution + 1
+        cdef long stride = self.resolution + 3
+        return ((x + 1) * stride + y + 1) * stride + z + 1
+
     @cython.cdivision(True) 
     cdef long get_voxel_idx(self, Vector3D loc) except +:
         """Utility function for getting voxel index corresponding to 3D coordinates."""
@@ -354,14 +620,15 @@ cdef class MISE:
             known=False,
         )
         self.grid_point_hash[vec_to_idx(loc, self.resolution + 1)] = self.grid_points.size()
+        self.unknown_points.push_back(self.grid_points.size())
         self.grid_points.push_back(point)
 
-    cdef inline int get_grid_point_idx(self, Vector3D loc):
+    cdef inline long get_grid_point_idx(self, Vector3D loc):
         p_idx = self.grid_point_hash.find(vec_to_idx(loc, self.resolution + 1))
         if p_idx == self.grid_point_hash.end():
             return -1
 
-        cdef int idx = dref(p_idx).second
+        cdef long idx = dref(p_idx).second
         assert(self.grid_points[idx].loc.x == loc.x)
         assert(self.grid_points[idx].loc.y == loc.y)
         assert(self.grid_points[idx].loc.z == loc.z)
@@ -1,6 +1,9 @@
 import numpy as np
-from mise import MISE
 import time
+from core.models.utils.occnet_utils.utils.libmise import MISE
+from core.models.utils.occnet_utils.utils.libmcubes import marching_cubes
+
+# python -m core.models.utils.occnet_utils.utils.libmise.test
 
 t0 = time.time()
 extractor = MISE(1, 2, 0.)
@@ -23,3 +26,43 @@ print(extractor.to_dense())
 # print(p)
 # print(v)
 print('Total time: %f' % (time.time() - t0))
+
+
+def mesh_key(vertices, triangles):
+    # the triangles as sorted vertex positions, independent of the vertex order
+    faces = np.sort(np.round(vertices, 9).view('f8,f8,f8').reshape(-1)[triangles], axis=1)
+    return np.sort(faces, axis=0)
+
+
+def check_sparse_marching_cubes(n_trials=20, resolution_0=8, depth=3, seed=0):
+    """The sparse marching cubes gives the mesh of to_dense and the padded dense marching cubes,
+    on wavy spheres that leave coarse leaves next to subdivided ones, with and without confidence
+    pruning"""
+    rng = np.random.RandomState(seed)
+    for trial in range(n_trials):
+        center = rng.uniform(0.3, 0.7, 3)
+        freq, amp = rng.uniform(5., 40.), rng.uniform(0.02, 0.2)
+        for margin in [np.inf, 0.1]:
+            extractor = MISE(resolution_0, depth, 0., margin)
+            p = extractor.query()
+            while p.shape[0] != 0:
+                q = p / extractor.resolution
+                v = 0.25 - np.linalg.norm(q - center, axis=-1)
+                v += amp * np.sin(freq * q[:, 0]) * np.sin(freq * q[:, 1])
+                extractor.update(p, v)
+                p = extractor.query()
+            dense = np.pad(extractor.to_dense(), 1, 'constant', constant_values=-1e6)
+            vertices_dense, triangles_dense = marching_cubes(dense, 0.)
+            # the shift of libmcubes and the padding, as in the dense mesh extraction
+            vertices_dense -= 1.5
+            vertices_sparse, triangles_sparse = extractor.marching_cubes()
+            assert len(triangles_dense) == len(triangles_sparse), (
+                'Trial %d margin %f: %d dense vs %d sparse triangles'
+                % (trial, margin, len(triangles_dense), len(triangles_sparse))
+            )
+            assert np.array_equal(
+                mesh_key(vertices_dense, triangles_dense), mesh_key(vertices_sparse, triangles_sparse)
+            ), 'Trial %d margin %f: the dense and sparse meshes differ' % (trial, margin)
+    print('Sparse marching cubes matches dense on %d trials' % n_trials)
+
+check_sparse_marching_cubes()
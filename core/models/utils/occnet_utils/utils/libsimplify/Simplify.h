@@ -321,6 +321,10 @@ namespace Simplify
 	std::vector<Triangle> triangles;
 	std::vector<Vertex> vertices;
 	std::vector<Ref> refs;
+	// edge collapses of the last simplify_mesh as (kept vertex, removed vertex, border) and
+	// the original index of each vertex after compact_mesh, used to replay the simplification
+	std::vector<int> collapses;
+	std::vector<int> vertex_map;
     std::string mtllib;
     std::vector<std::string> materials;
 
@@ -349,6 +353,7 @@ namespace Simplify
         {
             triangles[i].deleted=0;
         }
+		collapses.clear();
 
 		// main iteration loop
 		int deleted_triangles=0;
@@ -417,6 +422,9 @@ namespace Simplify
 					// not flipped, so remove edge
 					v0.p=p;
 					v0.q=v1.q+v0.q;
+					collapses.push_back(i0);
+					collapses.push_back(i1);
+					collapses.push_back(v0.border & v1.border);
 					int tstart=refs.size();
 
 					update_triangles(i0,v0,deleted0,deleted_triangles);
@@ -749,11 +757,13 @@ namespace Simplify
 		}
 		triangles.resize(dst);
 		dst=0;
+		vertex_map.clear();
 		loopi(0,vertices.size())
 		if(vertices[i].tcount)
 		{
 			vertices[i].tstart=dst;
 			vertices[dst].p=vertices[i].p;
+			vertex_map.push_back(i);
 			dst++;
 		}
 		loopi(0,triangles.size())
@@ -764,6 +774,52 @@ namespace Simplify
 		vertices.resize(dst);
 	}
 
+	// Replay the collapses recorded by simplify_mesh on other positions p of the original
+	// vertices (e.g. the other frames of a sequence), with the optimal positions recomputed from
+	// their own quadrics. tris are the original triangles, p is updated in place. No global state.
+
+	void replay_collapses(std::vector<vec3f> &p, const std::vector<int> &tris, const std::vector<int> &log)
+	{
+		std::vector<SymetricMatrix> q(p.size(), SymetricMatrix(0.0));
+		for(size_t i=0;i<tris.size();i+=3)
+		{
+			vec3f n,v[3];
+			loopj(0,3) v[j]=p[tris[i+j]];
+			n.cross(v[1]-v[0],v[2]-v[0]);
+			n.normalize();
+			loopj(0,3) q[tris[i+j]] = q[tris[i+j]]+SymetricMatrix(n.x,n.y,n.z,-n.dot(v[0]));
+		}
+		for(size_t k=0;k<log.size();k+=3)
+		{
+			int i0=log[k], i1=log[k+1];
+			bool border=log[k+2];
+			SymetricMatrix qs=q[i0]+q[i1];
+			double det = qs.det(0, 1, 2, 1, 4, 5, 2, 5, 7);
+			vec3f p_result;
+			if ( det != 0 && !border )
+			{
+				p_result.x = -1/det*(qs.det(1, 2, 3, 4, 5, 6, 5, 7 , 8));
+				p_result.y =  1/det*(qs.det(0, 2, 3, 1, 5, 6, 2, 7 , 8));
+				p_result.z = -1/det*(qs.det(0, 1, 3, 1, 4, 6, 2, 5,  8));
+			}
+			else
+			{
+				vec3f p1=p[i0];
+				vec3f p2=p[i1];
+				vec3f p3=(p1+p2)/2;
+				double error1 = vertex_error(qs, p1.x,p1.y,p1.z);
+				double error2 = vertex_error(qs, p2.x,p2.y,p2.z);
+				double error3 = vertex_error(qs, p3.x,p3.y,p3.z);
+				double error = min(error1, min(error2, error3));
+				if (error1 == error) p_result=p1;
+				if (error2 == error) p_result=p2;
+				if (error3 == error) p_result=p3;
+			}
+			p[i0]=p_result;
+			q[i0]=qs;
+		}
+	}
+
 	// Error between vertex and Quadric
 
 	double vertex_error(SymetricMatrix q, double x, double y, double z)
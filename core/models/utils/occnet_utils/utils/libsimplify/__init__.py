@@ -1,7 +1,11 @@
 from .simplify_mesh import (
-    mesh_simplify
+    mesh_simplify,
+    mesh_simplify_plan,
+    replay_simplify,
 )
 import trimesh
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 def simplify_mesh(mesh, f_target=10000, agressiveness=7.):
@@ -13,3 +17,28 @@ def simplify_mesh(mesh, f_target=10000, agressiveness=7.):
     mesh_simplified = trimesh.Trimesh(vertices, faces, process=False)
 
     return mesh_simplified
+
+
+def simplify_mesh_sequence(mesh, vertices, f_target=10000, agressiveness=7., n_workers=4):
+    """
+    Simplify mesh and replay the same edge collapses on other vertex positions sharing its faces
+    (e.g. the deformed frames), so all outputs keep one connectivity and vertex correspondence.
+    vertices: K,V,3; return the simplified mesh and the K,V',3 simplified vertices
+    """
+    faces = np.ascontiguousarray(mesh.faces, dtype=np.int64)
+    vertices_s, faces_s, collapses, vertex_map = mesh_simplify_plan(
+        np.ascontiguousarray(mesh.vertices, dtype=np.float64), faces, f_target, agressiveness
+    )
+    mesh_simplified = trimesh.Trimesh(vertices_s, faces_s, process=False)
+
+    def replay(v):
+        return replay_simplify(
+            np.ascontiguousarray(v, dtype=np.float64), faces, collapses, vertex_map
+        )
+
+    # the replay releases the GIL, so the frames run in parallel in a thread pool
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as pool:
+        vertices_out = list(pool.map(replay, vertices))
+    if len(vertices_out) == 0:
+        return mesh_simplified, np.zeros((0, vertices_s.shape[0], 3))
+    return mesh_simplified, np.stack(vertices_out, axis=0)
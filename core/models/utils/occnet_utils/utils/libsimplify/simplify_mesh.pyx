@@ -5,8 +5,10 @@ cimport numpy as np
 
 
 cdef extern from "Simplify.h":
-    cdef struct vec3f:
+    cdef cppclass vec3f:
         double x, y, z
+        vec3f() nogil
+        vec3f(double, double, double) nogil
 
     cdef cppclass SymetricMatrix:
         SymetricMatrix() except +
@@ -28,7 +30,10 @@ cdef extern from "Simplify.h" namespace "Simplify":
     
     cdef vector[Triangle] triangles
     cdef vector[Vertex] vertices
+    cdef vector[int] collapses
+    cdef vector[int] vertex_map
     cdef void simplify_mesh(int, double)
+    cdef void replay_collapses(vector[vec3f]&, const vector[int]&, const vector[int]&) nogil
 
 
 cpdef mesh_simplify(double[:, ::1] vertices_in, long[:, ::1] triangles_in,
@@ -86,4 +91,61 @@ cpdef mesh_simplify(double[:, ::1] vertices_in, long[:, ::1] triangles_in,
     vertices.clear()
     triangles.clear()
     
-    return vertices_out, triangles_out
\ No newline at end of file
+    return vertices_out, triangles_out
+
+
+cpdef mesh_simplify_plan(double[:, ::1] vertices_in, long[:, ::1] triangles_in,
+                         int f_target, double agressiveness=7.):
+    """Simplify like mesh_simplify and also return the plan to replay it with
+    replay_simplify: the (kept, removed, border) edge collapses in order and the
+    original index of each output vertex."""
+    vertices_out, triangles_out = mesh_simplify(vertices_in, triangles_in, f_target, agressiveness)
+
+    cdef long i
+    collapses_out = np.empty((collapses.size() // 3, 3), dtype=np.int32)
+    vertex_map_out = np.empty((vertex_map.size(),), dtype=np.int64)
+    cdef int[:, :] collapses_out_view = collapses_out
+    cdef long[:] vertex_map_out_view = vertex_map_out
+
+    for i in range(collapses.size()):
+        collapses_out_view[i // 3, i % 3] = collapses[i]
+    for i in range(vertex_map.size()):
+        vertex_map_out_view[i] = vertex_map[i]
+
+    return vertices_out, triangles_out, collapses_out, vertex_map_out
+
+
+cpdef replay_simplify(double[:, ::1] vertices_in, long[:, ::1] triangles_in,
+                      int[:, ::1] collapses_in, long[::1] vertex_map_in):
+    """Apply a plan of mesh_simplify_plan to other positions of the same original vertices.
+    Thread safe, the replay runs without the GIL."""
+    cdef vector[vec3f] points
+    cdef vector[int] tris
+    cdef vector[int] log
+    cdef long i
+    cdef int j
+
+    vertices_out = np.empty((vertex_map_in.shape[0], 3), dtype=np.float64)
+    cdef double[:, :] vertices_out_view = vertices_out
+
+    with nogil:
+        points.reserve(vertices_in.shape[0])
+        for i in range(vertices_in.shape[0]):
+            points.push_back(vec3f(vertices_in[i, 0], vertices_in[i, 1], vertices_in[i, 2]))
+        tris.reserve(3 * triangles_in.shape[0])
+        for i in range(triangles_in.shape[0]):
+            for j in range(3):
+                tris.push_back(triangles_in[i, j])
+        log.reserve(3 * collapses_in.shape[0])
+        for i in range(collapses_in.shape[0]):
+            for j in range(3):
+                log.push_back(collapses_in[i, j])
+
+        replay_collapses(points, tris, log)
+
+        for i in range(vertex_map_in.shape[0]):
+            vertices_out_view[i, 0] = points[vertex_map_in[i]].x
+            vertices_out_view[i, 1] = points[vertex_map_in[i]].y
+            vertices_out_view[i, 2] = points[vertex_map_in[i]].z
+
+    return vertices_out
@@ -0,0 +1,136 @@
+# inference precision utils: int8 dynamic quantization for cpu, bf16 autocast where supported
+
+import torch
+import torch.nn as nn
+import logging
+import contextlib
+
+PRECISION_LIST = ["fp32", "bf16", "int8"]
+TRAIN_AMP_LIST = ["none", "fp16", "bf16"]
+_bf16_fallback_warned = set()
+
+
+class PointwiseLinear(nn.Module):
+    """
+    A kernel-size-1 Conv1d computed by a Linear over the channel dim, so that it can be
+    dynamically quantized (quantize_dynamic only supports Linear / RNN layers)
+    """
+
+    def __init__(self, conv):
+        super().__init__()
+        self.linear = nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        self.linear.weight.data.copy_(conv.weight.data.squeeze(-1))
+        if conv.bias is not None:
+            self.linear.bias.data.copy_(conv.bias.data)
+
+    def forward(self, x):
+        # x: B,C,N
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def is_pointwise_conv1d(m):
+    return (
+        isinstance(m, nn.Conv1d)
+        and m.kernel_size == (1,)
+        and m.stride == (1,)
+        and m.padding == (0,)
+        and m.dilation == (1,)
+        and m.groups == 1
+    )
+
+
+def convert_pointwise_conv1d(module):
+    """
+    Recursively replace all pointwise Conv1d by PointwiseLinear, in place
+    """
+    for name, child in module.named_children():
+        if is_pointwise_conv1d(child):
+            setattr(module, name, PointwiseLinear(child))
+        else:
+            convert_pointwise_conv1d(child)
+    return module
+
+
+def bf16_supported(device_type):
+    if not hasattr(torch, "autocast"):
+        return False
+    if device_type == "cuda":
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    return device_type == "cpu"
+
+
+def apply_precision(module, precision):
+    """
+    Prepare an eval-mode module for the inference precision, return the (new) module
+    int8 dynamically quantizes all Linear and pointwise Conv1d, the module must live on cpu;
+    bf16 keeps the fp32 weights, the computation is autocast by precision_context
+    """
+    assert precision in PRECISION_LIST, "Precision {} not support".format(precision)
+    module.eval()
+    if precision == "int8":
+        device = next(module.parameters()).device
+        if device.type != "cpu":
+            raise RuntimeError("int8 dynamic quantization only runs on cpu, got {}".format(device))
+        convert_pointwise_conv1d(module)
+        module = torch.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+        logging.info("Inference module dynamically quantized to int8")
+    elif precision == "bf16":
+        device_type = next(module.parameters()).device.type
+        if not bf16_supported(device_type):
+            raise RuntimeError(
+                "bf16 autocast not supported on {} with torch {}".format(device_type, torch.__version__)
+            )
+    return module
+
+
+def precision_context(precision, device_type):
+    """
+    Context to run the forward in, only bf16 needs autocast
+    """
+    if precision == "bf16":
+        if bf16_supported(device_type):
+            return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+        if device_type not in _bf16_fallback_warned:
+            _bf16_fallback_warned.add(device_type)
+            logging.warning(
+                "bf16 autocast not supported on {} with torch {}, run in fp32".format(
+                    device_type, torch.__version__
+                )
+            )
+    return contextlib.nullcontext()
+
+
+def get_precision(cfg):
+    precision = "fp32"
+    if "precision" in cfg["generation"].keys():
+        precision = cfg["generation"]["precision"]
+    assert precision in PRECISION_LIST, "Precision {} not support".format(precision)
+    return precision
+
+
+def assert_module_precision(precision, where):
+    """
+    int8 changes the weights, it is only applied to the inference module built from a checkpoint
+    """
+    assert precision != "int8", (
+        "generation.precision int8 is not applied by {}, use reconstruct.py or serve.py with a "
+        "checkpoint on cpu (validate it with validate_precision.py)".format(where)
+    )
+
+
+def train_autocast(amp, device_type):
+    """
+    Autocast context of the training forward: fp16 needs cuda (and a grad scaler), bf16 runs on
+    cpu and cuda with the generic torch.autocast
+    """
+    if amp == "none":
+        return contextlib.nullcontext()
+    if amp == "fp16":
+        if device_type != "cuda":
+            raise RuntimeError("fp16 autocast needs cuda, use bf16 on {}".format(device_type))
+        return torch.cuda.amp.autocast()
+    if not bf16_supported(device_type):
+        raise RuntimeError(
+            "bf16 autocast not supported on {} with torch {}".format(device_type, torch.__version__)
+        )
+    return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
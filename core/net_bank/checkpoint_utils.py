@@ -0,0 +1,36 @@
+# activation checkpointing helpers shared by the networks
+
+import inspect
+import torch
+from torch.utils.checkpoint import checkpoint
+
+_HAS_USE_REENTRANT = "use_reentrant" in inspect.signature(checkpoint).parameters
+
+
+def checkpoint_call(func, *args):
+    """
+    checkpoint(func, *args) that also gives the parameter gradients when no input requires grad,
+    e.g. an encoder over the raw point clouds
+    """
+    if _HAS_USE_REENTRANT:
+        return checkpoint(func, *args, use_reentrant=False)
+    # the reentrant checkpoint only tracks its outputs if an input requires grad
+    dummy = torch.ones(1, requires_grad=True)
+    return checkpoint(lambda _, *a: func(*a), dummy, *args)
+
+
+def checkpoint_forward(module):
+    """
+    Make module recompute its forward in the backward when training, by swapping its class for a
+    subclass, so that the state dict and the data parallel replicas are unchanged
+    """
+    cls = module.__class__
+
+    def forward(self, *args, **kwargs):
+        if self.training and torch.is_grad_enabled() and len(kwargs) == 0:
+            return checkpoint_call(super(checkpointed_cls, self).forward, *args)
+        return super(checkpointed_cls, self).forward(*args, **kwargs)
+
+    checkpointed_cls = type("Checkpointed" + cls.__name__, (cls,), {"forward": forward})
+    module.__class__ = checkpointed_cls
+    return module
@@ -1,5 +1,8 @@
+import hashlib
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from collections import OrderedDict
 
 
 def maxpool(x, dim=-1, keepdim=False):
@@ -59,11 +62,188 @@ class ResnetBlockFC(nn.Module):
         return x_s + dx
 
 
-class SpatioTemporalResnetPointnet(nn.Module):
+def expand_cat(x_list):
+    # broadcast all inputs to the full size and concatenate the channels
+    size = [max([x.shape[i] for x in x_list]) for i in range(x_list[0].dim() - 1)]
+    return torch.cat([x.expand(*size, x.shape[-1]) for x in x_list], dim=-1)
+
+
+def linear_cat(layer, x_list):
+    """Applies a Linear layer to the channel concatenation of x_list without materializing it,
+    the inputs only need to be broadcastable (e.g. a pooled B,T,1,C next to a B,T,N,C).
+
+    Args:
+        layer (nn.Linear): layer with in_features equal to the summed channels
+        x_list (list): input tensors
+    """
+    if not isinstance(layer.weight, torch.Tensor):
+        # e.g. a dynamically quantized Linear, its packed weight can not be sliced
+        return layer(expand_cat(x_list))
+    out, start = None, 0
+    for x in x_list:
+        y = F.linear(x, layer.weight[:, start : start + x.shape[-1]])
+        out = y if out is None else out + y
+        start += x.shape[-1]
+    if layer.bias is not None:
+        out = out + layer.bias
+    return out
+
+
+def resnet_block_cat(block, x_list, split=True):
+    """Applies a ResnetBlockFC to the channel concatenation of x_list.
+    With split, the weights are sliced per input and the pooled inputs are added by broadcasting,
+    else the inputs are expanded and concatenated.
+
+    Args:
+        block (ResnetBlockFC): block with size_in equal to the summed channels
+        x_list (list): input tensors
+        split (bool): use the split weights
+    """
+    if not split or block.shortcut is None:
+        return block(expand_cat(x_list))
+    net = linear_cat(block.fc_0, [block.actvn(x) for x in x_list])
+    dx = block.fc_1(block.actvn(net))
+    return linear_cat(block.shortcut, x_list) + dx
+
+
+class SpatioTemporalPointnetBase(nn.Module):
+    """Shared spatial / temporal branches of the spatio-temporal PointNets.
+
+    Args:
+        split_pool (bool): compute the pooled feature concatenations by split weights
+        spatial_cache_size (int): number of frames whose spatial codes are kept in eval mode,
+            so overlapping windows only encode their new frames
+    """
+
+    def __init__(self, split_pool=True, spatial_cache_size=0):
+        super().__init__()
+        self.split_pool = split_pool
+        self.spatial_cache_size = spatial_cache_size
+        self.spatial_cache = OrderedDict()
+        self.spatial_cache_hit, self.spatial_cache_miss = 0, 0
+
+    def train(self, mode=True):
+        # the cached codes are only valid for the weights they were computed with, the weights
+        # only change in train mode, so the next eval phase starts with an empty cache; eval()
+        # is called before every val batch and keeps the cache
+        if mode:
+            self.spatial_cache.clear()
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.spatial_cache.clear()
+        return super()._load_from_state_dict(*args, **kwargs)
+
+    def spatial_encode(self, x):
+        """
+        x: B,T,N,3; return the per frame spatial codes B,T,C, each frame is encoded on its own
+        """
+        net = self.spatial_fc_pos(x)
+        net = self.spatial_block_0(net)
+        for block in [
+            self.spatial_block_1,
+            self.spatial_block_2,
+            self.spatial_block_3,
+            self.spatial_block_4,
+        ]:
+            pooled = self.pool(net, dim=2, keepdim=True)
+            net = resnet_block_cat(block, [net, pooled], self.split_pool)
+        net = self.pool(net, dim=2)
+        return self.spatial_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
+
+    def spatial_encode_cached(self, x):
+        """
+        spatial_encode with a per frame cache keyed by the frame content, only used without grad
+        """
+        if self.spatial_cache_size <= 0 or self.training or torch.is_grad_enabled():
+            return self.spatial_encode(x)
+        B, T = x.shape[:2]
+        x_cpu = x.detach().cpu().numpy()
+        keys = [[hashlib.sha1(x_cpu[b, t].tobytes()).hexdigest() for t in range(T)] for b in range(B)]
+        missing = [(b, t) for b in range(B) for t in range(T) if keys[b][t] not in self.spatial_cache]
+        if len(missing) > 0:
+            frames = torch.stack([x[b, t] for b, t in missing], dim=0).unsqueeze(0)  # 1,M,N,3
+            codes = self.spatial_encode(frames)[0]
+            for (b, t), code in zip(missing, codes):
+                self.spatial_cache[keys[b][t]] = code
+        self.spatial_cache_miss += len(missing)
+        self.spatial_cache_hit += B * T - len(missing)
+        spatial_c = []
+        for b in range(B):
+            for t in range(T):
+                self.spatial_cache.move_to_end(keys[b][t])
+                spatial_c.append(self.spatial_cache[keys[b][t]])
+        while len(self.spatial_cache) > self.spatial_cache_size:
+            self.spatial_cache.popitem(last=False)
+        return torch.stack(spatial_c, dim=0).reshape(B, T, -1)
+
+    def temporal_encode(self, x, t):
+        """
+        x: B,T,N,3; t: B,T time stamps; return the temporal codes B,T,C
+        """
+        if self.pool_once:
+            return self.temporal_encode_pool_once(x, t)
+        # the time stamp is added by broadcasting instead of concatenated to every point
+        net = linear_cat(self.temporal_fc_pos, [x, t[:, :, None, None]])
+        net = self.temporal_block_0(net)
+        for block in [
+            self.temporal_block_1,
+            self.temporal_block_2,
+            self.temporal_block_3,
+            self.temporal_block_4,
+        ]:
+            pooled = self.pool(net, dim=2, keepdim=True)
+            pooled_time = self.pool(pooled, dim=1, keepdim=True)
+            net = resnet_block_cat(block, [net, pooled, pooled_time], self.split_pool)
+        net = self.pool(net, dim=2)
+        return self.temporal_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
+
+    def temporal_encode_pool_once(self, x, t):
+        batch_size, n_steps, n_pts, n_dim = x.shape
+        t = t[:, :, None, None].expand(batch_size, n_steps, n_pts, 1)
+        x_t = torch.cat([x, t], dim=3).reshape(batch_size, n_steps, n_pts, n_dim + 1)
+
+        net = self.temporal_fc_pos(x_t)
+        net = self.temporal_block_0(net)
+        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
+        net = torch.cat([net, pooled], dim=3)
+
+        net = self.temporal_block_1(net)
+        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
+        net = torch.cat([net, pooled], dim=3)
+
+        net = self.temporal_block_2(net)
+        pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
+        net = torch.cat([net, pooled], dim=2)
+
+        net = self.temporal_block_3(net)
+        pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
+        net = torch.cat([net, pooled], dim=2)
+
+        net = self.temporal_block_4(net)
+        net = self.pool(net, dim=2)
+        return self.temporal_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
+
+    @staticmethod
+    def default_t(x):
+        batch_size, n_steps = x.shape[:2]
+        t = (torch.arange(n_steps, dtype=torch.float32) / (n_steps - 1)).to(x.device)
+        return t[None, :].expand(batch_size, -1)
+
+
+class SpatioTemporalResnetPointnet(SpatioTemporalPointnetBase):
     def __init__(
-        self, c_dim=128, dim=3, hidden_dim=512, use_only_first_pcl=False, pool_once=False, **kwargs
+        self,
+        c_dim=128,
+        dim=3,
+        hidden_dim=512,
+        use_only_first_pcl=False,
+        pool_once=False,
+        split_pool=True,
+        spatial_cache_size=0,
+        **kwargs
     ):
-        super().__init__()
+        super().__init__(split_pool, spatial_cache_size)
         self.c_dim = c_dim
         self.use_only_first_pcl = use_only_first_pcl
         self.pool_once = pool_once
@@ -95,80 +275,21 @@ class SpatioTemporalResnetPointnet(nn.Module):
         self.actvn = nn.ReLU()
         self.pool = maxpool
 
-    def forward(self, x):
-        batch_size, n_steps, n_pts, n_dim = x.shape
-        t = (torch.arange(n_steps, dtype=torch.float32) / (n_steps - 1)).to(x.device)
-        t = t[None, :, None, None].expand(batch_size, n_steps, n_pts, 1)
-        x_t = torch.cat([x, t], dim=3).reshape(batch_size, n_steps, n_pts, n_dim + 1)
-
-        net = self.spatial_fc_pos(x)
-        net = self.spatial_block_0(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_1(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_2(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_3(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_4(net)
-        net = self.pool(net, dim=2)
-        spatial_c = self.spatial_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
-
-        net = self.temporal_fc_pos(x_t)
-        net = self.temporal_block_0(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=3)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_1(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=3)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_2(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=2)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_3(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=2)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_4(net)
-        net = self.pool(net, dim=2)
-        temporal_c = self.temporal_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
-
-        spatiotemporal_c = torch.cat([spatial_c, temporal_c], dim=2)
-        spatiotemporal_c = self.fc_c(spatiotemporal_c)  # batch_size x n_steps x c_dim
+    def forward(self, x, spatial_c=None, t=None):
+        """
+        x: B,T,N,3; spatial_c: B,T,C cached spatial_encode(x); t: B,T time stamps, default
+        evenly spaced in [0, 1]
+        """
+        if t is None:
+            t = self.default_t(x)
+        if spatial_c is None:
+            spatial_c = self.spatial_encode_cached(x)
+        temporal_c = self.temporal_encode(x, t)
+        spatiotemporal_c = linear_cat(self.fc_c, [spatial_c, temporal_c])  # B,T,C
         return spatial_c, spatiotemporal_c
 
 
-class SpatioTemporalResnetPointnetCDC(nn.Module):
+class SpatioTemporalResnetPointnetCDC(SpatioTemporalPointnetBase):
     def __init__(
         self,
         c_dim=128,
@@ -177,9 +298,11 @@ class SpatioTemporalResnetPointnetCDC(nn.Module):
         use_only_first_pcl=False,
         pool_once=False,
         global_geometry=True,
+        split_pool=True,
+        spatial_cache_size=0,
         **kwargs
     ):
-        super().__init__()
+        super().__init__(split_pool, spatial_cache_size)
         self.c_dim = c_dim
         self.use_only_first_pcl = use_only_first_pcl
         self.pool_once = pool_once
@@ -220,95 +343,30 @@ class SpatioTemporalResnetPointnetCDC(nn.Module):
         self.actvn = nn.ReLU()
         self.pool = maxpool
 
-    def forward(self, x):
-        batch_size, n_steps, n_pts, n_dim = x.shape
-        t = (torch.arange(n_steps, dtype=torch.float32) / (n_steps - 1)).to(x.device)
-        t = t[None, :, None, None].expand(batch_size, n_steps, n_pts, 1)
-        x_t = torch.cat([x, t], dim=3).reshape(batch_size, n_steps, n_pts, n_dim + 1)
-
-        net = self.spatial_fc_pos(x)
-        net = self.spatial_block_0(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_1(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_2(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_3(net)
-        pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-        net = torch.cat([net, pooled], dim=3)
-
-        net = self.spatial_block_4(net)
-        net = self.pool(net, dim=2)
-        spatial_c = self.spatial_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
+    def forward(self, x, spatial_c=None, t=None):
+        """
+        x: B,T,N,3; spatial_c: B,T,C cached spatial_encode(x); t: B,T time stamps, default
+        evenly spaced in [0, 1]
+        """
+        if t is None:
+            t = self.default_t(x)
+        if spatial_c is None:
+            spatial_c = self.spatial_encode_cached(x)
 
         # get a global code
         if self.global_geometry:
             canonical_geometry_c = self.pool(self.global_geometry_mlp(spatial_c), dim=1)  # B,C
 
         # Temporal Encoding
-        net = self.temporal_fc_pos(x_t)
-        net = self.temporal_block_0(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=3)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_1(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=2, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=3)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_2(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=2)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_3(net)
-        if self.pool_once:
-            pooled = self.pool(net, dim=1, keepdim=True).expand(net.size())
-            net = torch.cat([net, pooled], dim=2)
-        else:
-            pooled = self.pool(net, dim=2, keepdim=True)
-            pooled_time = self.pool(pooled, dim=1, keepdim=True)
-            net = torch.cat([net, pooled.expand(net.size()), pooled_time.expand(net.size())], dim=3)
-
-        net = self.temporal_block_4(net)
-        net = self.pool(net, dim=2)
-        temporal_c = self.temporal_fc_c(self.actvn(net))  # batch_size x n_steps x c_dim
+        temporal_c = self.temporal_encode(x, t)
 
         if self.global_geometry:
-            spatiotemporal_c = torch.cat(
-                [canonical_geometry_c.unsqueeze(1).expand(-1, n_steps, -1), spatial_c, temporal_c],
-                dim=2,
-            )
-        else:
-            spatiotemporal_c = torch.cat(
-                [spatial_c, temporal_c],
-                dim=2,
+            spatiotemporal_c = linear_cat(
+                self.fc_c, [canonical_geometry_c.unsqueeze(1), spatial_c, temporal_c]
             )
-        spatiotemporal_c = self.fc_c(spatiotemporal_c)
-
-        if self.global_geometry:
             return canonical_geometry_c, spatiotemporal_c
         else:
-            return spatiotemporal_c
+            return linear_cat(self.fc_c, [spatial_c, temporal_c])
 
 
 class SpatioTemporalResnetPointnetCDC_global_dyn(nn.Module):
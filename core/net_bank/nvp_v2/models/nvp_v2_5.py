@@ -1,6 +1,6 @@
 import torch
 from torch import masked_select, nn
-from torch.utils.checkpoint import checkpoint
+from core.net_bank.checkpoint_utils import checkpoint_call
 import logging
 from .projection_layer import get_projection_layer
 
@@ -142,6 +142,7 @@ class NVP_v2_5(nn.Module):
     ):
         super().__init__()
         self._checkpoint = False
+        self._checkpoint_segment = 0  # blocks per checkpointed segment, 0 for none
         self._normalize = block_normalize
         self._explicit_affine = explicit_affine
 
@@ -257,12 +258,60 @@ class NVP_v2_5(nn.Module):
         _, N, _, _ = x.shape
         return F[:, None].expand(-1, N, -1, -1)
 
+    def set_checkpointing(self, policy, every_k=1):
+        """
+        none; per-coupling checkpoints each coupling call; per-block each block of two couplings
+        and its code projector; every-k every k consecutive blocks as one segment
+        """
+        self._checkpoint = policy == "per-coupling"
+        self._checkpoint_segment = {"per-block": 1, "every-k": max(every_k, 1)}.get(policy, 0)
+
+    def _checkpointing(self):
+        return self.training and torch.is_grad_enabled()
+
     def _call(self, func, *args, **kwargs):
-        if self._checkpoint:
-            return checkpoint(func, *args, **kwargs)
+        if self._checkpoint and self._checkpointing():
+            return checkpoint_call(func, *args)
         else:
             return func(*args, **kwargs)
 
+    def _segments(self, idx):
+        k = self._checkpoint_segment if self._checkpointing() else 0
+        if k <= 0:
+            return [idx]
+        return [idx[i : i + k] for i in range(0, len(idx), k)]
+
+    def _call_segment(self, func, idx, F, x):
+        if self._checkpoint_segment > 0 and self._checkpointing():
+            return checkpoint_call(lambda _F, _x: func(idx, _F, _x), F, x)
+        return func(idx, F, x)
+
+    def _forward_blocks(self, idx, F, y):
+        for i in idx:
+            # get block condition code
+            Fi = self.code_projectors[i](F)
+            Fi = self._expand_features(Fi, y)
+            # first transformation
+            l1 = self.layers1[i]
+            y, _ = self._call(l1, Fi, y)
+            # second transformation
+            l2 = self.layers2[i]
+            y, _ = self._call(l2, Fi, y)
+        return y
+
+    def _inverse_blocks(self, idx, F, x):
+        for i in idx:
+            # get block condition code
+            Fi = self.code_projectors[i](F)
+            Fi = self._expand_features(Fi, x)
+            # reverse second transformation
+            l2 = self.layers2[i]
+            x, _ = self._call(l2.inverse, Fi, x)
+            # reverse first transformation
+            l1 = self.layers1[i]
+            x, _ = self._call(l1.inverse, Fi, x)
+        return x
+
     def _normalize_input(self, F, y):
         if not self._normalize:
             return 0, 1
@@ -290,16 +339,8 @@ class NVP_v2_5(nn.Module):
         # F: B,N,T,C x: B,N,T,3
         y = x
         y = torch.matmul(y.unsqueeze(-2), R).squeeze(-2) + t
-        for i in self.layer_idx:
-            # get block condition code
-            Fi = self.code_projectors[i](F)
-            Fi = self._expand_features(Fi, y)
-            # first transformation
-            l1 = self.layers1[i]
-            y, _ = self._call(l1, Fi, y)
-            # second transformation
-            l2 = self.layers2[i]
-            y, _ = self._call(l2, Fi, y)
+        for idx in self._segments(self.layer_idx):
+            y = self._call_segment(self._forward_blocks, idx, F, y)
         y = y / sigma + mu
         return y
 
@@ -311,17 +352,7 @@ class NVP_v2_5(nn.Module):
         x = y
         x = (x - mu) * sigma
         ldj = 0
-        for i in reversed(self.layer_idx):
-            # get block condition code
-            Fi = self.code_projectors[i](F)
-            Fi = self._expand_features(Fi, x)
-            # reverse second transformation
-            l2 = self.layers2[i]
-            x, _ = self._call(l2.inverse, Fi, x)
-            # ldj = ldj + ldji
-            # reverse first transformation
-            l1 = self.layers1[i]
-            x, _ = self._call(l1.inverse, Fi, x)
-            # ldj = ldj + ldji
+        for idx in self._segments(list(reversed(self.layer_idx))):
+            x = self._call_segment(self._inverse_blocks, idx, F, x)
         x = torch.matmul((x - t).unsqueeze(-2), R.transpose(-2, -1)).squeeze(-2)
         return x, ldj
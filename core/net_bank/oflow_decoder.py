@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from .oflow_point import ResnetBlockFC
@@ -58,6 +59,66 @@ class CResnetBlockConv1d(nn.Module):
 
         return x_s + dx
 
+    def bind(self, c):
+        """Precomputes the per sample affines of c, the affine of bn_1 is folded into fc_0
+        when bn_1 is an eval-mode batch norm.
+
+        Args:
+            c (tensor): latent conditioned code c, B x c_dim
+        """
+        bound = {"bn_0": bind_cbatchnorm(self.bn_0, c), "bn_1": bind_cbatchnorm(self.bn_1, c)}
+        if bound["bn_1"]["fold"]:
+            scale, shift = bound["bn_1"]["scale"], bound["bn_1"]["shift"]  # B,F,1
+            bound["fc_0_weight"] = scale * self.fc_0.weight.squeeze(-1).unsqueeze(0)  # B,F,F_in
+            bound["fc_0_bias"] = scale * self.fc_0.bias.reshape(1, -1, 1) + shift
+        return bound
+
+    def forward_bound(self, x, bound):
+        net = self.actvn(cbatchnorm_bound(self.bn_0, x, bound["bn_0"]))
+        if "fc_0_weight" in bound.keys():
+            net = torch.baddbmm(bound["fc_0_bias"], bound["fc_0_weight"], net)
+        else:
+            net = cbatchnorm_bound(self.bn_1, self.fc_0(net), bound["bn_1"])
+        dx = self.fc_1(self.actvn(net))
+
+        if self.shortcut is not None:
+            x_s = self.shortcut(x)
+        else:
+            x_s = x
+
+        return x_s + dx
+
+
+def bind_cbatchnorm(norm, c):
+    """Precomputes the affine of a conditional batch norm for the code c, an eval-mode batch norm
+    with running stats is folded into it, so that the normalization itself is skipped.
+
+    Args:
+        norm (CBatchNorm1d or CBatchNorm1d_legacy): conditional normalization layer
+        c (tensor): latent conditioned code c, B x c_dim
+    """
+    gamma, beta = norm.affine(c)  # B,F,1
+    bn = norm.bn
+    if isinstance(bn, nn.Identity):
+        # already folded into the gamma / beta layers
+        return {"scale": gamma, "shift": beta, "fold": True}
+    fold = (
+        isinstance(bn, nn.BatchNorm1d)
+        and not bn.training
+        and bn.track_running_stats
+        and bn.running_mean is not None
+    )
+    if not fold:
+        return {"scale": gamma, "shift": beta, "fold": False}
+    inv_std = torch.rsqrt(bn.running_var + bn.eps).reshape(1, -1, 1)
+    scale = gamma * inv_std
+    return {"scale": scale, "shift": beta - scale * bn.running_mean.reshape(1, -1, 1), "fold": True}
+
+
+def cbatchnorm_bound(norm, x, bound):
+    net = x if bound["fold"] else norm.bn(x)
+    return bound["scale"] * net + bound["shift"]
+
 
 class CBatchNorm1d(nn.Module):
     """Conditional batch normalization layer class.
@@ -92,17 +153,18 @@ class CBatchNorm1d(nn.Module):
         nn.init.ones_(self.conv_gamma.bias)
         nn.init.zeros_(self.conv_beta.bias)
 
-    def forward(self, x, c):
-        assert x.size(0) == c.size(0)
-        assert c.size(1) == self.c_dim
-
+    def affine(self, c):
         # c is assumed to be of size batch_size x c_dim x T
         if len(c.size()) == 2:
             c = c.unsqueeze(2)
+        return self.conv_gamma(c), self.conv_beta(c)
+
+    def forward(self, x, c):
+        assert x.size(0) == c.size(0)
+        assert c.size(1) == self.c_dim
 
         # Affine mapping
-        gamma = self.conv_gamma(c)
-        beta = self.conv_beta(c)
+        gamma, beta = self.affine(c)
 
         # Batchnorm
         net = self.bn(x)
@@ -144,13 +206,15 @@ class CBatchNorm1d_legacy(nn.Module):
         nn.init.ones_(self.fc_gamma.bias)
         nn.init.zeros_(self.fc_beta.bias)
 
+    def affine(self, c):
+        batch_size = c.size(0)
+        gamma = self.fc_gamma(c).view(batch_size, self.f_dim, 1)
+        beta = self.fc_beta(c).view(batch_size, self.f_dim, 1)
+        return gamma, beta
+
     def forward(self, x, c):
-        batch_size = x.size(0)
         # Affine mapping
-        gamma = self.fc_gamma(c)
-        beta = self.fc_beta(c)
-        gamma = gamma.view(batch_size, self.f_dim, 1)
-        beta = beta.view(batch_size, self.f_dim, 1)
+        gamma, beta = self.affine(c)
         # Batchnorm
         net = self.bn(x)
         out = gamma * net + beta
@@ -274,6 +338,10 @@ class DecoderCBatchNorm(nn.Module):
         else:
             self.actvn = lambda x: F.leaky_relu(x, 0.2)
 
+        # in eval mode the code bound by the last call is reused while the same c is passed
+        self.bind_cache = True
+        self._bound_c, self._bound_version, self._bound = None, None, None
+
     def forward(self, p, z, c, **kwargs):
         """Performs a forward pass through the network.
 
@@ -282,6 +350,8 @@ class DecoderCBatchNorm(nn.Module):
             z (tensor): latent code z
             c (tensor): latent conditioned code c
         """
+        if self.bindable(c):
+            return self.forward_bound(p, z, self.cached_bind(c))
         p = p.transpose(1, 2)
         batch_size, D, T = p.size()
         net = self.fc_p(p)
@@ -300,3 +370,63 @@ class DecoderCBatchNorm(nn.Module):
         out = out.squeeze(1)
 
         return out
+
+    def bindable(self, c):
+        return (
+            self.bind_cache
+            and not self.training
+            and c.dim() == 2
+            and not c.requires_grad
+            and isinstance(self.block0.fc_0, nn.Conv1d)
+            and not getattr(torch.jit, "is_tracing", lambda: False)()
+        )
+
+    def clear_bind_cache(self):
+        self._bound_c, self._bound_version, self._bound = None, None, None
+
+    def train(self, mode=True):
+        # the bound gamma / beta are only valid for the weights they were computed with, and keep
+        # c alive; eval() before a generation, a norm folding or a precision conversion drops them
+        self.clear_bind_cache()
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.clear_bind_cache()
+        return super()._load_from_state_dict(*args, **kwargs)
+
+    def cached_bind(self, c):
+        if not (c is self._bound_c and c._version == self._bound_version):
+            with torch.no_grad():
+                self._bound = self.bind_code(c)
+            self._bound_c, self._bound_version = c, c._version
+        return self._bound
+
+    def bind_code(self, c):
+        """Precomputes the gamma / beta of all conditional batch norms for the code c, so that
+        the following point batches only run the point MLP (see forward_bound).
+
+        Args:
+            c (tensor): latent conditioned code c, B x c_dim
+        """
+        blocks = [self.block0, self.block1, self.block2, self.block3, self.block4]
+        return {"blocks": [block.bind(c) for block in blocks], "bn": bind_cbatchnorm(self.bn, c)}
+
+    def forward_bound(self, p, z, bound):
+        """Performs a forward pass with a code bound by bind_code.
+
+        Args:
+            p (tensor): points tensor
+            z (tensor): latent code z
+            bound (dict): output of bind_code
+        """
+        net = self.fc_p(p.transpose(1, 2))
+
+        if self.z_dim != 0:
+            net = net + self.fc_z(z).unsqueeze(2)
+
+        blocks = [self.block0, self.block1, self.block2, self.block3, self.block4]
+        for block, block_bound in zip(blocks, bound["blocks"]):
+            net = block.forward_bound(net, block_bound)
+
+        out = self.fc_out(self.actvn(cbatchnorm_bound(self.bn, net, bound["bn"])))
+        return out.squeeze(1)
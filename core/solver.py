@@ -5,39 +5,42 @@ from copy import deepcopy
 import os
 import logging
 import torch
-from torch.utils.data import DataLoader
 import gc
+from core.models.utils.latent_cache import hash_checkpoint_files
+from dataset.seeded_sampling import SeededDataset, ResumableSampler
+from dataset.loader_utils import build_dataloader, loader_shuffle
+from dataset.loader_probe import TimedDataset, LoaderProbe
 
 
 class Solver(object):
     def __init__(self, cfg, model, datasets_dict, logger):
         self.cfg = deepcopy(cfg)
 
+        # the data order and the sample randomness only depend on (seed, epoch, index)
+        self.seed = int(cfg["rand_seed"])
+        self.seeded_sampling = False
+        if "seeded_sampling" in cfg["dataset"].keys():
+            self.seeded_sampling = bool(cfg["dataset"]["seeded_sampling"])
+
+        # time the waits on the loaders, the stats go to the loader logger
+        self.loader_probe = None
+        if "loader_probe" in cfg["logging"].keys() and cfg["logging"]["loader_probe"]:
+            self.loader_probe = LoaderProbe()
+
         self.modes = self.cfg["modes"]
         self.dataloader_dict = {}
         for mode in cfg["modes"]:  # prepare dataloader
-            if mode.lower() == "train" or cfg["evaluation"]["batch_size"] < 0:
-                bs = cfg["training"]["batch_size"]
-            else:
-                bs = cfg["evaluation"]["batch_size"]
-            # if mode.lower() == "train":
-            #     n_workers = cfg["dataset"]["num_workers"]
-            # else:
-            #     n_workers = min(4, cfg["dataset"]["num_workers"])
-            n_workers = cfg["dataset"]["num_workers"]
-            # decide shuffle
-            shuffle_dataset = True if mode in ["train"] else False
-            if "shuffle" in cfg["evaluation"].keys():
-                if cfg["evaluation"]["shuffle"]:
-                    shuffle_dataset = True
-            logging.debug(f"{mode} dataloader use pin_mem={cfg['dataset']['pin_mem']}")
-            self.dataloader_dict[mode] = DataLoader(
-                datasets_dict[mode],
-                batch_size=bs,
-                shuffle=shuffle_dataset,
-                num_workers=n_workers,
-                pin_memory=cfg["dataset"]["pin_mem"],
-                drop_last=mode == "train",  # ! check this
+            shuffle_dataset = loader_shuffle(cfg, mode)
+            sampler = self.make_sampler(mode, datasets_dict[mode], shuffle_dataset)
+            dataset = datasets_dict[mode]
+            if self.loader_probe is not None:
+                dataset = TimedDataset(dataset)
+            self.dataloader_dict[mode] = build_dataloader(
+                cfg,
+                mode,
+                SeededDataset(dataset, self.seed) if self.seeded_sampling else dataset,
+                shuffle_dataset,
+                sampler,
             )
         self.model = model
         self.logger = logger
@@ -45,6 +48,8 @@ class Solver(object):
         self.current_epoch = 1
         self.batch_count = 0
         self.batch_in_epoch_count = 0
+        self.train_batch_in_epoch, self.train_batch_total = 0, 0
+        self.resume_batch_in_epoch = 0
         self.total_epoch = cfg["training"]["total_epoch"]
 
         self.eval_every_epoch = int(cfg["evaluation"]["eval_every_epoch"])
@@ -55,6 +60,7 @@ class Solver(object):
         self.lr_config = self.init_lr_schedule()
 
         # handle resume and initialization
+        self.checkpoint_files = []
         if cfg["resume"]:  # resume > initialization
             self.solver_resume()
         elif len(cfg["training"]["initialize_network_file"]) > 0:
@@ -65,7 +71,14 @@ class Solver(object):
                 cfg["training"]["initialize_network_file"],
                 cfg["training"]["initialize_network_name"],
             )
-        self.model.to_gpus()
+        self.to_devices()
+
+        # cache the test latents on disk, only valid if the weights are fixed during the run
+        if "latent_cache" in cfg["evaluation"].keys() and cfg["evaluation"]["latent_cache"]:
+            if "train" in self.modes or len(self.checkpoint_files) == 0:
+                logging.warning("Latent cache needs a loaded checkpoint and no train mode, skip")
+            else:
+                self.model.set_latent_cache(hash_checkpoint_files(self.checkpoint_files))
 
         # control viz in model and logger
         log_config = self.cfg["logging"]
@@ -89,22 +102,82 @@ class Solver(object):
                     checkpoint_fn = os.path.join(checkpoint_dir, fn)
         else:
             checkpoint_fn = os.path.join(checkpoint_dir, resume_key + ".pt")
-        checkpoint = torch.load(checkpoint_fn)
+        checkpoint = torch.load(checkpoint_fn, map_location="cpu")
         logging.info("Checkpoint {} Loaded".format(checkpoint_fn))
+        self.checkpoint_files = [checkpoint_fn]
         self.current_epoch = checkpoint["epoch"]
         self.batch_count = checkpoint["batch"]
         self.model.model_resume(checkpoint, is_initialization=False)
+        if self.resume_inside_epoch(checkpoint):
+            # the lr decay of this epoch is not due yet
+            return
         self.adjust_lr()
         self.current_epoch += 1
         return
 
+    def resume_inside_epoch(self, checkpoint):
+        """
+        If the checkpoint is saved inside a training epoch, continue that epoch after its
+        consumed batches; the skipped samples are not loaded
+        """
+        if "sampler_state_dict" not in checkpoint.keys() or "train" not in self.modes:
+            return False
+        state = checkpoint["sampler_state_dict"]
+        if state["train_batch_in_epoch"] >= state["train_batch_total"]:
+            return False
+        loader = self.dataloader_dict["train"]
+        if not self.seeded_sampling or state["batch_size"] != loader.batch_size:
+            logging.warning(
+                "Checkpoint is inside epoch {}, but the data order can not be reproduced "
+                "without seeded sampling and the same batch size, restart this epoch".format(
+                    self.current_epoch
+                )
+            )
+            return True
+        if state["seed"] != self.seed:
+            logging.warning("Resume with seed {}, the checkpoint uses {}".format(self.seed, state["seed"]))
+        self.resume_batch_in_epoch = state["train_batch_in_epoch"]
+        loader.sampler.skip(self.resume_batch_in_epoch * loader.batch_size)
+        logging.info(
+            "Resume epoch {} after batch {}/{}".format(
+                self.current_epoch, self.resume_batch_in_epoch, state["train_batch_total"]
+            )
+        )
+        return True
+
+    def sampler_state_dict(self):
+        return {
+            "seed": self.seed,
+            "epoch": self.current_epoch,
+            "train_batch_in_epoch": self.train_batch_in_epoch,
+            "train_batch_total": self.train_batch_total,
+            "batch_size": self.cfg["training"]["batch_size"],
+        }
+
+    def save_checkpoint(self, filepath, additional_dict=None):
+        additional_dict = {} if additional_dict is None else dict(additional_dict)
+        additional_dict["sampler_state_dict"] = self.sampler_state_dict()
+        self.model.save_checkpoint(filepath, additional_dict)
+
     def initialize_from_file(self, filelist, network_name):
         for fn in filelist:
-            checkpoint = torch.load(fn)
+            checkpoint = torch.load(fn, map_location="cpu")
             logging.info("Initialization {} Loaded".format(fn))
             self.model.model_resume(checkpoint, is_initialization=True, network_name=network_name)
+        self.checkpoint_files = list(filelist)
         return
 
+    def make_sampler(self, mode, dataset, shuffle):
+        """
+        None for the default sampler of the DataLoader
+        """
+        if self.seeded_sampling:
+            return ResumableSampler(len(dataset), self.seed, shuffle)
+        return None
+
+    def to_devices(self):
+        self.model.to_gpus()
+
     def run(self):
         logging.info("Start Running...")
         while self.current_epoch <= self.total_epoch:
@@ -113,26 +186,61 @@ class Solver(object):
                     torch.cuda.empty_cache()
                 if mode.lower() != "train" and self.current_epoch % self.eval_every_epoch != 0:
                     continue  # for val and test, skip if not meets eval epoch interval
-                batch_total_num = len(self.dataloader_dict[mode])
-                self.batch_in_epoch_count = 0
-                for batch in iter(self.dataloader_dict[mode]):
-                    self.batch_in_epoch_count += 1
-                    self.batch_count += 1
-                    self.viz_flag = self.viz_state(mode)
-                    batch[0]["epoch"] = self.current_epoch
-                    if mode == "train":
-                        batch = self.model.train_batch(batch, self.viz_flag)
-                    else:
-                        batch = self.model.val_batch(batch, self.viz_flag)
-                    batch = self.wrap_output(batch, batch_total_num, mode=mode)
-                    self.logger.log_batch(batch)
-                self.logger.log_phase()
-                gc.collect()
+                self.run_phase(mode)
             self.adjust_lr()
             self.current_epoch += 1
-        self.logger.end_log()
+        if self.model.latent_cache is not None:
+            logging.info(
+                "Latent cache hit {} miss {} samples".format(
+                    self.model.latent_cache.hit_count, self.model.latent_cache.miss_count
+                )
+            )
+        self.end_log()
         return
 
+    def run_phase(self, mode):
+        sampler = self.dataloader_dict[mode].sampler
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(self.current_epoch)
+        batch_total_num = len(self.dataloader_dict[mode])
+        self.batch_in_epoch_count = 0
+        if mode == "train":
+            # the loader of a resumed epoch only has the remaining batches
+            self.batch_in_epoch_count = self.resume_batch_in_epoch
+            batch_total_num += self.resume_batch_in_epoch
+            self.resume_batch_in_epoch = 0
+            self.train_batch_in_epoch = self.batch_in_epoch_count
+            self.train_batch_total = batch_total_num
+        for batch in self.iterate_loader(mode):
+            self.batch_in_epoch_count += 1
+            self.batch_count += 1
+            if mode == "train":
+                self.train_batch_in_epoch = self.batch_in_epoch_count
+            self.viz_flag = self.viz_state(mode)
+            batch[0]["epoch"] = self.current_epoch
+            if mode == "train":
+                batch = self.model.train_batch(batch, self.viz_flag)
+            else:
+                batch = self.model.val_batch(batch, self.viz_flag)
+            batch = self.wrap_output(batch, batch_total_num, mode=mode)
+            self.log_batch(batch)
+        self.log_phase()
+        gc.collect()
+
+    def iterate_loader(self, mode):
+        if self.loader_probe is None:
+            return iter(self.dataloader_dict[mode])
+        return self.loader_probe.iterate(self.dataloader_dict[mode])
+
+    def log_batch(self, batch):
+        self.logger.log_batch(batch)
+
+    def log_phase(self):
+        self.logger.log_phase()
+
+    def end_log(self):
+        self.logger.end_log()
+
     def wrap_output(self, batch, batch_total, mode="train"):
         assert "meta_info" in batch.keys()
         wrapped = dict()
@@ -146,9 +254,12 @@ class Solver(object):
         wrapped["phase"] = mode.lower()
 
         wrapped["output_parser"] = self.model.output_specs
-        wrapped["save_method"] = self.model.save_checkpoint
+        wrapped["save_method"] = self.save_checkpoint
         wrapped["meta_info"] = batch["meta_info"]
         wrapped["data"] = batch
+        if self.loader_probe is not None:
+            wrapped["loader_stats"] = self.loader_probe.batch_stats()
+            wrapped["device"] = self.model.device.type
 
         return wrapped
 
@@ -181,8 +292,7 @@ class Solver(object):
         epoch = self.current_epoch if specific_epoch is None else specific_epoch
         for k in self.lr_config.keys():
             if epoch in self.lr_config[k]["decay_schedule"]:
-                optimizer = self.model.optimizer_dict[k]
-                for param_group in optimizer.param_groups:
+                for param_group in self.model.get_param_groups(k):
                     lr_before = param_group["lr"]
                     factor = self.lr_config[k]["decay_factor"][
                         self.lr_config[k]["decay_schedule"].index(epoch)
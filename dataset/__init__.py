@@ -1,6 +1,19 @@
 import importlib
+from .dataset_shard import ShardDataset
 
 
 def get_dataset(cfg):
     module = importlib.import_module('dataset.' + cfg['dataset']['dataset_name'])
     return module.Dataset
+
+
+def get_shard(cfg, dataset, mode):
+    """
+    The evaluation.shard_id slice of a test dataset when evaluation.num_shards > 1
+    """
+    num_shards = 1
+    if "num_shards" in cfg["evaluation"].keys():
+        num_shards = int(cfg["evaluation"]["num_shards"])
+    if num_shards <= 1 or not mode.startswith("test"):
+        return dataset
+    return ShardDataset(dataset, int(cfg["evaluation"]["shard_id"]), num_shards)
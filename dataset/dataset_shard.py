@@ -0,0 +1,31 @@
+"""
+One contiguous slice of a dataset for sharded evaluation, the samples keep their index in the
+full dataset, so the viz_id and the row order of the merged reports are the same as unsharded
+"""
+import logging
+from torch.utils.data import Dataset
+
+
+def shard_bounds(n, shard_id, num_shards):
+    # the first n % num_shards shards get one more sample
+    size, rest = divmod(n, num_shards)
+    start = shard_id * size + min(shard_id, rest)
+    return start, start + size + (1 if shard_id < rest else 0)
+
+
+class ShardDataset(Dataset):
+    def __init__(self, dataset, shard_id, num_shards):
+        assert 0 <= shard_id < num_shards, "Shard {} of {} invalid".format(shard_id, num_shards)
+        self.dataset = dataset
+        self.start, self.end = shard_bounds(len(dataset), shard_id, num_shards)
+        logging.info(
+            "Shard {}/{}: samples [{}, {}) of {}".format(
+                shard_id, num_shards, self.start, self.end, len(dataset)
+            )
+        )
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        return self.dataset[self.start + index]
@@ -6,6 +6,7 @@ import json
 import os
 import numpy as np
 from os.path import join
+from dataset.packed_occ import SHUFFLED_SUFFIX, read_chunk_slices
 
 
 class Dataset(Dataset):
@@ -42,6 +43,11 @@ class Dataset(Dataset):
         if "camera_frame" in cfg["dataset"].keys():
             self.use_camera_frame = cfg["dataset"]["camera_frame"]
 
+        # training reads slices of the pre-shuffled occupancy chunks, see preshuffle_occ.py
+        self.preshuffled_occ = False
+        if "preshuffled_occ" in cfg["dataset"].keys():
+            self.preshuffled_occ = cfg["dataset"]["preshuffled_occ"]
+
         self.oflow_flag = False
         # O-Flow let points to be at t=0 and points_t to be at t during training, during testing, points are for full time
         if "oflow_flag" in cfg["dataset"].keys():
@@ -129,6 +135,14 @@ class Dataset(Dataset):
     def __len__(self) -> int:
         return len(self.meta_list)
 
+    def get_viz_id(self, index: int):
+        # only from the meta list, without loading the sample
+        meta_info = self.meta_list[index]
+        start = meta_info["start"]
+        if self.input_type == "pcl":
+            return f"{self.mode}_{os.path.basename(meta_info['seq_dir'])}_start{start}_{index}"
+        return f"{self.mode}_{os.path.basename(meta_info['seq_dir'])}_{meta_info['view']}_start{start}_{index}"
+
     def get_chunk_index(self, n, type, random_flag):
         assert type in ["occ", "corr"]
         n_chunk_file = int(np.ceil(n / float(self.chunk_size)))
@@ -161,11 +175,7 @@ class Dataset(Dataset):
         ret = {}
         meta_info = self.meta_list[index]
         start = meta_info["start"]
-        if self.input_type == "pcl":
-            viz_id = f"{self.mode}_{os.path.basename(meta_info['seq_dir'])}_start{start}_{index}"
-        else:
-            viz_id = f"{self.mode}_{os.path.basename(meta_info['seq_dir'])}_{meta_info['view']}_start{start}_{index}"
-        meta_info["viz_id"] = viz_id
+        meta_info["viz_id"] = self.get_viz_id(index)
         meta_info["mode"] = self.mode
 
         seq_dir = meta_info["seq_dir"]
@@ -260,7 +270,14 @@ class Dataset(Dataset):
             ind_list = np.array([i for i in range(self.seq_len)])
         queries, occ_state = [], []
         for i in ind_list:
-            if self.mode == "train":
+            if self.mode == "train" and self.preshuffled_occ:
+                occ_dir = join(base_root, "c_occ" + SHUFFLED_SUFFIX)
+                file_ind = self.get_chunk_index(max(self.n_nss, self.n_uni), "occ", True)
+                un, un_o = read_chunk_slices(occ_dir, i + start, "uni", file_ind, self.n_uni)
+                ns, ns_o = read_chunk_slices(occ_dir, i + start, "nss", file_ind, self.n_nss)
+                _q = np.concatenate([un, ns], axis=0)
+                _o = np.concatenate([un_o, ns_o], axis=0)
+            elif self.mode == "train":
                 _occ_data = self.load(
                     join(base_root, "c_occ"), i + start, max(self.n_nss, self.n_uni), type="occ"
                 )
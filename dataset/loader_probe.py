@@ -0,0 +1,126 @@
+"""
+Where the time of a phase goes: the time blocked in next() on the loader against the compute of
+each batch, the load latency of each sample per worker and the batches queued ahead, to tell
+if the training / evaluation is starved by the data pipeline
+"""
+import time
+import numpy as np
+from torch.utils.data import Dataset, get_worker_info
+
+PROBE_KEYS = ["load_time", "worker_id"]
+
+
+class TimedDataset(Dataset):
+    """
+    Add the load time of a sample and the id of the worker loading it (-1 in the main process)
+    to its meta info, the probe removes them from the batch again
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        start_t = time.time()
+        data, meta_info = self.dataset[index]
+        meta_info = dict(meta_info)  # the meta info list of the dataset is not modified
+        meta_info["load_time"] = time.time() - start_t
+        worker_info = get_worker_info()
+        meta_info["worker_id"] = -1 if worker_info is None else worker_info.id
+        return data, meta_info
+
+
+def queue_depth(iterator):
+    """
+    (batches requested from the workers and not consumed yet, batches already loaded among them),
+    read from private attributes of the multi-process iterator; (0, 0) for the in-process loader
+    or a torch version where they differ
+    """
+    try:
+        outstanding = int(iterator._tasks_outstanding)
+        # batches arrived before their turn wait in _task_info, the others in the data queue
+        ready = len([v for v in iterator._task_info.values() if len(v) == 2])
+    except (AttributeError, TypeError, ValueError):
+        return 0, 0
+    try:
+        ready += iterator._data_queue.qsize()
+    except (NotImplementedError, AttributeError):
+        pass
+    return outstanding, ready
+
+
+class LoaderProbe(object):
+    def __init__(self):
+        self.wait_t, self.yield_t = 0.0, None
+        self.outstanding, self.ready = 0, 0
+        self.sample_time, self.worker_id = [], []
+        self.first = False
+
+    def iterate(self, loader):
+        """
+        Iterate the loader like iter(loader), timing each next()
+        """
+        iterator = iter(loader)
+        self.first = True
+        while True:
+            start_t = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.wait_t = time.time() - start_t
+            self.outstanding, self.ready = queue_depth(iterator)
+            meta_info = batch[1]
+            self.sample_time = [float(t) for t in meta_info.pop("load_time", [])]
+            self.worker_id = [int(i) for i in meta_info.pop("worker_id", [])]
+            self.yield_t = time.time()
+            yield batch
+            self.first = False
+
+    def batch_stats(self):
+        """
+        Stats of the current batch, the compute is the time since the batch was yielded
+        """
+        worker_ms = {}
+        for i, t in zip(self.worker_id, self.sample_time):
+            worker_ms.setdefault(i, []).append(t * 1000.0)
+        return {
+            "first": self.first,  # includes the worker startup of the phase
+            "wait_ms": self.wait_t * 1000.0,
+            "compute_ms": (time.time() - self.yield_t) * 1000.0,
+            "outstanding": self.outstanding,
+            "ready": self.ready,
+            "sample_ms": [t * 1000.0 for t in self.sample_time],
+            "worker_ms": {i: float(np.mean(v)) for i, v in worker_ms.items()},
+        }
+
+
+def summarize(stats_list, starved_fraction):
+    """
+    Phase summary of the batch stats, the first batch (worker startup) is reported apart
+    """
+    steady = [s for s in stats_list if not s["first"]]
+    if len(steady) == 0:
+        steady = stats_list
+    wait = sum([s["wait_ms"] for s in steady])
+    compute = sum([s["compute_ms"] for s in steady])
+    sample_ms = sum([s["sample_ms"] for s in steady], [])
+    worker_ms = {}
+    for s in steady:
+        for i, v in s["worker_ms"].items():
+            worker_ms.setdefault(i, []).append(v)
+    summary = {
+        "startup_ms": stats_list[0]["wait_ms"] if stats_list[0]["first"] else 0.0,
+        "wait_ms": wait / len(steady),
+        "compute_ms": compute / len(steady),
+        "wait_fraction": wait / max(wait + compute, 1e-6),
+        "ready": float(np.mean([s["ready"] for s in steady])),
+        "outstanding": float(np.mean([s["outstanding"] for s in steady])),
+        "sample_ms": float(np.mean(sample_ms)) if len(sample_ms) > 0 else 0.0,
+        "sample_p95_ms": float(np.percentile(sample_ms, 95)) if len(sample_ms) > 0 else 0.0,
+        "worker_ms": {i: float(np.mean(v)) for i, v in worker_ms.items()},
+    }
+    summary["starved"] = summary["wait_fraction"] > starved_fraction
+    return summary
@@ -0,0 +1,78 @@
+"""
+DataLoader construction from the config, shared by the solver and benchmark_loader.py
+"""
+import os
+import random
+import functools
+import logging
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+
+def loader_batch_size(cfg, mode):
+    if mode.lower() == "train" or cfg["evaluation"]["batch_size"] < 0:
+        return cfg["training"]["batch_size"]
+    return cfg["evaluation"]["batch_size"]
+
+
+def loader_shuffle(cfg, mode):
+    shuffle = True if mode in ["train"] else False
+    if "shuffle" in cfg["evaluation"].keys():
+        if cfg["evaluation"]["shuffle"]:
+            shuffle = True
+    return shuffle
+
+
+def worker_init(worker_id, num_workers, affinity):
+    """
+    Seed np.random and random of each worker differently (torch seeds its own per worker), and
+    optionally pin the worker to its own slice of the cpus of the process
+    """
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+    if affinity and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        if num_workers <= len(cpus):
+            cpus = np.array_split(cpus, num_workers)[worker_id].tolist()
+        else:
+            cpus = [cpus[worker_id % len(cpus)]]
+        os.sched_setaffinity(0, cpus)
+
+
+def loader_kwargs(cfg, mode):
+    """
+    Worker settings of a phase: the train loader and the val / test loaders have their own pools
+    """
+    n_workers = cfg["dataset"]["num_workers"]
+    if mode.lower() != "train" and "num_workers_eval" in cfg["dataset"].keys():
+        if cfg["dataset"]["num_workers_eval"] >= 0:
+            n_workers = cfg["dataset"]["num_workers_eval"]
+    kwargs = {"num_workers": n_workers, "pin_memory": cfg["dataset"]["pin_mem"]}
+    if n_workers > 0:
+        affinity = False
+        if "worker_affinity" in cfg["dataset"].keys():
+            affinity = bool(cfg["dataset"]["worker_affinity"])
+        kwargs["worker_init_fn"] = functools.partial(
+            worker_init, num_workers=n_workers, affinity=affinity
+        )
+        # keep the workers and their open files alive over epochs
+        if "persistent_workers" in cfg["dataset"].keys():
+            kwargs["persistent_workers"] = bool(cfg["dataset"]["persistent_workers"])
+        if "prefetch_factor" in cfg["dataset"].keys():
+            kwargs["prefetch_factor"] = int(cfg["dataset"]["prefetch_factor"])
+    return kwargs
+
+
+def build_dataloader(cfg, mode, dataset, shuffle, sampler=None):
+    kwargs = loader_kwargs(cfg, mode)
+    logging.debug("{} dataloader with {}".format(mode, kwargs))
+    return DataLoader(
+        dataset,
+        batch_size=loader_batch_size(cfg, mode),
+        shuffle=shuffle if sampler is None else False,
+        sampler=sampler,
+        drop_last=mode == "train",  # ! check this
+        **kwargs
+    )
@@ -47,13 +47,19 @@ class Dataset(Dataset):
     def __len__(self) -> int:
         return len(self.dataset)
 
+    def get_viz_id(self, index: int):
+        # only from the model list, without loading the sample; the keys added by __getitem__
+        # are skipped, so the id is the same on every access
+        viz_id = "{}_".format(index)
+        for k, v in self.dataset.models[index].items():
+            if k not in ["viz_id", "mode"]:
+                viz_id += str(v) + "_"
+        return viz_id
+
     def __getitem__(self, index: int):
         data = self.dataset.__getitem__(index)
         meta_info = self.dataset.models[index]
-        viz_id = "{}_".format(index)
-        for v in meta_info.values():
-            viz_id += str(v) + "_"
-        meta_info["viz_id"] = viz_id
+        meta_info["viz_id"] = self.get_viz_id(index)
         meta_info["mode"] = self.mode
         if "points" in data.keys():
             if data["points"].ndim == 3:
@@ -173,6 +179,9 @@ def get_data_fields(mode, cfg):
         if cfg["dataset"]["oflow_config"]["training_multi_files"]:
             training_multi_files = True
             logging.info("Oflow D-FAUST Points Field use multi files to speed up disk performation")
+    preshuffled = False
+    if "preshuffled_occ" in cfg["dataset"].keys():
+        preshuffled = cfg["dataset"]["preshuffled_occ"]
 
     if mode == "train":
         if cfg["model"]["loss_recon"]:
@@ -184,6 +193,7 @@ def get_data_fields(mode, cfg):
                     seq_len=seq_len_train,
                     unpackbits=unpackbits,
                     use_multi_files=training_multi_files,
+                    preshuffled=preshuffled,
                 )
             else:
                 fields["points"] = pts_iou_field(
@@ -194,6 +204,7 @@ def get_data_fields(mode, cfg):
                     fixed_time_step=0,
                     unpackbits=unpackbits,
                     use_multi_files=training_multi_files,
+                    preshuffled=preshuffled,
                 )
             fields["points_t"] = pts_iou_field(
                 p_folder,
@@ -202,6 +213,7 @@ def get_data_fields(mode, cfg):
                 unpackbits=unpackbits,
                 not_choose_last=not_choose_last,
                 use_multi_files=training_multi_files,
+                preshuffled=preshuffled,
             )
     # only training can be boost by multi-files
     # modify here, if not train, val should also load the same as the test
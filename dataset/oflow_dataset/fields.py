@@ -8,6 +8,7 @@ import trimesh
 from .core import Field
 import torch
 from .transforms import SubsamplePointcloudSeq
+from ..packed_occ import SHUFFLED_SUFFIX, read_slice
 
 
 class IndexField(Field):
@@ -67,6 +68,7 @@ class PointsSubseqField(Field):
         all_steps (bool): whether to return all time steps
         fixed_time_step (int): if and which fixed time step to use
         unpackbits (bool): whether to unpack bits
+        preshuffled (bool): read transform.N points per step from the pre-shuffled folder
     """
 
     def __init__(
@@ -80,6 +82,7 @@ class PointsSubseqField(Field):
         unpackbits=False,
         not_choose_last=False,
         use_multi_files=False,
+        preshuffled=False,
         **kwargs
     ):
         self.folder_name = folder_name
@@ -96,10 +99,21 @@ class PointsSubseqField(Field):
         if self.use_multi_files:
             assert transform is not None
             self.N_files = int(np.ceil(transform.N / 10000))
+        # a contiguous slice of the shuffled points replaces the subsampling transform
+        self.preshuffled = preshuffled
+        if self.preshuffled:
+            assert transform is not None
+            self.folder_name = folder_name + SHUFFLED_SUFFIX
 
     def load_np(self, fn):
         assert "_" not in fn[-6:]
-        if self.use_multi_files:
+        if self.preshuffled:
+            out = dict(np.load(fn))
+            out["points"], out["occupancies"] = read_slice(fn[:-4], "points", self.transform.N)
+            if not self.unpackbits:
+                out["occupancies"] = np.unpackbits(out["occupancies"])[: out["points"].shape[0]]
+            return out
+        elif self.use_multi_files:
             idx = np.random.choice(replace=False, a=10, size=self.N_files).tolist()
             out = {}
             for i in idx:
@@ -323,7 +337,7 @@ class PointsSubseqField(Field):
         else:
             data = self.load_single_step(files, points_dict, loc0, scale0)
 
-        if self.transform is not None:
+        if self.transform is not None and not self.preshuffled:
             data = self.transform(data)
         return data
 
@@ -0,0 +1,75 @@
+"""
+Pre-shuffled occupancy format (dataset.preshuffled_occ), written by preshuffle_occ.py into
+<occ folder>_shuffled next to the original folder: the query points of each file are shuffled
+once and stored as <file>.<set>.xyz.npy with the occupancy bits packed in the same order as
+<file>.<set>.occ.npy, the other arrays (loc, scale) stay in <file>.npz. A random subset is then
+a contiguous slice read through a memory map, and only the bytes of its bits are unpacked
+"""
+import os
+import numpy as np
+
+SHUFFLED_SUFFIX = "_shuffled"
+
+# dataset name: (occ folder of each sequence, [(set name, xyz key, occ key, occ kind)]),
+# occ kind "packed" is np.packbits, "sdf" is occupied where < 0, "bool" is unpacked 0/1
+PRESHUFFLE_SPECS = {
+    "dt4d_animal_v3": (
+        "c_occ",
+        [("uni", "uni_xyz", "uni_occ", "packed"), ("nss", "nss_xyz", "nss_occ", "packed")],
+    ),
+    "shape2motion": (
+        "implicit",
+        [("uni", "uni_xyz", "uni_occ", "sdf"), ("nss", "nss_xyz", "nss_occ", "sdf")],
+    ),
+}
+
+
+def occ_bits(occ, kind, n):
+    if kind == "packed":
+        return np.unpackbits(occ)[:n]
+    if kind == "sdf":
+        return (occ < 0).astype(np.uint8)
+    return occ.astype(np.uint8)
+
+
+def preshuffle_file(src_fn, dst_dir, sets, rng):
+    """
+    Write the shuffled sets of one .npz file into dst_dir
+    """
+    data = np.load(src_fn)
+    stem = os.path.join(dst_dir, os.path.basename(src_fn)[:-4])
+    occ_keys = []
+    for name, xyz_key, occ_key, kind in sets:
+        xyz = data[xyz_key]
+        bits = occ_bits(data[occ_key], kind, xyz.shape[0])
+        perm = rng.permutation(xyz.shape[0])
+        np.save("{}.{}.xyz.npy".format(stem, name), xyz[perm])
+        np.save("{}.{}.occ.npy".format(stem, name), np.packbits(bits[perm]))
+        occ_keys += [xyz_key, occ_key]
+    np.savez(stem + ".npz", **{k: data[k] for k in data.files if k not in occ_keys})
+
+
+def read_slice(stem, name, n, random_flag=True):
+    """
+    n consecutive points of a shuffled set and their packed occupancy bytes, the start is a
+    multiple of 8 so the slice of the packed array is exactly the packed bits of the points;
+    decode with np.unpackbits(occ)[:len(xyz)]
+    """
+    xyz = np.load("{}.{}.xyz.npy".format(stem, name), mmap_mode="r")
+    packed = np.load("{}.{}.occ.npy".format(stem, name), mmap_mode="r")
+    m = min(n, xyz.shape[0])
+    start = 8 * np.random.randint((xyz.shape[0] - m) // 8 + 1) if random_flag else 0
+    return np.array(xyz[start : start + m]), np.array(packed[start // 8 : (start + m + 7) // 8])
+
+
+def read_chunk_slices(dir, id, name, file_ind, n):
+    """
+    n points of a set over the chunk files {id}_{ind}, an equal slice from each chunk
+    """
+    n_per_file = int(np.ceil(n / float(len(file_ind))))
+    xyz_list, occ_list = [], []
+    for ind in file_ind:
+        xyz, occ = read_slice(os.path.join(dir, f"{id}_{ind}"), name, n_per_file)
+        xyz_list.append(xyz)
+        occ_list.append(np.unpackbits(occ)[: xyz.shape[0]])
+    return np.concatenate(xyz_list, axis=0)[:n], np.concatenate(occ_list, axis=0)[:n]
@@ -0,0 +1,99 @@
+"""
+Reproducible data order and per-sample randomness (dataset.seeded_sampling, off by default):
+the sampler yields (epoch, index) and the random generators (np.random, random, torch cpu) of
+the worker loading a sample are reseeded from (seed, epoch, index), so a sample is the same
+whichever worker loads it and wherever the run resumes; in the main process (num_workers 0) the
+generators are restored after the sample, so the randomness of the model does not depend on it.
+The sampler skips the consumed samples of a resumed epoch without loading them
+"""
+import random
+import contextlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler, get_worker_info
+
+
+def derive_seed(*keys):
+    return int(np.random.SeedSequence([int(k) for k in keys]).generate_state(1)[0])
+
+
+def seed_sample_rng(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+    torch.default_generator.manual_seed(seed)
+
+
+@contextlib.contextmanager
+def restored_rng():
+    # the global generators of the main process are only borrowed by the sample
+    np_state, py_state, torch_state = np.random.get_state(), random.getstate(), torch.get_rng_state()
+    try:
+        yield
+    finally:
+        np.random.set_state(np_state)
+        random.setstate(py_state)
+        torch.set_rng_state(torch_state)
+
+
+class SeededDataset(Dataset):
+    def __init__(self, dataset, seed):
+        self.dataset = dataset
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, key):
+        epoch, index = key
+        if get_worker_info() is not None:
+            seed_sample_rng(derive_seed(self.seed, epoch, index))
+            return self.dataset[index]
+        with restored_rng():
+            seed_sample_rng(derive_seed(self.seed, epoch, index))
+            return self.dataset[index]
+
+
+class ResumableSampler(Sampler):
+    """
+    The order of an epoch only depends on (seed, epoch); with num_replicas > 1 each rank takes
+    every num_replicas-th index, padded to the same length as DistributedSampler
+    """
+
+    def __init__(self, n, seed, shuffle, num_replicas=1, rank=0):
+        self.n = n
+        self.seed = seed
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.n_skip = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def skip(self, n_samples):
+        """
+        Skip the first n_samples of the next iteration, for resuming inside an epoch
+        """
+        self.n_skip = n_samples
+
+    def indices(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(derive_seed(self.seed, self.epoch))
+            indices = torch.randperm(self.n, generator=g).tolist()
+        else:
+            indices = list(range(self.n))
+        if self.num_replicas > 1:
+            total = int(np.ceil(self.n / self.num_replicas)) * self.num_replicas
+            indices += (indices * self.num_replicas)[: total - self.n]
+            indices = indices[self.rank : total : self.num_replicas]
+        return indices[self.n_skip :]
+
+    def __iter__(self):
+        indices = self.indices()
+        self.n_skip = 0
+        return iter([(self.epoch, i) for i in indices])
+
+    def __len__(self):
+        return len(self.indices())
@@ -6,6 +6,7 @@ import json
 import os
 import numpy as np
 from os.path import join
+from dataset.packed_occ import SHUFFLED_SUFFIX, read_chunk_slices
 
 
 class Dataset(Dataset):
@@ -33,6 +34,11 @@ class Dataset(Dataset):
         # self.pcl_traj = cfg["dataset"]["pcl_traj"]
         self.use_camera_frame = cfg["dataset"]["camera_frame"]
 
+        # training reads slices of the pre-shuffled occupancy chunks, see preshuffle_occ.py
+        self.preshuffled_occ = False
+        if "preshuffled_occ" in cfg["dataset"].keys():
+            self.preshuffled_occ = cfg["dataset"]["preshuffled_occ"]
+
         self.num_theta = cfg["dataset"]["num_atc"]
         self.n_inputs = cfg["dataset"]["num_input_pts"]
         self.inputs_noise_std = cfg["dataset"]["input_noise"]
@@ -140,16 +146,17 @@ class Dataset(Dataset):
             data[k] = np.concatenate(data[k], axis=0)
         return data
 
+    def get_viz_id(self, index: int):
+        # only from the meta list, without loading the sample
+        meta_info = self.meta_list[index]
+        if self.input_type == "pcl":
+            return f"{self.mode}_{os.path.basename(meta_info['dir'])}_idx{index}"
+        return f"{self.mode}_{os.path.basename(meta_info['dir'])}_{meta_info['view']}_idx{index}"
+
     def __getitem__(self, index: int):
         ret = {}
         meta_info = self.meta_list[index]
-        if self.input_type == "pcl":
-            viz_id = f"{self.mode}_{os.path.basename(meta_info['dir'])}_idx{index}"
-        else:
-            viz_id = (
-                f"{self.mode}_{os.path.basename(meta_info['dir'])}_{meta_info['view']}_idx{index}"
-            )
-        meta_info["viz_id"] = viz_id
+        meta_info["viz_id"] = self.get_viz_id(index)
         meta_info["mode"] = self.mode
 
         base_root = meta_info["dir"]
@@ -243,21 +250,29 @@ class Dataset(Dataset):
         queries, occ_state = [], []
         for i in range(self.set_size):
             if self.mode == "train":
-                _occ_data = self.load(
-                    join(base_root, "implicit"),
-                    meta_info["files"][i],
-                    max(self.n_nss, self.n_uni),
-                    type="occ",
-                )
-                # load nss and uniform
-                ns = _occ_data["nss_xyz"]
-                choice = np.random.choice(ns.shape[0], self.n_nss, replace=False)
-                ns = ns[choice, :]
-                ns_o = (_occ_data["nss_occ"] < 0).astype(float)[choice]
-                un = _occ_data["uni_xyz"]
-                choice = np.random.choice(un.shape[0], self.n_uni, replace=False)
-                un = un[choice, :]
-                un_o = (_occ_data["uni_occ"] < 0).astype(float)[choice]
+                if self.preshuffled_occ:
+                    occ_dir = join(base_root, "implicit" + SHUFFLED_SUFFIX)
+                    file_ind = self.get_chunk_index(max(self.n_nss, self.n_uni), "occ", True)
+                    fid = meta_info["files"][i]
+                    ns, ns_o = read_chunk_slices(occ_dir, fid, "nss", file_ind, self.n_nss)
+                    un, un_o = read_chunk_slices(occ_dir, fid, "uni", file_ind, self.n_uni)
+                    ns_o, un_o = ns_o.astype(float), un_o.astype(float)
+                else:
+                    _occ_data = self.load(
+                        join(base_root, "implicit"),
+                        meta_info["files"][i],
+                        max(self.n_nss, self.n_uni),
+                        type="occ",
+                    )
+                    # load nss and uniform
+                    ns = _occ_data["nss_xyz"]
+                    choice = np.random.choice(ns.shape[0], self.n_nss, replace=False)
+                    ns = ns[choice, :]
+                    ns_o = (_occ_data["nss_occ"] < 0).astype(float)[choice]
+                    un = _occ_data["uni_xyz"]
+                    choice = np.random.choice(un.shape[0], self.n_uni, replace=False)
+                    un = un[choice, :]
+                    un_o = (_occ_data["uni_occ"] < 0).astype(float)[choice]
                 assert (un_o.sum() / un_o.shape[0]) < (
                     ns_o.sum() / ns_o.shape[0]
                 ), "NS rate < UNI rate, This happens very rare, please check the dataset! Process Stopped"
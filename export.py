@@ -0,0 +1,48 @@
+"""
+Export the inference graph of a trained CaDeX model to a self-contained TorchScript artifact
+python export.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml --output dfaust_w_pf.ts
+"""
+
+import os
+import argparse
+import logging
+from init import load_config
+from core.models import get_inference
+from core.models.inference_base import export_inference, get_seq_len
+from core.models.utils.precision import assert_module_precision, get_precision
+
+arg_parser = argparse.ArgumentParser(description="Export")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument(
+    "--checkpoint",
+    dest="checkpoint",
+    default=None,
+    help="(str) If not specify, use the first training.initialize_network_file in config",
+)
+arg_parser.add_argument("--output", "-o", dest="output", required=True)
+arg_parser.add_argument("--device", dest="device", default="cpu")
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+project_root = os.getcwd()
+cfg = load_config(
+    os.path.join(project_root, args.config_fn),
+    default_path=os.path.join(project_root, "init/default.yaml"),
+)
+checkpoint = args.checkpoint
+if checkpoint is None:
+    checkpoint = cfg["training"]["initialize_network_file"][0]
+
+assert_module_precision(get_precision(cfg), "export.py, the traced module is fp32")
+InferenceClass = get_inference(cfg["model"]["model_name"])
+module = InferenceClass(cfg).load_checkpoint(checkpoint).to(args.device).eval()
+example_inputs = module.example_inputs(get_seq_len(cfg))
+meta_info = {
+    "model_name": cfg["model"]["model_name"],
+    "method": cfg["method"],
+    "checkpoint": checkpoint,
+    "seq_len": get_seq_len(cfg),
+    "methods": list(example_inputs.keys()),
+    "occ_if_meshing_cfg": cfg["generation"]["occ_if_meshing_cfg"],
+}
+export_inference(module, example_inputs, args.output, meta_info)
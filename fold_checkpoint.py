@@ -0,0 +1,78 @@
+"""
+Fold the eval-mode normalizations of a trained CaDeX model into its linear layers and save an
+inference-only checkpoint, the folded module is checked against the original on random inputs
+python fold_checkpoint.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml -o dfaust_w_pf_folded.pt
+"""
+
+import os
+import copy
+import argparse
+import logging
+import torch
+from init import load_config
+from core.models import get_inference
+from core.models.inference_base import get_seq_len
+from core.models.utils.fold_norm import fold_norms, max_output_difference, time_fused_norms
+
+arg_parser = argparse.ArgumentParser(description="Fold normalizations")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument(
+    "--checkpoint",
+    dest="checkpoint",
+    default=None,
+    help="(str) If not specify, use the first training.initialize_network_file in config",
+)
+arg_parser.add_argument("--output", "-o", dest="output", required=True)
+arg_parser.add_argument("--tol", dest="tol", type=float, default=1e-4, help="(float) max abs diff")
+arg_parser.add_argument("--n_trials", dest="n_trials", type=int, default=3)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+project_root = os.getcwd()
+cfg = load_config(
+    os.path.join(project_root, args.config_fn),
+    default_path=os.path.join(project_root, "init/default.yaml"),
+)
+checkpoint = args.checkpoint
+if checkpoint is None:
+    checkpoint = cfg["training"]["initialize_network_file"][0]
+
+InferenceClass = get_inference(cfg["model"]["model_name"])
+reference = InferenceClass(cfg).load_checkpoint(checkpoint).eval()
+folded = copy.deepcopy(reference)
+report = fold_norms(folded)
+for k, v in report.items():
+    logging.info("{} {} norms: {}".format(len(v), k, v))
+
+# the folded module must give the same outputs on random inputs
+seq_len = get_seq_len(cfg)
+max_diff = {}
+for trial in range(args.n_trials):
+    torch.manual_seed(trial)
+    example_inputs = reference.example_inputs(seq_len)
+    for method, diff in max_output_difference(reference, folded, example_inputs).items():
+        max_diff[method] = max(max_diff.get(method, 0.0), diff)
+logging.info("Max abs difference to the original over {} trials: {}".format(args.n_trials, max_diff))
+if max(max_diff.values()) > args.tol:
+    raise RuntimeError("Folded module differs by more than {}: {}".format(args.tol, max_diff))
+
+# the instance norms without stats are not folded, only replaced, report what that gains
+for name, (shape, original_ms, fused_ms) in time_fused_norms(folded, example_inputs).items():
+    logging.info(
+        "{} on {}: InstanceNorm1d {:.3f}ms, FusedInstanceNorm1d {:.3f}ms".format(
+            name, shape, original_ms, fused_ms
+        )
+    )
+
+source = torch.load(checkpoint, map_location="cpu")
+torch.save(
+    {
+        "model_state_dict": folded.state_dict(),
+        "folded_norms": True,
+        "epoch": source.get("epoch", -1),
+        "source_checkpoint": checkpoint,
+        "fold_report": report,
+    },
+    args.output,
+)
+logging.info("Save folded inference checkpoint to {}".format(args.output))
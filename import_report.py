@@ -0,0 +1,67 @@
+"""
+Import time of the modules a run of the config loads (dataset, model, runner and the configured
+loggers), measured by python -X importtime in a fresh interpreter
+python import_report.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml -n 20
+"""
+
+import os
+import sys
+import argparse
+import logging
+import subprocess
+from init import load_config
+from logger.logger_meta import LOGGER_REGISTED
+
+arg_parser = argparse.ArgumentParser(description="Import report")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--top", "-n", dest="top", type=int, default=20)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+project_root = os.getcwd()
+cfg = load_config(
+    os.path.join(project_root, args.config_fn),
+    default_path=os.path.join(project_root, "init/default.yaml"),
+)
+# the same modules as run.py, the checkpoint and metric loggers are always added
+module_list = [
+    "init",
+    "core",
+    "logger",
+    "dataset." + cfg["dataset"]["dataset_name"],
+    "core.models." + cfg["model"]["model_name"],
+] + [
+    "logger.logger_meta." + LOGGER_REGISTED[name][0]
+    for name in set(cfg["logging"]["loggers"] + ["checkpoint", "metric"])
+]
+code = "import importlib\nfor m in {}:\n    importlib.import_module(m)".format(module_list)
+out = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", code],
+    cwd=project_root,
+    stderr=subprocess.PIPE,
+    universal_newlines=True,
+)
+if out.returncode != 0:
+    raise RuntimeError("Import failed:\n{}".format(out.stderr[-2000:]))
+
+# lines: import time: self [us] | cumulative | imported package
+self_us, cumulative_us = {}, {}
+for line in out.stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+        continue
+    fields = line[len("import time:") :].split("|")
+    name = fields[2].strip()
+    self_us[name] = int(fields[0])
+    cumulative_us[name] = int(fields[1])
+package_us = {}
+for name, t in self_us.items():
+    package_us[name.split(".")[0]] = package_us.get(name.split(".")[0], 0) + t
+
+logging.info("Total import time {:.3f}s of {} modules".format(sum(self_us.values()) / 1e6, len(self_us)))
+logging.info("Packages by self time:")
+for name, t in sorted(package_us.items(), key=lambda x: -x[1])[: args.top]:
+    logging.info("{:10.3f}s  {}".format(t / 1e6, name))
+logging.info("Modules of the config by cumulative time:")
+for name in module_list:
+    if name in cumulative_us.keys():
+        logging.info("{:10.3f}s  {}".format(cumulative_us[name] / 1e6, name))
@@ -2,10 +2,7 @@ import os
 from .config_utils import load_config, get_spec_with_default
 from .pre_config import parse_cmd_params, merge_cmd2cfg
 from .post_config import post_config
-from torch import autograd
-import torch
-import numpy as np
-import random
+from .config_builder import build_config
 
 
 def get_cfg():
@@ -17,22 +14,24 @@ def get_cfg():
     # parse cmd args
     cmd = parse_cmd_params()
     if cmd.enable_anomaly:
-        autograd.detect_anomaly()
-    # load from init file and default file
-    config_fn = os.path.join(project_root, cmd.config_fn)
-    cfg = load_config(config_fn, default_path=os.path.join(project_root, "init/default.yaml"))
+        import torch
 
-    # merge cmd to cfg
-    cfg = merge_cmd2cfg(cmd, cfg)
-    cfg["root"] = project_root
+        torch.autograd.set_detect_anomaly(True)
+    # load from init file and default file, merge cmd to cfg, without side effects
+    cfg = build_config(cmd.config_fn, project_root, cmd=cmd)
 
-    # startup
+    # startup: confirm, prepare the log dir, logging, visible gpus and backups
     cfg = post_config(cfg, interactive=not cmd.no_interaction)
 
     return cfg
 
 
 def setup_seed(seed):
+    # imported here, so that building a config does not import torch and numpy
+    import random
+    import numpy as np
+    import torch
+
     torch.manual_seed(seed)
     torch.cuda.manual_seed_all(seed)
     np.random.seed(seed)
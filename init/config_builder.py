@@ -0,0 +1,69 @@
+# pure config building: no prompt, no filesystem writes, no env change, usable from worker
+# processes, benchmarks and the inference server; the run setup is post_config
+import os
+from .config_utils import load_config, update_recursive
+from .pre_config import merge_cmd2cfg
+
+MODE_PREFIX = ("train", "val", "test")
+
+
+def shard_dir_name(shard_id, num_shards):
+    return "shard_{}_of_{}".format(shard_id, num_shards)
+
+
+def build_config(config_fn, project_root=None, cmd=None, overrides=None):
+    """
+    The config file over init/default.yaml, then the command line args and the overrides (a nested
+    dict, e.g. {"training": {"batch_size": 4}}), normalized and validated
+    """
+    project_root = os.getcwd() if project_root is None else project_root
+    cfg = load_config(
+        os.path.join(project_root, config_fn),
+        default_path=os.path.join(project_root, "init/default.yaml"),
+    )
+    if cmd is not None:
+        cfg = merge_cmd2cfg(cmd, cfg)
+    if overrides is not None:
+        cfg = update_recursive(cfg, overrides)
+    cfg["root"] = project_root
+    cfg = normalize_config(cfg)
+    validate_config(cfg)
+    return cfg
+
+
+def normalize_config(cfg):
+    if cfg["resume"] == "None":
+        cfg["resume"] = False
+    if isinstance(cfg["gpu"], int):
+        cfg["gpu"] = str(cfg["gpu"])
+    for name in ["checkpoint", "metric"]:
+        if name not in cfg["logging"]["loggers"]:
+            cfg["logging"]["loggers"] = cfg["logging"]["loggers"] + [name]
+    if "loader_probe" in cfg["logging"].keys() and cfg["logging"]["loader_probe"]:
+        if "loader" not in cfg["logging"]["loggers"]:
+            cfg["logging"]["loggers"] = cfg["logging"]["loggers"] + ["loader"]
+    if isinstance(cfg["dataset"]["dataset_proportion"], float):
+        cfg["dataset"]["dataset_proportion"] = [cfg["dataset"]["dataset_proportion"]] * len(
+            cfg["modes"]
+        )
+    if int(cfg["evaluation"]["num_shards"]) > 1:
+        # each shard logs into its own sub dir, so it can be re-run alone
+        cfg["logging"]["log_dir"] = os.path.join(
+            cfg["logging"]["log_dir"],
+            "shards",
+            shard_dir_name(int(cfg["evaluation"]["shard_id"]), int(cfg["evaluation"]["num_shards"])),
+        )
+    return cfg
+
+
+def validate_config(cfg):
+    for section in ["dataset", "model", "training", "evaluation", "logging"]:
+        assert isinstance(cfg[section], dict), "Config section {} missing".format(section)
+    for mode in cfg["modes"]:
+        assert mode.startswith(MODE_PREFIX), "Mode {} not support".format(mode)
+    assert len(cfg["dataset"]["dataset_proportion"]) >= len(
+        cfg["modes"]
+    ), "dataset_proportion needs one value per mode"
+    assert cfg["training"]["batch_size"] > 0, "Batch size must be positive"
+    num_shards = int(cfg["evaluation"]["num_shards"])
+    assert 0 <= int(cfg["evaluation"]["shard_id"]) < max(num_shards, 1), "Shard id out of range"
@@ -12,10 +12,12 @@ from .config_utils import configure_logging
 
 def post_config(cfg, interactive=True):
     """
-    preparation before start
+    preparation before start, the side effects of a run on a built config (see build_config)
     """
     local_time = time.asctime(time.localtime(time.time()))
     local_time = "_".join(local_time.split(" "))
+    if int(os.environ.get("RANK", 0)) > 0:
+        return post_config_worker(cfg)
 
     # check init
     os_cate = platform.system().lower()
@@ -40,8 +42,6 @@ def post_config(cfg, interactive=True):
     print("=" * shutil.get_terminal_size()[0])
 
     # check log dir
-    if cfg["resume"] == "None":
-        cfg["resume"] = False
     abs_log_dir = os.path.join(cfg["root"], "log", cfg["logging"]["log_dir"])
     if cfg["resume"]:
         # if resume, don't remove the old log
@@ -75,25 +75,19 @@ def post_config(cfg, interactive=True):
                 print("y Warning, NO INTERACTIVE CONFIRMATION, RENAME OLD LOG DIR!")
             # os.system("rm " + abs_log_dir + " -r")
             os.makedirs(abs_log_dir + "_old", exist_ok=True)
-            os.system(
-                f"mv {abs_log_dir} "
-                + os.path.join(
+            shutil.move(
+                abs_log_dir,
+                os.path.join(
                     abs_log_dir + "_old",
                     os.path.basename(abs_log_dir)
                     + f"_dup_old_rename_at_{datetime.today().strftime('%Y-%m-%d-%H-%M-%S')}",
-                )
+                ),
             )
         os.makedirs(abs_log_dir)
     print("Log dir confirmed...")
 
     configure_logging(cfg, time_stamp=local_time)
 
-    # prepare dataset proportion
-    if isinstance(cfg["dataset"]["dataset_proportion"], float):
-        cfg["dataset"]["dataset_proportion"] = [cfg["dataset"]["dataset_proportion"]] * len(
-            cfg["modes"]
-        )
-
     # Set visible GPUs
     os.environ["CUDA_VISIBLE_DEVICES"] = str(cfg["gpu"])
     logging.info("Set GPU: " + str(cfg["gpu"]) + " ...")
@@ -119,3 +113,18 @@ def post_config(cfg, interactive=True):
             logging.warning("{} backup failed".format(fn))
 
     return cfg
+
+
+def post_config_worker(cfg):
+    """
+    The other processes of a distributed run, rank 0 confirms the config and owns the log dir
+    """
+    checkpoint_dir = os.path.join(cfg["root"], "log", cfg["logging"]["log_dir"], "checkpoint")
+    if cfg["resume"] and not os.path.exists(checkpoint_dir):
+        cfg["resume"] = False
+    logging.basicConfig(
+        level=logging.DEBUG if cfg["logging"]["debug_mode"] else logging.WARNING,
+        format="| " + cfg["method"] + " | rank " + os.environ["RANK"] + " | %(levelname)s | %(message)s",
+    )
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(cfg["gpu"])
+    return cfg
@@ -1,6 +1,5 @@
 # get commandline params before init
 import argparse
-import os
 
 
 def parse_cmd_params():
@@ -60,6 +59,20 @@ def parse_cmd_params():
         action="store_true",
         help="(Bool) If set, will not use interactive confirm before start, used in cluster batch job",
     )
+    arg_parser.add_argument(
+        "--num_shards",
+        type=int,
+        dest="num_shards",
+        default=-1,
+        help="(int) Split the test set into this many shards, see merge_shards.py",
+    )
+    arg_parser.add_argument(
+        "--shard_id",
+        type=int,
+        dest="shard_id",
+        default=-1,
+        help="(int) The shard evaluated by this run, from 0 to num_shards - 1",
+    )
     args = arg_parser.parse_args()
     return args
 
@@ -73,9 +86,10 @@ def merge_cmd2cfg(cmd, cfg):
     cfg['logging']['debug_mode'] = cmd.debug_logging_flag
     if cmd.gpu is not None:
         cfg['gpu'] = cmd.gpu
-    if isinstance(cfg['gpu'], int):
-        cfg['gpu'] = str(cfg['gpu'])
     if cmd.resume is not None:
         cfg['resume'] = cmd.resume
-    cfg['logging']['loggers'] += ['checkpoint', 'metric']
+    if cmd.num_shards > 0:
+        cfg['evaluation']['num_shards'] = cmd.num_shards
+    if cmd.shard_id >= 0:
+        cfg['evaluation']['shard_id'] = cmd.shard_id
     return cfg
@@ -9,7 +9,7 @@ Logger can be selected from init file
 """
 import os
 from tensorboardX import SummaryWriter as writer
-from .logger_meta import LOGGER_REGISTED
+from .logger_meta import LOGGER_REGISTED, get_logger_class
 from copy import deepcopy
 import logging
 
@@ -28,7 +28,7 @@ class Logger(object):
         mapping = LOGGER_REGISTED
         for name in names:
             if name in mapping.keys():
-                loggers_list.append(mapping[name](self.tb_writer, os.path.join(
+                loggers_list.append(get_logger_class(name)(self.tb_writer, os.path.join(
                     os.path.join(self.cfg['root'], 'log', self.cfg['logging']['log_dir'], name)), self.cfg))
             else:
                 raise Warning('Required logger ' + name + ' not found!')
@@ -1,17 +1,19 @@
-from logger.logger_meta.video_logger import VideoLogger
-from .metric_logger import MetricLogger
-from .image_logger import ImageLogger
-from .checkpoint_logger import CheckpointLogger
-from .xls_logger import XLSLogger
-from .mesh_logger import MeshLogger
-from .hist_logger import HistLogger
+import importlib
 
+# name: (module, class), a logger module is only imported when it is configured
 LOGGER_REGISTED = {
-    "metric": MetricLogger,
-    "image": ImageLogger,
-    "checkpoint": CheckpointLogger,
-    "xls": XLSLogger,
-    "mesh": MeshLogger,
-    "hist": HistLogger,
-    "video": VideoLogger
+    "metric": ("metric_logger", "MetricLogger"),
+    "image": ("image_logger", "ImageLogger"),
+    "checkpoint": ("checkpoint_logger", "CheckpointLogger"),
+    "xls": ("xls_logger", "XLSLogger"),
+    "mesh": ("mesh_logger", "MeshLogger"),
+    "hist": ("hist_logger", "HistLogger"),
+    "video": ("video_logger", "VideoLogger"),
+    "loader": ("loader_logger", "LoaderLogger"),
 }
+
+
+def get_logger_class(name):
+    module_name, class_name = LOGGER_REGISTED[name]
+    module = importlib.import_module("logger.logger_meta." + module_name)
+    return getattr(module, class_name)
@@ -1,6 +1,7 @@
 import os
 import shutil
 from .base_logger import BaseLogger
+import time
 import numpy as np
 import torch
 import logging
@@ -27,6 +28,13 @@ class CheckpointLogger(BaseLogger):
         self.model_select_larger = cfg["logging"]["model_select_larger"]
         self.model_select_best = -np.inf if self.model_select_larger else np.inf
         self.model_select_buffer = []
+        # save the latest inside an epoch every n train batches or m minutes, -1 to disable
+        self.step_interval, self.minute_interval = -1, -1
+        if "checkpoint_every_n_batches" in cfg["logging"].keys():
+            self.step_interval = int(cfg["logging"]["checkpoint_every_n_batches"])
+        if "checkpoint_every_minutes" in cfg["logging"].keys():
+            self.minute_interval = float(cfg["logging"]["checkpoint_every_minutes"])
+        self.last_save_time = time.time()
 
     def log_batch(self, batch):
         self.phase = batch["phase"]
@@ -34,6 +42,17 @@ class CheckpointLogger(BaseLogger):
         self.current_batch = batch["batch"]
         if self.save_method is None:
             self.save_method = batch["save_method"]
+        if self.phase == "train" and batch["batch_in_epoch"] < batch["batch_total"]:
+            step_due = self.step_interval > 0 and batch["batch_in_epoch"] % self.step_interval == 0
+            time_due = (
+                self.minute_interval > 0
+                and time.time() - self.last_save_time > self.minute_interval * 60
+            )
+            if step_due or time_due:
+                self.save_latest(
+                    "%d_b%d_latest.pt" % (self.current_epoch, batch["batch_in_epoch"]),
+                    {"batch": self.current_batch, "epoch": self.current_epoch},
+                )
         # update model selection metric
         if self.phase.startswith("val"):  # val or vali
             if self.model_select_metric in batch["data"].keys():
@@ -49,13 +68,7 @@ class CheckpointLogger(BaseLogger):
                 os.path.join(self.log_path, "%d.pt" % self.current_epoch), batch_epoch_info
             )
         if self.phase == "train":  # log the latest
-            if any(
-                [True if fn.endswith("latest.pt") else False for fn in os.listdir(self.log_path)]
-            ):
-                os.system("rm " + os.path.join(self.log_path, "*_latest.pt"))
-            self.save_method(
-                os.path.join(self.log_path, "%d_latest.pt" % self.current_epoch), batch_epoch_info
-            )
+            self.save_latest("%d_latest.pt" % self.current_epoch, batch_epoch_info)
         if self.phase.startswith("val"):  # model selection
             if len(self.model_select_buffer) > 0:
                 # model select
@@ -79,6 +92,18 @@ class CheckpointLogger(BaseLogger):
                         logging.info("Select epoch {} model".format(self.current_epoch))
             self.model_select_buffer = []
 
+    def save_latest(self, fn, batch_epoch_info):
+        """
+        Replace the latest checkpoint, the old one is only removed after the new one is complete
+        """
+        tmp_fn = os.path.join(self.log_path, fn + ".tmp")
+        self.save_method(tmp_fn, batch_epoch_info)
+        os.replace(tmp_fn, os.path.join(self.log_path, fn))
+        for old_fn in os.listdir(self.log_path):
+            if old_fn.endswith("_latest.pt") and old_fn != fn:
+                os.remove(os.path.join(self.log_path, old_fn))
+        self.last_save_time = time.time()
+
     def better(self, old, new):
         select = False
         if self.model_select_larger and new > old:
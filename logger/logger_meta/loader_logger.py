@@ -0,0 +1,77 @@
+from .base_logger import BaseLogger
+import logging
+from dataset.loader_probe import summarize
+
+
+class LoaderLogger(BaseLogger):
+    """
+    Data loader stats of the solver (logging.loader_probe) per dataset class, warns when the
+    compute of a phase waits on the data for more than logging.loader_starved_fraction of the time
+    """
+
+    def __init__(self, tb_logger, log_path, cfg):
+        super().__init__(tb_logger, log_path, cfg)
+        self.NAME = "loader"
+        self.dataset_name = cfg["dataset"]["dataset_name"]
+        self.starved_fraction = 0.2
+        if "loader_starved_fraction" in cfg["logging"].keys():
+            self.starved_fraction = float(cfg["logging"]["loader_starved_fraction"])
+        self.phase = None
+        self.epoch = -1
+        self.device = "cpu"
+        self.stats_list = []
+
+    def log_batch(self, batch):
+        if "loader_stats" not in batch.keys():
+            return
+        stats = batch["loader_stats"]
+        self.phase = batch["phase"]
+        self.epoch = batch["epoch"]
+        self.device = batch["device"]
+        self.stats_list.append(stats)
+        tag = "Loader-BatchWise/{}/".format(self.dataset_name)
+        for k in ["wait_ms", "compute_ms", "ready", "outstanding"]:
+            self.tb.add_scalars(tag + k, {self.phase: float(stats[k])}, batch["batch"])
+        if len(stats["worker_ms"]) > 0:
+            self.tb.add_scalars(
+                tag + "{}/sample_ms".format(self.phase),
+                {"worker_{}".format(i): v for i, v in stats["worker_ms"].items()},
+                batch["batch"],
+            )
+
+    def log_phase(self):
+        if len(self.stats_list) == 0:
+            return
+        summary = summarize(self.stats_list, self.starved_fraction)
+        tag = "Loader-EpochWise/{}/".format(self.dataset_name)
+        for k in ["startup_ms", "wait_ms", "compute_ms", "wait_fraction", "ready", "sample_ms", "sample_p95_ms"]:
+            self.tb.add_scalars(tag + k, {self.phase: summary[k]}, int(self.epoch))
+        self.tb.add_scalars(tag + "starved", {self.phase: float(summary["starved"])}, int(self.epoch))
+        logging.info(
+            "{} {} loader: wait {:.1f}ms compute {:.1f}ms per batch ({:.0%} waiting), "
+            "sample {:.1f}ms (p95 {:.1f}ms), {:.1f} batches ready, startup {:.0f}ms".format(
+                self.dataset_name,
+                self.phase,
+                summary["wait_ms"],
+                summary["compute_ms"],
+                summary["wait_fraction"],
+                summary["sample_ms"],
+                summary["sample_p95_ms"],
+                summary["ready"],
+                summary["startup_ms"],
+            )
+        )
+        if summary["starved"]:
+            logging.warning(
+                "The {} compute of {} {} epoch {} is starved by the data loader, {:.0%} of the time "
+                "waits on data, per worker sample ms {}; try more dataset.num_workers, "
+                "dataset.prefetch_factor or dataset.persistent_workers".format(
+                    self.device,
+                    self.dataset_name,
+                    self.phase,
+                    self.epoch,
+                    summary["wait_fraction"],
+                    {i: round(v, 1) for i, v in sorted(summary["worker_ms"].items())},
+                )
+            )
+        self.stats_list = []
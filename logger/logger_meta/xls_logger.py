@@ -60,16 +60,31 @@ class XLSLogger(BaseLogger):
             # handle end log
             if len(self.pd_container[k]) == 0:
                 continue
-            try:
-                D = self.pd_container[k]
-                df2 = pd.DataFrame(D.mean(axis=0))
-                self.pd_container[k] = pd.concat([df2.T, D], axis=0, ignore_index=False)
-            except:
-                logging.warning("XLS loger add mean to head fail, ignore and continue")
-            self.pd_container[k].to_excel(
+            write_xls(
+                self.pd_container[k],
                 os.path.join(
                     self.log_path,
                     k + "_" + str(self.current_epoch) + "_" + self.current_phase + ".xls",
-                )
+                ),
             )
             self.pd_container[k] = pd.DataFrame()
+
+
+def write_xls(D, fn):
+    """
+    Save the rows with their mean as the head row
+    """
+    try:
+        df2 = pd.DataFrame(D.mean(axis=0))
+        D = pd.concat([df2.T, D], axis=0, ignore_index=False)
+    except:
+        logging.warning("XLS loger add mean to head fail, ignore and continue")
+    D.to_excel(fn)
+
+
+def read_xls_rows(fn):
+    """
+    The rows of a file saved by write_xls, without the mean head row
+    """
+    D = pd.read_excel(fn, index_col=0)
+    return D[D["viz_id"].notna()]
@@ -0,0 +1,80 @@
+"""
+Merge the reports and meshes of a sharded test run into the log dir of the config
+python run.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml --num_shards 8 --shard_id 3 -f  # for each shard
+python merge_shards.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml --num_shards 8
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import logging
+import pandas as pd
+from init import load_config
+from init.config_builder import shard_dir_name
+from logger.logger_meta.xls_logger import write_xls, read_xls_rows
+
+arg_parser = argparse.ArgumentParser(description="Merge shards")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument(
+    "--num_shards",
+    dest="num_shards",
+    type=int,
+    default=-1,
+    help="(int) If not specify, use evaluation.num_shards in config",
+)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+
+project_root = os.getcwd()
+cfg = load_config(
+    os.path.join(project_root, args.config_fn),
+    default_path=os.path.join(project_root, "init/default.yaml"),
+)
+num_shards = args.num_shards if args.num_shards > 0 else int(cfg["evaluation"]["num_shards"])
+log_root = os.path.join(project_root, "log", cfg["logging"]["log_dir"])
+shard_dirs = [
+    os.path.join(log_root, "shards", shard_dir_name(i, num_shards)) for i in range(num_shards)
+]
+
+# a shard is finished when its reports are written at the end of the test phase
+xls_names = set()
+for shard_dir in shard_dirs:
+    if os.path.isdir(os.path.join(shard_dir, "xls")):
+        xls_names.update([fn for fn in os.listdir(os.path.join(shard_dir, "xls")) if fn.endswith(".xls")])
+unfinished = [
+    i
+    for i, shard_dir in enumerate(shard_dirs)
+    if len(xls_names) == 0
+    or not all([os.path.exists(os.path.join(shard_dir, "xls", fn)) for fn in xls_names])
+]
+if len(unfinished) > 0:
+    for i in unfinished:
+        logging.error(
+            "Shard {} is not finished, re-run it by: python run.py --config {} --num_shards {} --shard_id {} -f".format(
+                i, args.config_fn, num_shards, i
+            )
+        )
+    sys.exit(1)
+
+os.makedirs(os.path.join(log_root, "xls"), exist_ok=True)
+for fn in sorted(xls_names):
+    D = pd.concat(
+        [read_xls_rows(os.path.join(shard_dir, "xls", fn)) for shard_dir in shard_dirs],
+        axis=0,
+        ignore_index=True,
+    )
+    write_xls(D, os.path.join(log_root, "xls", fn))
+    logging.info("Merge {} rows of {} from {} shards".format(len(D), fn, num_shards))
+
+# the mesh names contain the viz_id, which is the same as unsharded
+n_mesh = 0
+for shard_dir in shard_dirs:
+    mesh_dir = os.path.join(shard_dir, "mesh")
+    for dirpath, _, filenames in os.walk(mesh_dir):
+        dst_dir = os.path.join(log_root, "mesh", os.path.relpath(dirpath, mesh_dir))
+        os.makedirs(dst_dir, exist_ok=True)
+        for fn in filenames:
+            shutil.copy2(os.path.join(dirpath, fn), dst_dir)
+            n_mesh += 1
+logging.info("Copy {} mesh files to {}".format(n_mesh, os.path.join(log_root, "mesh")))
@@ -0,0 +1,99 @@
+"""
+Write the pre-shuffled occupancy format of the training data of a config (dataset.preshuffled_occ),
+see dataset/packed_occ.py, and compare the per-file sampling cost of both formats
+python preshuffle_occ.py --config configs/dt4d/training/dt4d_pcl.yaml --workers 8
+"""
+
+import os
+import glob
+import time
+import argparse
+import logging
+import functools
+import numpy as np
+from multiprocessing import Pool
+from init import build_config
+from dataset.packed_occ import (
+    PRESHUFFLE_SPECS,
+    SHUFFLED_SUFFIX,
+    occ_bits,
+    preshuffle_file,
+    read_slice,
+)
+
+arg_parser = argparse.ArgumentParser(description="Pre-shuffle occupancy data")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+arg_parser.add_argument("--workers", dest="workers", type=int, default=8)
+arg_parser.add_argument("--overwrite", dest="overwrite", action="store_true")
+arg_parser.add_argument("--n_check", dest="n_check", type=int, default=20, help="(int) files timed")
+arg_parser.add_argument("--n_points", dest="n_points", type=int, default=1024, help="(int) sampled per file")
+
+
+def get_spec(cfg):
+    name = cfg["dataset"]["dataset_name"]
+    if name == "oflow_data":
+        oflow_cfg = cfg["dataset"]["oflow_config"]
+        kind = "packed" if oflow_cfg["points_unpackbits"] else "bool"
+        root = os.path.join(cfg["root"], oflow_cfg["path"])
+        return root, oflow_cfg["points_iou_seq_folder"], [("points", "points", "occupancies", kind)]
+    assert name in PRESHUFFLE_SPECS.keys(), "No pre-shuffled format for dataset {}".format(name)
+    folder, sets = PRESHUFFLE_SPECS[name]
+    return os.path.join(cfg["root"], cfg["dataset"]["data_root"]), folder, sets
+
+
+def worker(task, sets, seed, overwrite):
+    i, fn = task
+    dst_dir = os.path.dirname(fn) + SHUFFLED_SUFFIX
+    if not overwrite and os.path.exists(os.path.join(dst_dir, os.path.basename(fn))):
+        return 0
+    os.makedirs(dst_dir, exist_ok=True)
+    preshuffle_file(fn, dst_dir, sets, np.random.default_rng([seed, i]))
+    return 1
+
+
+def time_sampling(files, sets, n):
+    # the original path loads and unpacks the whole file, the new one only a slice
+    old_t, new_t = 0.0, 0.0
+    for fn in files:
+        start_t = time.time()
+        data = np.load(fn)
+        for _, xyz_key, occ_key, kind in sets:
+            xyz = data[xyz_key]
+            choice = np.random.choice(xyz.shape[0], min(n, xyz.shape[0]), replace=False)
+            xyz, occ = xyz[choice], occ_bits(data[occ_key], kind, xyz.shape[0])[choice]
+        old_t += time.time() - start_t
+        start_t = time.time()
+        stem = os.path.join(os.path.dirname(fn) + SHUFFLED_SUFFIX, os.path.basename(fn)[:-4])
+        dict(np.load(stem + ".npz"))
+        for name, _, _, _ in sets:
+            xyz, occ = read_slice(stem, name, n)
+            occ = np.unpackbits(occ)[: xyz.shape[0]]
+        new_t += time.time() - start_t
+    return old_t / len(files) * 1000.0, new_t / len(files) * 1000.0
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    cfg = build_config(args.config_fn, os.getcwd())
+    root, folder, sets = get_spec(cfg)
+    files = sorted(glob.glob(os.path.join(root, "**", folder, "*.npz"), recursive=True))
+    if cfg["dataset"]["dataset_name"] == "oflow_data":
+        files = [fn for fn in files if "_" not in os.path.basename(fn)]  # skip the multi-file parts
+    logging.info("Pre-shuffle {} files of {} under {}".format(len(files), folder, root))
+    start_t = time.time()
+    with Pool(args.workers) as pool:
+        written = pool.map(
+            functools.partial(worker, sets=sets, seed=args.seed, overwrite=args.overwrite),
+            list(enumerate(files)),
+        )
+    logging.info("Wrote {} files in {:.1f}min".format(sum(written), (time.time() - start_t) / 60.0))
+
+    if args.n_check > 0 and len(files) > 0:
+        old_ms, new_ms = time_sampling(files[: args.n_check], sets, args.n_points)
+        logging.info(
+            "Sampling {} points per file: {:.2f}ms before, {:.2f}ms pre-shuffled, speedup {:.1f}".format(
+                args.n_points, old_ms, new_ms, old_ms / max(new_ms, 1e-6)
+            )
+        )
@@ -0,0 +1,139 @@
+"""
+Batch reconstruction of a dataset split without the training runner, samples are sharded over
+worker processes, each with its own device and threads. Finished samples are skipped on restart.
+python reconstruct.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml -o ./recon -n 8 --threads 4
+"""
+
+import os
+import time
+import argparse
+import logging
+import multiprocessing
+import numpy as np
+import torch
+
+
+def get_args():
+    arg_parser = argparse.ArgumentParser(description="Reconstruct")
+    arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+    arg_parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        default=None,
+        help="(str) If not specify, use the first training.initialize_network_file in config",
+    )
+    arg_parser.add_argument(
+        "--exported", dest="exported", default=None, help="(str) use an export.py artifact instead"
+    )
+    arg_parser.add_argument("--split", dest="split", default="test")
+    arg_parser.add_argument("--output", "-o", dest="output", required=True)
+    arg_parser.add_argument("--workers", "-n", dest="workers", type=int, default=1)
+    arg_parser.add_argument(
+        "--devices", dest="devices", default="cpu", help="(str) comma list, cycled over workers"
+    )
+    arg_parser.add_argument(
+        "--threads", dest="threads", type=int, default=-1, help="(int) torch threads per worker, default cores / workers"
+    )
+    arg_parser.add_argument("--n_samples", dest="n_samples", type=int, default=-1)
+    arg_parser.add_argument("--overwrite", dest="overwrite", action="store_true")
+    return arg_parser.parse_args()
+
+
+def sample_done(output_dir, viz_id):
+    # the latent is written last, its existence marks a finished sample
+    return os.path.exists(os.path.join(output_dir, viz_id, "latent.pt"))
+
+
+def worker(rank, args, queue):
+    from init import build_config
+    from dataset import get_dataset
+    from core.models import get_inference
+    from core.models.inference_base import generate_mesh_sequence, get_seq_len, load_inference
+    from core.models.utils.occnet_utils import get_generator
+    from core.models.utils.precision import apply_precision, assert_module_precision, get_precision
+
+    logging.getLogger().setLevel(logging.INFO)
+    device_list = args.devices.split(",")
+    device = device_list[rank % len(device_list)]
+    # by default split the cores evenly over the workers
+    threads = args.threads if args.threads > 0 else max(os.cpu_count() // args.workers, 1)
+    torch.set_num_threads(threads)
+
+    project_root = os.getcwd()
+    cfg = build_config(args.config_fn, project_root, overrides={"modes": [args.split]})
+    seq_len = get_seq_len(cfg)
+    dataset = get_dataset(cfg)(cfg, mode=args.split)
+    if args.exported is not None:
+        assert_module_precision(get_precision(cfg), "an exported module")
+        module, _ = load_inference(args.exported, map_location=device)
+    else:
+        checkpoint = args.checkpoint
+        if checkpoint is None:
+            checkpoint = cfg["training"]["initialize_network_file"][0]
+        InferenceClass = get_inference(cfg["model"]["model_name"])
+        module = InferenceClass(cfg).load_checkpoint(checkpoint).to(device).eval()
+        module = apply_precision(module, get_precision(cfg))
+    generator = get_generator(cfg, device=device)
+
+    n_samples = len(dataset) if args.n_samples < 0 else min(args.n_samples, len(dataset))
+    shard = list(range(rank, n_samples, args.workers))
+    n_done, n_skipped = 0, 0
+    start_t = time.time()
+    for idx in shard:
+        viz_id = dataset.get_viz_id(idx)
+        if not args.overwrite and sample_done(args.output, viz_id):
+            n_skipped += 1
+            continue
+        data, _ = dataset[idx]
+        sample_dir = os.path.join(args.output, viz_id)
+        os.makedirs(sample_dir, exist_ok=True)
+        seq_pc = torch.Tensor(np.asarray(data["inputs"])[:seq_len]).unsqueeze(0).to(device)
+        with torch.no_grad():
+            c_t, c_g = module.encode(seq_pc)
+        mesh_t_list, _, mesh_cdc = generate_mesh_sequence(module, generator, c_t[0], c_g[0])
+        for t, mesh in enumerate(mesh_t_list):
+            mesh.export(os.path.join(sample_dir, "mesh_t%d.ply" % t))
+        mesh_cdc.export(os.path.join(sample_dir, "cdc_mesh.ply"))
+        latent_fn = os.path.join(sample_dir, "latent.pt")
+        torch.save({"c_t": c_t[0].cpu(), "c_g": c_g[0].cpu()}, latent_fn + ".tmp")
+        os.replace(latent_fn + ".tmp", latent_fn)
+        n_done += 1
+        logging.info(
+            "Worker {} [{}/{}] {} {:.2f} samples/s".format(
+                rank, n_done + n_skipped, len(shard), viz_id, n_done / (time.time() - start_t)
+            )
+        )
+    queue.put((rank, device, n_done, n_skipped, time.time() - start_t))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    logging.getLogger().setLevel(logging.INFO)
+    os.makedirs(args.output, exist_ok=True)
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    start_t = time.time()
+    process_list = [ctx.Process(target=worker, args=(r, args, queue)) for r in range(args.workers)]
+    for p in process_list:
+        p.start()
+    for p in process_list:
+        p.join()
+    report = []
+    while not queue.empty():
+        report.append(queue.get())
+    wall_time = time.time() - start_t
+
+    for rank, device, n_done, n_skipped, elapsed in sorted(report):
+        logging.info(
+            "Worker {} ({}): {} reconstructed, {} skipped, {:.2f} samples/s".format(
+                rank, device, n_done, n_skipped, n_done / max(elapsed, 1e-6)
+            )
+        )
+    n_done = sum([r[2] for r in report])
+    logging.info(
+        "Reconstructed {} samples to {} in {:.1f}s, {:.2f} samples/s".format(
+            n_done, args.output, wall_time, n_done / max(wall_time, 1e-6)
+        )
+    )
+    if len(report) < args.workers:
+        raise RuntimeError("{} workers did not finish".format(args.workers - len(report)))
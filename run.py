@@ -5,10 +5,15 @@ Update 2020.10
 Update 2021.7
 """
 
-from dataset import get_dataset
+import time
+
+start_t = time.time()
+import logging
+from dataset import get_dataset, get_shard
 from logger import Logger
 from core.models import get_model
 from core import runner_dict
+from core.distributed_solver import is_main_process
 from init import get_cfg, setup_seed
 
 cfg = get_cfg()
@@ -18,13 +23,14 @@ setup_seed(cfg["rand_seed"])
 DatasetClass = get_dataset(cfg)
 datasets_dict = dict()
 for mode in cfg["modes"]:
-    datasets_dict[mode] = DatasetClass(cfg, mode=mode)
+    datasets_dict[mode] = get_shard(cfg, DatasetClass(cfg, mode=mode), mode)
 
 ModelClass = get_model(cfg["model"]["model_name"])
 model = ModelClass(cfg)
 
-logger = Logger(cfg)
+logger = Logger(cfg) if is_main_process() else None
 
 runner = runner_dict[cfg["runner"].lower()](cfg, model, datasets_dict, logger)
+logging.info("Startup in {:.2f}s, see import_report.py for the import time".format(time.time() - start_t))
 
 runner.run()
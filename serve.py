@@ -0,0 +1,91 @@
+"""
+Local reconstruction service, concurrent requests are micro-batched on a pool of warm replicas
+python serve.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml --device cpu --port 8000
+curl -X POST localhost:8000/reconstruct -d '{"points": [...], "output": "mesh"}'
+"""
+
+import os
+import argparse
+import logging
+import torch
+from init import build_config
+from core.models import get_inference
+from core.models.inference_base import get_seq_len, load_inference
+from core.models.utils.occnet_utils import get_generator
+from core.models.utils.precision import apply_precision, assert_module_precision, get_precision
+from core.inference_server import InferenceServer, ModelReplica, make_http_server
+
+arg_parser = argparse.ArgumentParser(description="Serve")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument(
+    "--checkpoint",
+    dest="checkpoint",
+    default=None,
+    help="(str) If not specify, use the first training.initialize_network_file in config",
+)
+arg_parser.add_argument(
+    "--exported", dest="exported", default=None, help="(str) use an export.py artifact instead"
+)
+arg_parser.add_argument(
+    "--device", dest="device", default="cpu", help="(str) comma list, cycled over the replicas"
+)
+arg_parser.add_argument("--replicas", "-n", dest="replicas", type=int, default=1)
+arg_parser.add_argument("--max_batch_size", dest="max_batch_size", type=int, default=4)
+arg_parser.add_argument("--max_wait_ms", dest="max_wait_ms", type=float, default=10.0)
+arg_parser.add_argument(
+    "--timeout", dest="timeout", type=float, default=60.0, help="(float) default request timeout in s"
+)
+arg_parser.add_argument("--host", dest="host", default="127.0.0.1")
+arg_parser.add_argument("--port", "-p", dest="port", type=int, default=8000)
+arg_parser.add_argument("--unix_socket", dest="unix_socket", default=None, help="(str) serve on this path instead")
+arg_parser.add_argument("--threads", dest="threads", type=int, default=-1)
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+if args.threads > 0:
+    torch.set_num_threads(args.threads)
+
+project_root = os.getcwd()
+cfg = build_config(args.config_fn, project_root)
+seq_len = get_seq_len(cfg)
+
+replica_list = []
+device_list = args.device.split(",")
+for rid in range(args.replicas):
+    device = device_list[rid % len(device_list)]
+    if args.exported is not None:
+        assert_module_precision(get_precision(cfg), "an exported module")
+        module, _ = load_inference(args.exported, map_location=device)
+    else:
+        checkpoint = args.checkpoint
+        if checkpoint is None:
+            checkpoint = cfg["training"]["initialize_network_file"][0]
+        InferenceClass = get_inference(cfg["model"]["model_name"])
+        module = InferenceClass(cfg).load_checkpoint(checkpoint).to(device).eval()
+        module = apply_precision(module, get_precision(cfg))
+    replica_list.append(ModelReplica(module, get_generator(cfg, device=device), device))
+
+server = InferenceServer(
+    replica_list,
+    seq_len,
+    max_batch_size=args.max_batch_size,
+    max_wait_ms=args.max_wait_ms,
+    timeout=args.timeout,
+).start()
+if args.unix_socket is not None and os.path.exists(args.unix_socket):
+    os.remove(args.unix_socket)
+http_server = make_http_server(server, args.host, args.port, args.unix_socket)
+logging.info(
+    "Serving {} replicas of {} on {}".format(
+        len(replica_list),
+        cfg["model"]["model_name"],
+        args.unix_socket if args.unix_socket is not None else "{}:{}".format(args.host, args.port),
+    )
+)
+try:
+    http_server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    http_server.server_close()
+    server.stop()
+    logging.info("Final metrics: {}".format(server.metrics.snapshot()))
@@ -41,8 +41,12 @@ triangle_hash_module = Extension(
 mise_module = Extension(
     'core.models.utils.occnet_utils.utils.libmise.mise',
     sources=[
-        'core/models/utils/occnet_utils/utils/libmise/mise.pyx'
+        'core/models/utils/occnet_utils/utils/libmise/mise.pyx',
+        'core/models/utils/occnet_utils/utils/libmcubes/marchingcubes.cpp'
     ],
+    language='c++',
+    extra_compile_args=['-std=c++11'],
+    include_dirs=['core/models/utils/occnet_utils/utils/libmcubes']
 )
 
 # simplify (efficient mesh simplification)
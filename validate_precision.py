@@ -0,0 +1,103 @@
+"""
+Compare a reduced inference precision against fp32 on held-out samples
+Reports IoU / Chamfer of both against the ground truth and the speed up of encoding + extraction
+python validate_precision.py --config configs/dfaust/testing/dfaust_w_pf_test_seen.yaml --precision int8
+"""
+
+import os
+import time
+import json
+import argparse
+import logging
+import numpy as np
+import torch
+from init import build_config
+from dataset import get_dataset
+from core.models import get_inference
+from core.models.inference_base import generate_mesh_sequence, get_seq_len
+from core.models.utils.occnet_utils import get_generator
+from core.models.utils.oflow_eval.evaluator import MeshEvaluator
+from core.models.utils.precision import apply_precision, precision_context
+
+arg_parser = argparse.ArgumentParser(description="Validate inference precision")
+arg_parser.add_argument("--config", "-c", dest="config_fn", required=True)
+arg_parser.add_argument("--checkpoint", dest="checkpoint", default=None)
+arg_parser.add_argument("--precision", "-p", dest="precision", required=True, choices=["int8", "bf16"])
+arg_parser.add_argument("--split", dest="split", default="test")
+arg_parser.add_argument("--n_samples", "-n", dest="n_samples", type=int, default=20)
+arg_parser.add_argument("--device", dest="device", default="cpu")
+arg_parser.add_argument("--threads", dest="threads", type=int, default=-1)
+arg_parser.add_argument("--output", "-o", dest="output", default=None, help="(str) json report")
+args = arg_parser.parse_args()
+logging.getLogger().setLevel(logging.INFO)
+if args.threads > 0:
+    torch.set_num_threads(args.threads)
+
+project_root = os.getcwd()
+cfg = build_config(args.config_fn, project_root, overrides={"modes": [args.split]})
+checkpoint = args.checkpoint
+if checkpoint is None:
+    checkpoint = cfg["training"]["initialize_network_file"][0]
+seq_len = get_seq_len(cfg)
+
+dataset = get_dataset(cfg)(cfg, mode=args.split)
+InferenceClass = get_inference(cfg["model"]["model_name"])
+generator = get_generator(cfg, device=args.device)
+generator.precision = "fp32"  # the reduced precision is applied around the whole sample
+evaluator = MeshEvaluator(cfg["dataset"]["n_query_sample_eval"])
+runs = {}
+for precision in ["fp32", args.precision]:
+    module = InferenceClass(cfg).load_checkpoint(checkpoint).to(args.device)
+    runs[precision] = apply_precision(module, precision)
+device_type = torch.device(args.device).type
+
+report = {k: {"iou": [], "chamfer-L1": [], "time": []} for k in runs.keys()}
+n_samples = min(args.n_samples, len(dataset))
+for idx in range(n_samples):
+    data, meta_info = dataset[idx]
+    seq_pc = torch.Tensor(np.asarray(data["inputs"])[:seq_len]).unsqueeze(0).to(args.device)
+    pcl_key = "points_chamfer" if "points_chamfer" in data.keys() else "points_mesh"
+    for precision, module in runs.items():
+        if idx == 0:  # warm up
+            with torch.no_grad(), precision_context(precision, device_type):
+                module.encode(seq_pc)
+        start_t = time.time()
+        with torch.no_grad(), precision_context(precision, device_type):
+            c_t, c_g = module.encode(seq_pc)
+            mesh_t_list, _, _ = generate_mesh_sequence(
+                module, generator, c_t[0].float(), c_g[0].float()
+            )
+        report[precision]["time"].append(time.time() - start_t)
+        iou, chamfer = [], []
+        for t, mesh in enumerate(mesh_t_list):
+            eval_dict = evaluator.eval_mesh(
+                mesh,
+                np.asarray(data[pcl_key])[t],
+                None,
+                np.asarray(data["points"])[t],
+                np.asarray(data["points.occ"])[t],
+            )
+            iou.append(eval_dict["iou"])
+            chamfer.append(eval_dict["chamfer-L1(Onet)"])
+        report[precision]["iou"].append(float(np.mean(iou)))
+        report[precision]["chamfer-L1"].append(float(np.mean(chamfer)))
+    logging.info(
+        "[{}/{}] {} ".format(idx + 1, n_samples, meta_info["viz_id"])
+        + " ".join(
+            "{}: iou={:.4f} cd={:.5f} t={:.2f}s".format(
+                k, v["iou"][-1], v["chamfer-L1"][-1], v["time"][-1]
+            )
+            for k, v in report.items()
+        )
+    )
+
+summary = {}
+for precision, v in report.items():
+    summary[precision] = {k: float(np.mean(l)) for k, l in v.items()}
+summary["delta_iou"] = summary[args.precision]["iou"] - summary["fp32"]["iou"]
+summary["delta_chamfer-L1"] = summary[args.precision]["chamfer-L1"] - summary["fp32"]["chamfer-L1"]
+summary["speedup"] = summary["fp32"]["time"] / summary[args.precision]["time"]
+logging.info("Precision validation over {} samples: {}".format(n_samples, summary))
+if args.output is not None:
+    with open(args.output, "w") as f:
+        json.dump({"summary": summary, "samples": report}, f, indent=2)